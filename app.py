@@ -98,12 +98,15 @@ for i in range(0, 2):  # number of queues to spin up
     )
 failed_queue = Queue("failed", connection=redis_rq_conn)
 
-# aws s3 connection
-s3_conn = boto.connect_s3(
-    os.getenv("AWS_ACCESS_KEY_ID"),
-    os.getenv("AWS_SECRET_ACCESS_KEY")
-)
-requests_cache_bucket = s3_conn.get_bucket('tng-requests-cache')
+# aws s3 connection, for the page cache.  optional, so things run without aws.
+s3_conn = None
+requests_cache_bucket = None
+if os.getenv("AWS_ACCESS_KEY_ID"):
+    s3_conn = boto.connect_s3(
+        os.getenv("AWS_ACCESS_KEY_ID"),
+        os.getenv("AWS_SECRET_ACCESS_KEY")
+    )
+    requests_cache_bucket = s3_conn.get_bucket('tng-requests-cache')
 
 # imports got here for tables that need auto-created.
 # import publication
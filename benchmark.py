@@ -0,0 +1,254 @@
+import argparse
+import os
+from time import time
+from time import clock
+
+from app import logger
+from oa_local import license_lookups
+from oa_local import find_normalized_license
+from webpage import ParsedPage
+from webpage import get_pdf_in_meta
+from webpage import get_useful_links
+from webpage import find_doc_download_link
+from webpage import get_pdf_from_javascript
+from webpage import has_bad_href_word
+from webpage import has_bad_anchor_word
+from webpage import DuckLink
+from util import get_tree
+from webpage import StreamingPageScanner
+from http_cache import BODY_CHUNK_BYTES
+
+# benchmarks for the per-page scraping code, run over a folder of saved landing pages.
+# save pages with something like
+# curl -L -o pages/1.html https://doi.org/10.1038/srep29901
+#
+# usage:
+# python benchmark.py license pages/ --repeat=5
+# python benchmark.py parsing pages/
+# python benchmark.py scanning pages/
+
+
+def read_pages(dir_name):
+    pages = []
+    for filename in sorted(os.listdir(dir_name)):
+        path = os.path.join(dir_name, filename)
+        if os.path.isfile(path):
+            with open(path, "rb") as fh:
+                pages.append((filename, fh.read()))
+    return pages
+
+
+# how find_normalized_license worked before the compiled matchers.  here for comparison.
+def find_normalized_license_sequential(text):
+    if not text:
+        return None
+
+    normalized_text = text.replace(" ", "").replace("-", "").lower()
+    for (lookup, license) in license_lookups:
+        if lookup in normalized_text:
+            if license=="pd":
+                try:
+                    if u"worksnotinthepublicdomain" in normalized_text:
+                        return None
+                except:
+                    return None
+            return license
+    return None
+
+
+def time_per_page(fn, pages, repeat):
+    timings = []
+    results = []
+    for (filename, page) in pages:
+        start = time()
+        for i in range(repeat):
+            result = fn(page)
+        timings.append((time() - start) / repeat)
+        results.append(result)
+    return (timings, results)
+
+
+def report(name, pages, timings):
+    total_bytes = sum([len(page) for (filename, page) in pages])
+    total_seconds = sum(timings)
+    logger.info(u"{}: {} pages, {} MB, {} ms/page average, {} ms/page max, {} MB/s".format(
+        name,
+        len(pages),
+        round(total_bytes / 1000000.0, 2),
+        round(1000 * total_seconds / len(pages), 3),
+        round(1000 * max(timings), 3),
+        round((total_bytes / 1000000.0) / total_seconds, 1) if total_seconds else None
+    ))
+
+
+def benchmark_license(dir_name, repeat=3):
+    pages = read_pages(dir_name)
+    if not pages:
+        logger.info(u"no pages found in {}".format(dir_name))
+        return
+
+    (old_timings, old_results) = time_per_page(find_normalized_license_sequential, pages, repeat)
+    (new_timings, new_results) = time_per_page(find_normalized_license, pages, repeat)
+
+    for ((filename, page), old_result, new_result) in zip(pages, old_results, new_results):
+        if old_result != new_result:
+            logger.info(u"MISMATCH on {}: sequential says {}, compiled matchers say {}".format(filename, old_result, new_result))
+
+    report(u"sequential substring lookups", pages, old_timings)
+    report(u"prefix-indexed compiled matchers", pages, new_timings)
+
+
+# how the page heuristics worked before ParsedPage, each calling util.get_tree on the
+# raw page itself.  copied from webpage.py, here for comparison.
+def count_get_tree(page, counter):
+    counter[0] += 1
+    return get_tree(page)
+
+
+def get_pdf_in_meta_parsing_each_time(page, counter):
+    if "citation_pdf_url" in page:
+        tree = count_get_tree(page, counter)
+        if tree is not None:
+            for meta in tree.xpath("//meta"):
+                if meta.attrib.get("name", None) == "citation_pdf_url" and "content" in meta.attrib:
+                    return DuckLink(href=meta.attrib["content"], anchor="<meta citation_pdf_url>")
+    return None
+
+
+def get_useful_links_parsing_each_time(page, counter):
+    links = []
+    tree = count_get_tree(page, counter)
+    if tree is None:
+        return []
+
+    for section_finder in ["//div[@class=\'relatedItem\']", "//div[@class=\'citedBySection\']"]:
+        for bad_section in tree.xpath(section_finder):
+            bad_section.clear()
+
+    for link in tree.xpath("//a"):
+        link_text = link.text_content().strip().lower()
+        if link_text:
+            link.anchor = link_text
+            if "href" in link.attrib:
+                link.href = link.attrib["href"]
+        else:
+            link_content_elements = [l for l in link]
+            if len(link_content_elements)==1:
+                link_insides = link_content_elements[0]
+                if link_insides.tag=="img":
+                    if "src" in link_insides.attrib and "pdf" in link_insides.attrib["src"]:
+                        link.anchor = u"image: {}".format(link_insides.attrib["src"])
+                        if "href" in link.attrib:
+                            link.href = link.attrib["href"]
+
+        if hasattr(link, "anchor") and hasattr(link, "href"):
+            links.append(link)
+    return links
+
+
+def find_doc_download_link_parsing_each_time(page, counter):
+    for link in get_useful_links_parsing_each_time(page, counter):
+        if has_bad_href_word(link.href) or has_bad_anchor_word(link.anchor):
+            continue
+        if ".doc" in link.href or ".doc" in link.anchor:
+            return link
+    return None
+
+
+def run_heuristics_parsing_each_time(page):
+    counter = [0]
+    find_normalized_license(page)
+    get_pdf_in_meta_parsing_each_time(page, counter)
+    get_useful_links_parsing_each_time(page, counter)
+    find_doc_download_link_parsing_each_time(page, counter)
+    return counter[0]
+
+
+def run_heuristics_on_parsed_page(page):
+    parsed_page = ParsedPage(page)
+    find_normalized_license(page)
+    get_pdf_in_meta(parsed_page)
+    get_useful_links(parsed_page)
+    find_doc_download_link(parsed_page)
+    return parsed_page.num_parses
+
+
+def cpu_per_page(fn, pages, repeat):
+    timings = []
+    num_parses = 0
+    for (filename, page) in pages:
+        start = clock()
+        for i in range(repeat):
+            num_parses += fn(page)
+        timings.append((clock() - start) / repeat)
+    return (timings, num_parses / float(repeat * len(pages)))
+
+
+def benchmark_parsing(dir_name, repeat=3):
+    pages = read_pages(dir_name)
+    if not pages:
+        logger.info(u"no pages found in {}".format(dir_name))
+        return
+
+    (old_timings, old_parses) = cpu_per_page(run_heuristics_parsing_each_time, pages, repeat)
+    (new_timings, new_parses) = cpu_per_page(run_heuristics_on_parsed_page, pages, repeat)
+
+    report(u"parsing for each heuristic", pages, old_timings)
+    logger.info(u"parsing for each heuristic: {} parses/page".format(round(old_parses, 2)))
+    report(u"one shared ParsedPage", pages, new_timings)
+    logger.info(u"one shared ParsedPage: {} parses/page".format(round(new_parses, 2)))
+
+
+# finding the meta or javascript pdf link by parsing the whole page
+def find_early_link_in_whole_page(page):
+    parsed_page = ParsedPage(page)
+    get_pdf_in_meta(parsed_page)
+    get_pdf_from_javascript(page)
+    return len(page)
+
+
+# finding it while the page comes in, BODY_CHUNK_BYTES at a time
+def find_early_link_while_streaming(page):
+    scanner = StreamingPageScanner()
+    for start in range(0, len(page), BODY_CHUNK_BYTES):
+        if scanner.feed(page[start:start + BODY_CHUNK_BYTES]):
+            break
+    return scanner.num_bytes
+
+
+def benchmark_scanning(dir_name, repeat=3):
+    pages = read_pages(dir_name)
+    if not pages:
+        logger.info(u"no pages found in {}".format(dir_name))
+        return
+
+    for (name, fn) in [(u"parsing the whole page", find_early_link_in_whole_page),
+                       (u"streaming scanner", find_early_link_while_streaming)]:
+        timings = []
+        bytes_read = 0
+        for (filename, page) in pages:
+            start = clock()
+            for i in range(repeat):
+                num_bytes = fn(page)
+            timings.append((clock() - start) / repeat)
+            bytes_read += num_bytes
+        report(name, pages, timings)
+        logger.info(u"{}: read {} MB of the pages".format(name, round(bytes_read / 1000000.0, 2)))
+
+
+benchmarks = {
+    "license": benchmark_license,
+    "parsing": benchmark_parsing,
+    "scanning": benchmark_scanning
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run benchmarks.")
+    parser.add_argument('benchmark', type=str, help="which benchmark: {}".format(", ".join(sorted(benchmarks.keys()))))
+    parser.add_argument('dir_name', type=str, help="folder of saved html pages")
+    parser.add_argument('--repeat', nargs="?", type=int, default=3, help="times to run each page")
+    parsed = parser.parse_args()
+
+    logger.info(u"running benchmark {} with these args: {}".format(parsed.benchmark, vars(parsed)))
+    benchmarks[parsed.benchmark](parsed.dir_name, repeat=parsed.repeat)
@@ -0,0 +1,165 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from urlparse import urlparse
+
+import requests
+
+from app import logger
+
+# stops us paying timeouts over and over to hosts that are down or refusing us.
+# after CIRCUIT_FAILURE_THRESHOLD connection errors or timeouts from one host within
+# CIRCUIT_WINDOW_SECONDS, its circuit opens and requests to it fail straight away
+# with CircuitOpenError for CIRCUIT_COOLDOWN_SECONDS.
+# after that one request is let through as a trial: if it works the circuit closes,
+# if not it opens again for twice as long.
+#
+# CircuitOpenError is a ConnectionError, so the scrapers record it in error like any other.
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", 60*5))
+CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_COOLDOWN_SECONDS", 60*10))
+CIRCUIT_MAX_COOLDOWN_SECONDS = 60*60*6
+CIRCUIT_MAX_HOSTS = 10000
+# if a trial request never reports back, let another one through after this long
+CIRCUIT_TRIAL_SECONDS = 60*5
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+
+class HostCircuit(object):
+    def __init__(self):
+        self.failure_times = []
+        self.open_until = None
+        self.cooldown = CIRCUIT_COOLDOWN_SECONDS
+        self.trial_in_flight = False
+        self.trial_started = None
+        self.times_opened = 0
+        self.skipped = 0
+
+
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, window_seconds=CIRCUIT_WINDOW_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.window_seconds = window_seconds
+        self.circuits = OrderedDict()
+        self.lock = Lock()
+
+    def get_circuit(self, host, create=True):
+        circuit = self.circuits.pop(host, None)
+        if not circuit:
+            if not create:
+                return None
+            circuit = HostCircuit()
+        self.circuits[host] = circuit
+        while len(self.circuits) > CIRCUIT_MAX_HOSTS:
+            self.circuits.popitem(last=False)
+        return circuit
+
+    # raises CircuitOpenError if we shouldn't try this url's host right now
+    def check(self, url, request=None):
+        host = get_host(url)
+        if not host:
+            return
+        with self.lock:
+            circuit = self.circuits.get(host, None)
+            if not circuit or not circuit.open_until:
+                return
+            now = time()
+            trial_is_stuck = circuit.trial_in_flight and now - circuit.trial_started > CIRCUIT_TRIAL_SECONDS
+            if now >= circuit.open_until and (trial_is_stuck or not circuit.trial_in_flight):
+                # cooled down, let one through to see if it's back
+                circuit.trial_in_flight = True
+                circuit.trial_started = now
+                return
+            circuit.skipped += 1
+            open_until = circuit.open_until
+        raise CircuitOpenError(
+            u"circuit open for {}, not trying it again for {} seconds".format(host, int(max(0, open_until - time()))),
+            request=request)
+
+    # the request check() let through as a trial didn't get sent after all
+    def release_trial(self, url):
+        host = get_host(url)
+        if not host:
+            return
+        with self.lock:
+            circuit = self.circuits.get(host, None)
+            if circuit:
+                circuit.trial_in_flight = False
+
+    def record_success(self, url):
+        host = get_host(url)
+        if not host:
+            return
+        with self.lock:
+            circuit = self.circuits.get(host, None)
+            if not circuit:
+                return
+            if circuit.open_until:
+                logger.info(u"{} is working again, closing its circuit".format(host))
+            circuit.failure_times = []
+            circuit.open_until = None
+            circuit.trial_in_flight = False
+            circuit.cooldown = CIRCUIT_COOLDOWN_SECONDS
+
+    def record_failure(self, url):
+        host = get_host(url)
+        if not host:
+            return
+        now = time()
+        with self.lock:
+            circuit = self.get_circuit(host)
+            if circuit.trial_in_flight:
+                # the trial request failed too
+                circuit.trial_in_flight = False
+                circuit.cooldown = min(CIRCUIT_MAX_COOLDOWN_SECONDS, circuit.cooldown * 2)
+                self.open_circuit(host, circuit, now)
+                return
+
+            circuit.failure_times = [t for t in circuit.failure_times if t > now - self.window_seconds]
+            circuit.failure_times.append(now)
+            if len(circuit.failure_times) >= self.failure_threshold and not circuit.open_until:
+                self.open_circuit(host, circuit, now)
+
+    def open_circuit(self, host, circuit, now):
+        circuit.open_until = now + circuit.cooldown
+        circuit.failure_times = []
+        circuit.times_opened += 1
+        logger.info(u"too many connection errors from {}, opening its circuit for {} seconds".format(
+            host, int(circuit.cooldown)))
+
+    def stats(self):
+        now = time()
+        with self.lock:
+            open_hosts = []
+            for (host, circuit) in self.circuits.iteritems():
+                if circuit.open_until:
+                    open_hosts.append({
+                        "host": host,
+                        "seconds_left": int(max(0, circuit.open_until - now)),
+                        "times_opened": circuit.times_opened,
+                        "skipped": circuit.skipped
+                    })
+            num_hosts = len(self.circuits)
+        open_hosts.sort(key=lambda row: row["skipped"], reverse=True)
+        return {
+            "hosts_tracked": num_hosts,
+            "open": open_hosts[:100]
+        }
+
+
+def get_host(url):
+    try:
+        host = urlparse(url).hostname
+    except ValueError:
+        return None
+    if host:
+        return host.lower()
+    return None
+
+
+circuit_breaker = CircuitBreaker()
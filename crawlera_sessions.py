@@ -0,0 +1,196 @@
+import os
+import requests
+from collections import OrderedDict
+from threading import Event
+from threading import Lock
+from threading import Thread
+from time import sleep
+
+from app import logger
+
+# a pool of crawlera sessions, so scraping a doi doesn't have to wait for crawlera
+# to hand out a new session first.
+# a background thread keeps CRAWLERA_POOL_SIZE sessions ready.  each session is
+# handed out round-robin, and retired after CRAWLERA_SESSION_MAX_USES requests sent
+# through it (counted in http_cache's DelayedAdapter, redirect hops included) or as soon
+# as crawlera says it's been banned.  a pub holding a used-up session gets a new one
+# before its next request.
+#
+# if crawlera won't hand out a session after CRAWLERA_SESSION_TRIES tries, we go
+# without one, and crawlera picks a different outgoing ip for each request.
+#
+# CRAWLERA_HOST can point at fake_crawlera.py for testing.
+
+CRAWLERA_HOST = os.getenv("CRAWLERA_HOST", "impactstory.crawlera.com:8010")
+CRAWLERA_POOL_SIZE = int(os.getenv("CRAWLERA_POOL_SIZE", 10))
+CRAWLERA_SESSION_MAX_USES = int(os.getenv("CRAWLERA_SESSION_MAX_USES", 50))
+CRAWLERA_REFILL_SECONDS = 30
+CRAWLERA_SESSION_TRIES = int(os.getenv("CRAWLERA_SESSION_TRIES", 5))
+# how many used-up session ids to remember, so pubs still holding one can be moved off it
+CRAWLERA_MAX_USED_UP = 10000
+
+# the X-Crawlera-Error values that mean the session itself is no good any more.
+# the target site's own 429s and 503s come back without this header.
+crawlera_session_errors = set(["banned", "slavebanned", "bad_session_id", "noslaves"])
+
+
+def get_crawlera_proxy_url():
+    return 'http://{}:DUMMY@{}'.format(os.getenv("CRAWLERA_KEY"), CRAWLERA_HOST)
+
+
+# asks crawlera for a new session.  None if it still hasn't given us one after tries tries.
+def fetch_crawlera_session_id(tries=CRAWLERA_SESSION_TRIES):
+    crawlera_session_id = None
+    for try_number in range(tries):
+        crawlera_username = os.getenv("CRAWLERA_KEY")
+        try:
+            r = requests.post("http://{}/sessions".format(CRAWLERA_HOST), auth=(crawlera_username, 'DUMMY'), timeout=30)
+            if r.status_code == 200:
+                crawlera_session_id = r.headers["X-Crawlera-Session"]
+        except (requests.exceptions.RequestException, KeyError) as e:
+            logger.info(u"couldn't get a crawlera session: {}".format(e))
+        if crawlera_session_id:
+            return crawlera_session_id
+        # bad call.  sleep and try again.
+        sleep(1)
+    logger.info(u"crawlera didn't give us a session after {} tries".format(tries))
+    return None
+
+
+# crawlera marks responses where the session was the problem
+def is_crawlera_ban(r):
+    return r.headers.get("X-Crawlera-Error", None) in crawlera_session_errors
+
+
+class CrawleraSessionPool(object):
+    def __init__(self, size=CRAWLERA_POOL_SIZE, max_uses=CRAWLERA_SESSION_MAX_USES):
+        self.size = size
+        self.max_uses = max_uses
+        self.sessions = []
+        self.uses = {}
+        self.used_up = OrderedDict()
+        self.next_index = 0
+        self.lock = Lock()
+        self.wake_up = Event()
+        self.thread = None
+        self.pid = None
+        self.counts = {
+            "fetched": 0,
+            "handed_out": 0,
+            "requests": 0,
+            "retired_for_uses": 0,
+            "retired_for_bans": 0,
+            "waited_for_one": 0,
+            "went_without": 0
+        }
+
+    # threads don't survive a fork, so start the refill thread on first use in each process
+    def ensure_started(self):
+        if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+                return
+            if self.pid != os.getpid():
+                self.sessions = []
+                self.uses = {}
+                self.used_up = OrderedDict()
+            self.pid = os.getpid()
+            self.thread = Thread(target=self.refill_forever, name="crawlera_sessions")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def refill_forever(self):
+        while True:
+            self.refill()
+            self.wake_up.wait(CRAWLERA_REFILL_SECONDS)
+            self.wake_up.clear()
+
+    def refill(self):
+        while True:
+            with self.lock:
+                if len(self.sessions) >= self.size:
+                    return
+            session_id = fetch_crawlera_session_id()
+            if not session_id:
+                # try again next time round
+                return
+            self.add(session_id)
+
+    def add(self, session_id):
+        with self.lock:
+            if session_id not in self.uses:
+                self.sessions.append(session_id)
+                self.uses[session_id] = 0
+                self.counts["fetched"] += 1
+
+    def retire(self, session_id, reason):
+        with self.lock:
+            if session_id in self.uses:
+                self.sessions.remove(session_id)
+                del self.uses[session_id]
+                self.counts[reason] += 1
+        self.wake_up.set()
+
+    def get_session_id(self):
+        self.ensure_started()
+        with self.lock:
+            session_id = self.take()
+        if not session_id:
+            # the pool's empty, so do what we used to and wait for a new one
+            new_session_id = fetch_crawlera_session_id()
+            if not new_session_id:
+                with self.lock:
+                    self.counts["went_without"] += 1
+                return None
+            self.add(new_session_id)
+            with self.lock:
+                self.counts["waited_for_one"] += 1
+                session_id = self.take() or new_session_id
+        return session_id
+
+    # call with the lock held
+    def take(self):
+        if not self.sessions:
+            return None
+        self.next_index = self.next_index % len(self.sessions)
+        session_id = self.sessions[self.next_index]
+        self.next_index += 1
+        self.counts["handed_out"] += 1
+        return session_id
+
+    # counts a request sent through the session, and retires it once it's had max_uses
+    def record_use(self, session_id):
+        with self.lock:
+            if session_id not in self.uses:
+                # retired already, or not one of ours
+                return
+            self.uses[session_id] += 1
+            self.counts["requests"] += 1
+            if self.uses[session_id] < self.max_uses:
+                return
+            self.sessions.remove(session_id)
+            del self.uses[session_id]
+            self.used_up[session_id] = True
+            while len(self.used_up) > CRAWLERA_MAX_USED_UP:
+                self.used_up.popitem(last=False)
+            self.counts["retired_for_uses"] += 1
+        self.wake_up.set()
+
+    def is_used_up(self, session_id):
+        with self.lock:
+            return session_id in self.used_up
+
+    def report_ban(self, session_id):
+        if session_id:
+            logger.info(u"crawlera session {} looks banned, retiring it".format(session_id))
+            self.retire(session_id, "retired_for_bans")
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats["ready"] = len(self.sessions)
+        return stats
+
+
+crawlera_session_pool = CrawleraSessionPool()
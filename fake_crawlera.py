@@ -0,0 +1,78 @@
+import argparse
+import random
+import BaseHTTPServer
+import SocketServer
+from threading import Lock
+
+import requests
+
+from app import logger
+
+# a stand-in for crawlera, for trying the session pool without using up real sessions.
+# POST /sessions hands out a new session id, and plain http GETs sent through it as a
+# proxy are fetched directly and passed back.
+#   python fake_crawlera.py --port 8010 --ban-every 20
+#   CRAWLERA_HOST=localhost:8010 CRAWLERA_KEY=fake python update.py ...
+# https urls need CONNECT, which this doesn't do.
+
+lock = Lock()
+counts = {"sessions": 0, "requests": 0}
+ban_every = 0
+
+
+class FakeCrawleraHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.rstrip("/") != "/sessions":
+            self.send_error(404)
+            return
+        with lock:
+            counts["sessions"] += 1
+        self.send_response(200)
+        self.send_header("X-Crawlera-Session", str(random.randint(1, 2**31)))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        with lock:
+            counts["requests"] += 1
+            request_number = counts["requests"]
+
+        session_id = self.headers.get("X-Crawlera-Session", None)
+        if ban_every and request_number % ban_every == 0:
+            self.send_response(503)
+            self.send_header("X-Crawlera-Error", "banned")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        try:
+            r = requests.get(self.path, headers={"User-Agent": self.headers.get("User-Agent", "")}, timeout=30)
+        except requests.exceptions.RequestException as e:
+            self.send_error(502, str(e))
+            return
+
+        self.send_response(r.status_code)
+        for name in ["Content-Type", "Content-Disposition", "Location"]:
+            if name in r.headers:
+                self.send_header(name, r.headers[name])
+        if session_id:
+            self.send_header("X-Crawlera-Session", session_id)
+        self.send_header("Content-Length", str(len(r.content)))
+        self.end_headers()
+        self.wfile.write(r.content)
+
+
+class FakeCrawleraServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake crawlera proxy.")
+    parser.add_argument('--port', type=int, default=8010, help="port to listen on")
+    parser.add_argument('--ban-every', type=int, default=0, help="answer every nth proxied request with a ban")
+    parsed_args = parser.parse_args()
+
+    ban_every = parsed_args.ban_every
+    server = FakeCrawleraServer(("localhost", parsed_args.port), FakeCrawleraHandler)
+    logger.info(u"fake crawlera listening on localhost:{}".format(parsed_args.port))
+    server.serve_forever()
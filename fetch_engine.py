@@ -0,0 +1,254 @@
+import os
+from Queue import Queue
+from threading import Event
+from threading import Lock
+from threading import Thread
+from threading import local
+from time import time
+
+import requests
+
+from app import logger
+
+# runs scraping work on a fixed pool of worker threads with a global cap on
+# how much is in flight at once, instead of a new thread per call.
+#
+# each task can have a deadline: if it hasn't started by then it's skipped,
+# and callers stop waiting for it then.  while it runs, the deadline is kept for its
+# thread, and http_cache checks it before every request and cuts the request's timeouts
+# down to what's left, so a task past its deadline stops at its next request.
+# (a thread can't be killed, so a task that isn't making requests runs on.)
+# tasks submitted while one is running get its deadline if theirs is later.
+# a task can also be cancelled, which skips it if it hasn't started yet.
+#
+# work submitted from inside a worker thread goes to a nested pool of its own,
+# FETCH_NESTED_CONCURRENCY threads, so nested parallel calls (pages of a base record,
+# pdf links of a page) still run in parallel, but can't deadlock waiting on a pool
+# they're already using up.  past FETCH_MAX_NESTING pools deep, it runs inline.
+
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", 50))
+FETCH_NESTED_CONCURRENCY = int(os.getenv("FETCH_NESTED_CONCURRENCY", 50))
+FETCH_MAX_NESTING = int(os.getenv("FETCH_MAX_NESTING", 3))
+FETCH_DEADLINE_SECONDS = float(os.getenv("FETCH_DEADLINE_SECONDS", 60*10))
+# the most fetch_engine threads there can be, counting its nested pools
+FETCH_MAX_THREADS = FETCH_CONCURRENCY + FETCH_NESTED_CONCURRENCY * (FETCH_MAX_NESTING - 1)
+
+
+# a Timeout, so scrapers that already give up on timeouts give up on this too
+class DeadlineExceeded(requests.exceptions.Timeout):
+    pass
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+# the deadline of the task running in this thread, if there is one
+running_task = local()
+
+
+def get_task_deadline():
+    return getattr(running_task, "deadline", None)
+
+
+# seconds until this thread's task is due, or None if it doesn't have a deadline
+def seconds_until_deadline():
+    deadline = get_task_deadline()
+    if deadline is None:
+        return None
+    return deadline - time()
+
+
+def check_deadline():
+    remaining = seconds_until_deadline()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded(u"task ran past its deadline")
+
+
+def earliest_deadline(deadline, other_deadline):
+    if deadline is None:
+        return other_deadline
+    if other_deadline is None:
+        return deadline
+    return min(deadline, other_deadline)
+
+
+class FetchTask(object):
+    def __init__(self, fn, args, kwargs, deadline):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.deadline = deadline
+        self.done = Event()
+        self.cancelled = False
+        self.started = False
+        self.result = None
+        self.error = None
+
+    # if it hasn't started yet it won't
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        # when run inline, the task that was running in this thread gets its deadline back after
+        outer_deadline = get_task_deadline()
+        try:
+            if self.cancelled:
+                raise TaskCancelled(u"cancelled before it started")
+            if self.deadline and time() > self.deadline:
+                raise DeadlineExceeded(u"didn't start before its deadline")
+            self.started = True
+            running_task.deadline = self.deadline
+            self.result = self.fn(*self.args, **self.kwargs)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            running_task.deadline = outer_deadline
+            self.done.set()
+
+    def wait(self):
+        if self.deadline:
+            timeout = max(0, self.deadline - time())
+            finished = self.done.wait(timeout)
+        else:
+            finished = self.done.wait()
+        if not finished:
+            self.error = DeadlineExceeded(u"didn't finish before its deadline")
+        return finished
+
+
+class FetchEngine(object):
+    def __init__(self, concurrency=FETCH_CONCURRENCY, name="fetch_engine",
+                 nested_concurrency=FETCH_NESTED_CONCURRENCY, max_nesting=FETCH_MAX_NESTING,
+                 depth=0, in_worker=None):
+        self.concurrency = concurrency
+        self.name = name
+        self.nested_concurrency = nested_concurrency
+        self.max_nesting = max_nesting
+        self.depth = depth
+        self.nested_engine = None
+        self.lock = Lock()
+        self.queue = None
+        self.threads = []
+        self.pid = None
+        # shared with the nested pools: which of them, if any, this thread works for
+        self.in_worker = in_worker or local()
+        self.counts = {
+            "submitted": 0,
+            "finished": 0,
+            "errors": 0,
+            "skipped_past_deadline": 0,
+            "cancelled": 0,
+            "deadlines_exceeded": 0,
+            "ran_inline": 0
+        }
+        self.running = 0
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+    # threads don't survive a fork, so start the pool on first use in each process
+    def ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = Queue()
+            self.threads = []
+            for i in range(self.concurrency):
+                thread = Thread(target=self.work, name="{}_{}".format(self.name, i))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+            self.pid = os.getpid()
+
+    def work(self):
+        self.in_worker.depth = self.depth
+        queue = self.queue
+        while True:
+            task = queue.get()
+            with self.lock:
+                self.running += 1
+            try:
+                self.run_task(task)
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+    def run_task(self, task):
+        task.run()
+        self.count("finished")
+        if isinstance(task.error, DeadlineExceeded) and not task.started:
+            self.count("skipped_past_deadline")
+        elif isinstance(task.error, TaskCancelled):
+            self.count("cancelled")
+        elif task.error:
+            self.count("errors")
+
+    def submit(self, fn, args=None, kwargs=None, deadline_seconds=FETCH_DEADLINE_SECONDS):
+        deadline = None
+        if deadline_seconds:
+            deadline = time() + deadline_seconds
+        deadline = earliest_deadline(deadline, get_task_deadline())
+        task = FetchTask(fn, args or [], kwargs or {}, deadline)
+
+        engine = self.get_engine_for_this_thread()
+        if engine:
+            engine.count("submitted")
+            engine.ensure_started()
+            engine.queue.put(task)
+        else:
+            # already as many pools deep as we go, so it runs right here
+            self.count("ran_inline")
+            self.run_task(task)
+        return task
+
+    # work from outside goes to this pool, and work from one of its threads to the
+    # pool one deeper, so a task never waits on the pool it's using up.
+    # None when there's no deeper pool and it should run inline.
+    def get_engine_for_this_thread(self):
+        thread_depth = getattr(self.in_worker, "depth", None)
+        engine = self
+        while engine and thread_depth is not None and engine.depth <= thread_depth:
+            engine = engine.get_nested_engine()
+        return engine
+
+    def get_nested_engine(self):
+        if self.depth + 1 >= self.max_nesting:
+            return None
+        if not self.nested_engine:
+            with self.lock:
+                if not self.nested_engine:
+                    self.nested_engine = FetchEngine(concurrency=self.nested_concurrency,
+                                                     name=u"{}_nested".format(self.name),
+                                                     nested_concurrency=self.nested_concurrency,
+                                                     max_nesting=self.max_nesting,
+                                                     depth=self.depth + 1,
+                                                     in_worker=self.in_worker)
+        return self.nested_engine
+
+    # the sync facade.  runs fn(*args) for each args in args_list and
+    # returns the FetchTasks in the same order, once they're all done or past their deadline.
+    def map(self, fn, args_list, deadline_seconds=FETCH_DEADLINE_SECONDS):
+        tasks = [self.submit(fn, args, deadline_seconds=deadline_seconds) for args in args_list]
+        for task in tasks:
+            if not task.wait():
+                self.count("deadlines_exceeded")
+        return tasks
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats["running"] = self.running
+        stats["concurrency"] = self.concurrency
+        stats["queued"] = self.queue.qsize() if self.queue else 0
+        if self.nested_engine:
+            stats["nested"] = self.nested_engine.stats()
+        return stats
+
+
+fetch_engine = FetchEngine()
@@ -0,0 +1,225 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import sleep
+from time import time
+from urlparse import urlparse
+
+import requests
+
+from app import logger
+from fetch_engine import FETCH_MAX_THREADS
+
+# keeps us polite to each publisher and repository.
+# every outbound request waits its turn in a token bucket for its registered domain
+# (so www.sciencedirect.com and pdf.sciencedirectassets.com are separate,
+# but all the *.elsevier.com hosts share a bucket).
+# a 429 or 503 halves that domain's rate and honours Retry-After; successes slowly
+# bring the rate back up.  once the block is over, waiters go one at a time at the new rate.
+# a request that would have to wait more than HOST_MAX_WAIT_SECONDS fails with HostBusyError
+# instead, which is a ConnectionError like CircuitOpenError.  by default that's long enough
+# for every fetch_engine thread to line up on one host at the default rate and get its turn,
+# so only hosts that have slowed us down turn requests away.
+#
+# urllib3 retries happen inside the adapter, so they don't wait in the bucket.
+#
+# HOST_RATE_OVERRIDES sets per-domain requests per second, like "doi.org=20,crossref.org=10"
+
+HOST_RATE_PER_SECOND = float(os.getenv("HOST_RATE_PER_SECOND", 2))
+HOST_BURST = float(os.getenv("HOST_BURST", 5))
+HOST_MIN_RATE_PER_SECOND = 0.05
+HOST_MAX_BACKOFF_SECONDS = float(os.getenv("HOST_MAX_BACKOFF_SECONDS", 60))
+HOST_MAX_WAIT_SECONDS = float(os.getenv("HOST_MAX_WAIT_SECONDS", max(60, FETCH_MAX_THREADS / HOST_RATE_PER_SECOND)))
+HOST_MAX_BUCKETS = 10000
+
+default_rate_overrides = {
+    "doi.org": 20,
+    "crossref.org": 10
+}
+
+# second-level domains where the registered domain is three labels, not two
+two_part_suffixes = set([
+    "ac.uk", "co.uk", "org.uk", "gov.uk", "nhs.uk",
+    "ac.jp", "co.jp", "or.jp", "go.jp",
+    "com.au", "edu.au", "org.au", "gov.au",
+    "com.br", "org.br", "gov.br", "edu.br", "usp.br",
+    "ac.nz", "co.nz", "ac.za", "co.za", "ac.in", "co.in", "res.in", "ernet.in",
+    "com.cn", "edu.cn", "ac.cn", "org.cn",
+    "ac.kr", "or.kr", "re.kr", "co.kr",
+    "edu.tw", "org.tw", "com.tw", "edu.hk", "edu.sg", "edu.my", "ac.id",
+    "edu.mx", "unam.mx", "edu.ar", "edu.co", "edu.pl", "edu.tr", "gov.tr", "ac.ir", "ac.il", "ac.at"
+])
+
+
+class HostBusyError(requests.exceptions.ConnectionError):
+    pass
+
+
+def parse_rate_overrides(overrides_string):
+    overrides = dict(default_rate_overrides)
+    if overrides_string:
+        for override in overrides_string.split(","):
+            if "=" in override:
+                (domain, rate) = override.split("=", 1)
+                overrides[domain.strip().lower()] = float(rate)
+    return overrides
+
+
+def get_registered_domain(url):
+    try:
+        host = urlparse(url).hostname
+    except ValueError:
+        host = None
+    if not host:
+        return None
+    host = host.lower()
+    labels = host.split(".")
+    if len(labels) <= 2 or host.replace(".", "").isdigit():
+        return host
+    if u".".join(labels[-2:]) in two_part_suffixes:
+        return u".".join(labels[-3:])
+    return u".".join(labels[-2:])
+
+
+class HostBucket(object):
+    def __init__(self, rate, burst):
+        self.base_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last_refill = time()
+        self.blocked_until = 0
+        self.blocks = 0
+        self.waiting = 0
+        self.turned_away = 0
+        self.requests = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    # takes a token now (letting the bucket go negative) and returns how long
+    # to sleep before using it, so waiters line up in the order they asked.
+    # returns None without taking one if that would be longer than max_wait.
+    def reserve(self, now, max_wait=None):
+        # while we're blocked last_refill is the end of the block, so nothing refills till then
+        if now > self.last_refill:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+        wait = (self.last_refill - now) + max(0, 1 - self.tokens) / self.rate
+        if max_wait is not None and wait > max_wait:
+            self.turned_away += 1
+            return None
+        self.tokens -= 1
+        self.requests += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    # no more requests till blocked_until, and then one at a time at the current rate.
+    # anyone already waiting gets back in line (see wait_for_turn).
+    def block(self, blocked_until):
+        if blocked_until <= self.blocked_until:
+            return
+        self.blocked_until = blocked_until
+        self.blocks += 1
+        self.tokens = 1
+        self.last_refill = blocked_until
+
+
+class HostScheduler(object):
+    def __init__(self, rate=HOST_RATE_PER_SECOND, burst=HOST_BURST, overrides=None):
+        self.rate = rate
+        self.burst = burst
+        self.overrides = overrides or {}
+        self.buckets = OrderedDict()
+        self.lock = Lock()
+
+    def get_bucket(self, domain):
+        bucket = self.buckets.pop(domain, None)
+        if not bucket:
+            rate = self.overrides.get(domain, self.rate)
+            bucket = HostBucket(rate, max(self.burst, rate))
+        self.buckets[domain] = bucket
+        while len(self.buckets) > HOST_MAX_BUCKETS:
+            self.buckets.popitem(last=False)
+        return bucket
+
+    def wait_for_turn(self, url, max_wait=HOST_MAX_WAIT_SECONDS):
+        domain = get_registered_domain(url)
+        if not domain:
+            return 0
+        total_wait = 0
+        while True:
+            with self.lock:
+                bucket = self.get_bucket(domain)
+                wait = bucket.reserve(time(), max_wait - total_wait)
+                if wait is None:
+                    raise HostBusyError(u"would have to wait more than {} seconds for a turn on {}".format(
+                        max_wait, domain))
+                blocks = bucket.blocks
+                if wait <= 0:
+                    return total_wait
+                bucket.waiting += 1
+            try:
+                sleep(wait)
+            finally:
+                with self.lock:
+                    bucket.waiting -= 1
+            total_wait += wait
+            with self.lock:
+                if bucket.blocks == blocks or bucket.blocked_until <= time():
+                    return total_wait
+            # the host pushed back while we slept, so our turn's gone.  get back in line.
+
+    def record_response(self, url, status_code, headers=None):
+        domain = get_registered_domain(url)
+        if not domain:
+            return
+        with self.lock:
+            bucket = self.get_bucket(domain)
+            if status_code in (429, 503):
+                bucket.throttled += 1
+                bucket.rate = max(HOST_MIN_RATE_PER_SECOND, bucket.rate / 2)
+                backoff = 1.0 / bucket.rate
+                retry_after = get_retry_after_seconds(headers)
+                if retry_after is not None:
+                    backoff = retry_after
+                backoff = min(backoff, HOST_MAX_BACKOFF_SECONDS)
+                bucket.block(time() + backoff)
+                logger.info(u"{} said {}, slowing {} down to {} requests/second for the next {} seconds".format(
+                    url, status_code, domain, round(bucket.rate, 2), round(backoff, 1)))
+            elif bucket.rate < bucket.base_rate:
+                bucket.rate = min(bucket.base_rate, bucket.rate * 1.1)
+
+    def stats(self, limit=50):
+        with self.lock:
+            rows = []
+            for (domain, bucket) in self.buckets.iteritems():
+                rows.append({
+                    "domain": domain,
+                    "requests": bucket.requests,
+                    "waiting": bucket.waiting,
+                    "throttled": bucket.throttled,
+                    "turned_away": bucket.turned_away,
+                    "rate": round(bucket.rate, 3),
+                    "total_wait_seconds": round(bucket.total_wait, 2),
+                    "max_wait_seconds": round(bucket.max_wait, 2)
+                })
+        rows.sort(key=lambda row: (row["total_wait_seconds"], row["requests"]), reverse=True)
+        return rows[:limit]
+
+
+def get_retry_after_seconds(headers):
+    if not headers:
+        return None
+    retry_after = headers.get("Retry-After", None)
+    if not retry_after:
+        return None
+    try:
+        return max(0, float(retry_after))
+    except ValueError:
+        # it can also be an http date, but we cap backoff anyway so just use the cap
+        return HOST_MAX_BACKOFF_SECONDS
+
+
+host_scheduler = HostScheduler(overrides=parse_rate_overrides(os.getenv("HOST_RATE_OVERRIDES", None)))
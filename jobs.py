@@ -18,6 +18,17 @@ from util import elapsed
 from util import chunks
 from util import safe_commit
 from util import run_sql
+from http_cache import get_connection_stats
+from host_scheduler import host_scheduler
+from fetch_engine import FetchEngine
+
+# how many objects in a chunk update_fn runs at once.  1 runs them one after another, as always.
+# with more, each object is loaded, run and committed in its worker thread's own session.
+# a task that runs past its deadline fails at its next http request, and update_fn stops waiting for it.
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 1))
+update_engine = None
+if UPDATE_CONCURRENCY > 1:
+    update_engine = FetchEngine(concurrency=UPDATE_CONCURRENCY, name="update_engine")
 
 
 def update_fn(cls, method, obj_id_list, shortcut_data=None, index=1):
@@ -31,7 +42,12 @@ def update_fn(cls, method, obj_id_list, shortcut_data=None, index=1):
 
     # logger(u"obj_id_list: {}".format(obj_id_list))
 
-    q = db.session.query(cls).options(orm.undefer('*')).filter(cls.id.in_(obj_id_list))
+    # in parallel, each worker loads its own object, so just get the ids here
+    run_in_parallel = update_engine and len(obj_id_list) > 1
+    if run_in_parallel:
+        q = db.session.query(cls.id).filter(cls.id.in_(obj_id_list))
+    else:
+        q = db.session.query(cls).options(orm.undefer('*')).filter(cls.id.in_(obj_id_list))
 
     obj_rows = q.all()
 
@@ -44,12 +60,9 @@ def update_fn(cls, method, obj_id_list, shortcut_data=None, index=1):
         elapsed=elapsed(start)
     ))
 
-    for count, obj in enumerate(obj_rows):
+    def run_method(count, obj):
         start_time = time()
 
-        if obj is None:
-            return None
-
         method_to_run = getattr(obj, method.__name__)
 
         logger.info(u"***")
@@ -70,6 +83,32 @@ def update_fn(cls, method, obj_id_list, shortcut_data=None, index=1):
             elapsed=elapsed(start_time, 4)
         ))
 
+    if run_in_parallel:
+        # db.session is per thread, so each worker loads its object in its own session,
+        # commits it and closes it.  no objects are shared between threads.
+        # their own parallel scrapes go to the shared fetch_engine pool.
+        def run_method_in_own_session(count, obj_id):
+            try:
+                obj = db.session.query(cls).options(orm.undefer('*')).get(obj_id)
+                if obj is None:
+                    return
+                run_method(count, obj)
+                if not safe_commit(db):
+                    logger.info(u"COMMIT fail on {}".format(obj_id))
+            finally:
+                db.session.remove()
+
+        args_list = [[count, row.id] for (count, row) in enumerate(obj_rows)]
+        for task in update_engine.map(run_method_in_own_session, args_list):
+            if task.error:
+                logger.info(u"{} in parallel {}.{}(), continuing".format(
+                    repr(task.error), cls.__name__, method.__name__))
+    else:
+        for count, obj in enumerate(obj_rows):
+            if obj is None:
+                return None
+            run_method(count, obj)
+
 
     logger.info(u"committing\n\n")
     start_time = time()
@@ -77,6 +116,8 @@ def update_fn(cls, method, obj_id_list, shortcut_data=None, index=1):
     if not commit_success:
         logger.info(u"COMMIT fail")
     logger.info(u"commit took {} seconds".format(elapsed(start_time, 2)))
+    logger.info(u"http connections so far in {}: {}".format(os.getpid(), get_connection_stats()))
+    logger.info(u"hosts we've waited on most so far in {}: {}".format(os.getpid(), host_scheduler.stats(limit=5)))
     db.session.remove()  # close connection nicely
     return None  # important for if we use this on RQ
 
@@ -0,0 +1,140 @@
+import atexit
+import json
+import os
+import requests
+from Queue import Queue
+from Queue import Empty
+from Queue import Full
+from threading import Lock
+from threading import Thread
+from time import time
+
+from app import logger
+
+# ships analytics events to loggly from a background thread, so the request
+# that made the event never waits on loggly.
+# events go on a bounded queue; if loggly falls behind and the queue fills up,
+# new events are dropped and counted rather than slowing down requests.
+# set LOG_SHIPPER_FILE to write events to a local file (one json object per line) instead,
+# which is handy for testing.
+# when the process exits, what's still queued is sent before the thread stops.
+
+LOGGLY_BULK_URL = "http://logs-01.loggly.com/bulk/6470410b-1d7f-4cb2-a625-72d8fa867d61/tag/{}/"
+LOG_SHIPPER_FILE = os.getenv("LOG_SHIPPER_FILE", None)
+LOG_SHIPPER_QUEUE_SIZE = int(os.getenv("LOG_SHIPPER_QUEUE_SIZE", 10000))
+LOG_SHIPPER_BATCH_SIZE = int(os.getenv("LOG_SHIPPER_BATCH_SIZE", 200))
+LOG_SHIPPER_FLUSH_SECONDS = float(os.getenv("LOG_SHIPPER_FLUSH_SECONDS", 5))
+
+
+class LogShipper(object):
+    def __init__(self, file_name=None, queue_size=10000, batch_size=200, flush_seconds=5):
+        self.file_name = file_name
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.lock = Lock()
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        self.counts = {
+            "queued": 0,
+            "dropped": 0,
+            "shipped": 0,
+            "failed": 0
+        }
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+    # gunicorn forks workers after import, and threads don't survive a fork,
+    # so start the worker thread on first use in each process
+    def ensure_started(self):
+        if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+                return
+            if self.pid != os.getpid():
+                self.queue = Queue(maxsize=self.queue_size)
+                atexit.register(self.stop)
+            self.pid = os.getpid()
+            self.thread = Thread(target=self.run, name="log_shipper")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def ship(self, tag, event):
+        self.ensure_started()
+        try:
+            self.queue.put_nowait((tag, event))
+            self.count("queued")
+        except Full:
+            self.count("dropped")
+
+    # sends what's queued and stops the thread.  a None on the queue tells it to stop.
+    def stop(self, timeout=10):
+        if self.pid != os.getpid() or not self.thread or not self.thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except Full:
+            return
+        self.thread.join(timeout)
+
+    def run(self):
+        queue = self.queue
+        stopping = False
+        while not stopping:
+            batch = []
+            flush_time = time() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                timeout = flush_time - time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = queue.get(timeout=timeout)
+                except Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self.send(batch)
+                    self.count("shipped", len(batch))
+                except Exception as e:
+                    logger.info(u"log shipper couldn't send {} events: {}".format(len(batch), e))
+                    self.count("failed", len(batch))
+
+    def send(self, batch):
+        if self.file_name:
+            with open(self.file_name, "a") as fh:
+                for (tag, event) in batch:
+                    fh.write(json.dumps({"tag": tag, "event": event}, sort_keys=True) + "\n")
+            return
+
+        # loggly's bulk endpoint takes one tag per post and newline-separated events
+        events_by_tag = {}
+        for (tag, event) in batch:
+            events_by_tag.setdefault(tag, []).append(json.dumps(event))
+        for (tag, events) in events_by_tag.iteritems():
+            r = requests.post(LOGGLY_BULK_URL.format(tag),
+                              headers={"content-type": "text/plain"},
+                              data="\n".join(events),
+                              timeout=10)
+            r.raise_for_status()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+        stats["queue_length"] = self.queue.qsize() if self.queue else 0
+        return stats
+
+
+log_shipper = LogShipper(
+    file_name=LOG_SHIPPER_FILE,
+    queue_size=LOG_SHIPPER_QUEUE_SIZE,
+    batch_size=LOG_SHIPPER_BATCH_SIZE,
+    flush_seconds=LOG_SHIPPER_FLUSH_SECONDS
+)
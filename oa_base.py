@@ -19,6 +19,7 @@ import shortuuid
 
 from app import db
 from app import logger
+from fetch_engine import fetch_engine
 from webpage import WebpageInOpenRepo
 from webpage import WebpageInUnknownRepo
 from webpage import WebpageInClosedRepo
@@ -200,14 +201,23 @@ class Base(db.Model, BaseResponseAddin):
         self.set_webpages()
         response_webpages = []
 
-        found_open_fulltext = False
-        for my_webpage in self.webpages:
-            if not found_open_fulltext:
-                my_webpage.scrape_for_fulltext_link()
-                if my_webpage.has_fulltext_url:
-                    logger.info(u"** found an open copy! {}".format(my_webpage.fulltext_url))
-                    found_open_fulltext = True
-                    response_webpages.append(my_webpage)
+        # scrape them all at once and keep the first one in order that's open.
+        # once we have it, the scrapes that haven't started yet are skipped.
+        # (when we're already one of many scrapes on fetch_engine, like find_fulltext_for_base_hits,
+        # these go to its nested pool.)
+        tasks = [fetch_engine.submit(lambda my_webpage: my_webpage.scrape_for_fulltext_link(), [my_webpage])
+                 for my_webpage in self.webpages]
+        for (my_webpage, task) in zip(self.webpages, tasks):
+            task.wait()
+            if task.error:
+                logger.info(u"Exception {} scraping {} in scrape_for_fulltext. continuing.".format(task.error, my_webpage))
+                continue
+            if my_webpage.has_fulltext_url:
+                logger.info(u"** found an open copy! {}".format(my_webpage.fulltext_url))
+                response_webpages.append(my_webpage)
+                break
+        for task in tasks:
+            task.cancel()
 
         self.open_webpages = response_webpages
         sys.exc_clear()  # someone on the internet said this would fix All The Memory Problems. has to be in the thread.
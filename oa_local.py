@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import csv
+import os
+import re
 import requests
 import json
 from time import time
@@ -71,13 +73,10 @@ def is_oa_license(license_url):
 def is_open_via_doaj_issn(issns, pub_year=None):
     if issns:
         for issn in issns:
-            for (row_issn, row_license, doaj_start_year) in doaj_issns:
-                if issn == row_issn:
-                    if doaj_start_year and pub_year and (doaj_start_year > pub_year):
-                        pass # journal wasn't open yet!
-                    else:
-                        # logger.info(u"open: doaj issn match!")
-                        return find_normalized_license(row_license)
+            license = doaj_lookup.license_for_issn(issn, pub_year)
+            if license is not False:
+                # logger.info(u"open: doaj issn match!")
+                return license
     return False
 
 def is_open_via_doaj_journal(all_journals, pub_year=None):
@@ -98,18 +97,16 @@ def is_open_via_doaj_journal(all_journals, pub_year=None):
 
             journals_to_skip = ["AMM"]
             if journal_name not in journals_to_skip:
-                for (row_journal_name, row_license, doaj_start_year) in doaj_titles:
-                    if journal_name_encoded.lower() == row_journal_name.lower():
-                        if doaj_start_year and pub_year and (doaj_start_year > pub_year):
-                            pass # journal wasn't open yet!
-                        else:
-                            # logger.info(u"open: doaj journal name match! {}".format(journal_name))
-                            return find_normalized_license(row_license)
+                license = doaj_lookup.license_for_title(journal_name_encoded, pub_year)
+                if license is not False:
+                    # logger.info(u"open: doaj journal name match! {}".format(journal_name))
+                    return license
     return False
 
 def is_open_via_datacite_prefix(doi):
-    if doi:
-        if any(doi.startswith(prefix) for prefix in get_datacite_doi_prefixes()):
+    if doi and u"/" in doi:
+        registrant = doi.split(u"/", 1)[0]
+        if registrant in datacite_doi_prefix_set:
             # logger.info(u"open: datacite match")
             return True
     return False
@@ -147,66 +144,155 @@ def is_open_via_url_fragment(url):
     return False
 
 
+# the lookup order matters
+# assumes no spaces, no dashes, and all lowercase
+# inspired by https://github.com/CottageLabs/blackbox/blob/fc13e5855bd13137cf1ef8f5e93883234fdab464/service/licences.py
+# thanks CottageLabs!  :)
+license_lookups = [
+    ("koreanjpathol.org/authors/access.php", "cc-by-nc"),  # their access page says it is all cc-by-nc now
+    ("elsevier.com/openaccess/userlicense", "elsevier-specific: oa user license"),  #remove the - because is removed in normalized_text above
+    ("pubs.acs.org/page/policy/authorchoice_termsofuse.html", "acs-specific: authorchoice/editors choice usage agreement"),
+
+    ("creativecommons.org/licenses/byncnd", "cc-by-nc-nd"),
+    ("creativecommonsattributionnoncommercialnoderiv", "cc-by-nc-nd"),
+    ("ccbyncnd", "cc-by-nc-nd"),
+
+    ("creativecommons.org/licenses/byncsa", "cc-by-nc-sa"),
+    ("creativecommonsattributionnoncommercialsharealike", "cc-by-nc-sa"),
+    ("ccbyncsa", "cc-by-nc-sa"),
+
+    ("creativecommons.org/licenses/bynd", "cc-by-nd"),
+    ("creativecommonsattributionnoderiv", "cc-by-nd"),
+    ("ccbynd", "cc-by-nd"),
+
+    ("creativecommons.org/licenses/bysa", "cc-by-sa"),
+    ("creativecommonsattributionsharealike", "cc-by-sa"),
+    ("ccbysa", "cc-by-sa"),
+
+    ("creativecommons.org/licenses/bync", "cc-by-nc"),
+    ("creativecommonsattributionnoncommercial", "cc-by-nc"),
+    ("ccbync", "cc-by-nc"),
+
+    ("creativecommons.org/licenses/by", "cc-by"),
+    ("creativecommonsattribution", "cc-by"),
+    ("ccby", "cc-by"),
+
+    ("creativecommons.org/publicdomain/zero", "cc0"),
+    ("creativecommonszero", "cc0"),
+
+    ("creativecommons.org/publicdomain/mark", "pd"),
+    ("publicdomain", "pd"),
+
+    # ("openaccess", "oa")
+]
+
+# every lookup starts with one of these, so we find them with fast substring searches
+# and only try the lookups at the places they occur.  anything that doesn't start
+# with one of them is its own prefix.
+license_lookup_prefixes = [
+    "creativecommons",
+    "ccby",
+    "publicdomain",
+    "koreanjpathol",
+    "elsevier.com",
+    "pubs.acs.org"
+]
+
+def build_license_matchers(lookups, prefixes):
+    lookups_by_prefix = {}
+    for (lookup, license) in lookups:
+        my_prefix = lookup
+        for prefix in prefixes:
+            if lookup.startswith(prefix):
+                my_prefix = prefix
+                break
+        lookups_by_prefix.setdefault(my_prefix, []).append(lookup)
+
+    # alternatives are in lookup order, so a match at a position is the best lookup starting there
+    matchers = []
+    for (prefix, prefix_lookups) in lookups_by_prefix.iteritems():
+        pattern = re.compile("|".join([re.escape(lookup) for lookup in prefix_lookups]))
+        matchers.append((prefix, pattern))
+    return matchers
+
+license_lookup_matchers = build_license_matchers(license_lookups, license_lookup_prefixes)
+license_lookup_priority = dict([(lookup, index) for (index, (lookup, license)) in enumerate(license_lookups)])
+
+
 def find_normalized_license(text):
     if not text:
         return None
 
-    normalized_text = text.replace(" ", "").replace("-", "").lower()
+    # same as removing spaces and dashes then lowercasing, in fewer copies of the page
+    if isinstance(text, unicode):
+        normalized_text = text.lower().translate({ord(u" "): None, ord(u"-"): None})
+    else:
+        normalized_text = text.lower().translate(None, " -")
 
-    # the lookup order matters
-    # assumes no spaces, no dashes, and all lowercase
-    # inspired by https://github.com/CottageLabs/blackbox/blob/fc13e5855bd13137cf1ef8f5e93883234fdab464/service/licences.py
-    # thanks CottageLabs!  :)
+    best_priority = None
+    for (prefix, pattern) in license_lookup_matchers:
+        position = normalized_text.find(prefix)
+        while position != -1:
+            match = pattern.match(normalized_text, position)
+            if match:
+                priority = license_lookup_priority[match.group(0)]
+                if best_priority is None or priority < best_priority:
+                    best_priority = priority
+            position = normalized_text.find(prefix, position + 1)
 
-    license_lookups = [
-        ("koreanjpathol.org/authors/access.php", "cc-by-nc"),  # their access page says it is all cc-by-nc now
-        ("elsevier.com/openaccess/userlicense", "elsevier-specific: oa user license"),  #remove the - because is removed in normalized_text above
-        ("pubs.acs.org/page/policy/authorchoice_termsofuse.html", "acs-specific: authorchoice/editors choice usage agreement"),
+    if best_priority is None:
+        return None
 
-        ("creativecommons.org/licenses/byncnd", "cc-by-nc-nd"),
-        ("creativecommonsattributionnoncommercialnoderiv", "cc-by-nc-nd"),
-        ("ccbyncnd", "cc-by-nc-nd"),
+    license = license_lookups[best_priority][1]
+    if license=="pd":
+        try:
+            if u"worksnotinthepublicdomain" in normalized_text:
+                return None
+        except:
+            # some kind of unicode exception
+            return None
+    return license
 
-        ("creativecommons.org/licenses/byncsa", "cc-by-nc-sa"),
-        ("creativecommonsattributionnoncommercialsharealike", "cc-by-nc-sa"),
-        ("ccbyncsa", "cc-by-nc-sa"),
 
-        ("creativecommons.org/licenses/bynd", "cc-by-nd"),
-        ("creativecommonsattributionnoderiv", "cc-by-nd"),
-        ("ccbynd", "cc-by-nd"),
+class DoajLookup(object):
+    """
+    Hash index over the DOAJ rows loaded in app.py, so we don't scan
+    every row for every issn and journal title we check.
 
-        ("creativecommons.org/licenses/bysa", "cc-by-sa"),
-        ("creativecommonsattributionsharealike", "cc-by-sa"),
-        ("ccbysa", "cc-by-sa"),
+    Keys map to the rows' (normalized license, start year) pairs, kept in
+    file order so the first row that was open by pub_year still wins.
+    """
+    def __init__(self, issn_rows, title_rows):
+        self.by_issn = {}
+        for (row_issn, row_license, doaj_start_year) in issn_rows:
+            self._add(self.by_issn, row_issn, row_license, doaj_start_year)
 
-        ("creativecommons.org/licenses/bync", "cc-by-nc"),
-        ("creativecommonsattributionnoncommercial", "cc-by-nc"),
-        ("ccbync", "cc-by-nc"),
+        self.by_title = {}
+        for (row_journal_name, row_license, doaj_start_year) in title_rows:
+            self._add(self.by_title, row_journal_name.lower(), row_license, doaj_start_year)
 
-        ("creativecommons.org/licenses/by", "cc-by"),
-        ("creativecommonsattribution", "cc-by"),
-        ("ccby", "cc-by"),
+    def _add(self, index, key, row_license, doaj_start_year):
+        entry = (find_normalized_license(row_license), doaj_start_year)
+        index.setdefault(key, []).append(entry)
 
-        ("creativecommons.org/publicdomain/zero", "cc0"),
-        ("creativecommonszero", "cc0"),
+    def _license_for(self, index, key, pub_year):
+        for (license, doaj_start_year) in index.get(key, []):
+            if doaj_start_year and pub_year and (doaj_start_year > pub_year):
+                pass # journal wasn't open yet!
+            else:
+                return license
+        return False
 
-        ("creativecommons.org/publicdomain/mark", "pd"),
-        ("publicdomain", "pd"),
+    # returns False if no match, otherwise the normalized license (which can be None)
+    def license_for_issn(self, issn, pub_year=None):
+        return self._license_for(self.by_issn, issn, pub_year)
 
-        # ("openaccess", "oa")
-    ]
+    # expects the utf-8 encoded journal title, same as the rows in app.doaj_titles
+    def license_for_title(self, journal_name_encoded, pub_year=None):
+        return self._license_for(self.by_title, journal_name_encoded.lower(), pub_year)
 
-    for (lookup, license) in license_lookups:
-        if lookup in normalized_text:
-            if license=="pd":
-                try:
-                    if u"worksnotinthepublicdomain" in normalized_text:
-                        return None
-                except:
-                    # some kind of unicode exception
-                    return None
-            return license
-    return None
+# built once per process from data/doaj_issns.json and data/doaj_titles.json
+doaj_lookup = DoajLookup(doaj_issns, doaj_titles)
 
 
 
@@ -267,14 +353,35 @@ def save_author_manuscript():
 
 
 def get_datacite_doi_prefixes():
-    datacite_doi_prefixes = ["{}/".format(prefix) for prefix in datacite_doi_prefixes_string.split("\n") if prefix]
+    datacite_doi_prefixes = ["{}/".format(prefix) for prefix in sorted(datacite_doi_prefix_set)]
     return datacite_doi_prefixes
 
-# removed this one because paywalled.  see 10.1515/fabl.1988.29.1.21
-# 10.1515
+def parse_datacite_doi_prefixes(prefixes_string):
+    prefixes = []
+    for line in prefixes_string.split("\n"):
+        prefix = line.strip().rstrip("/")
+        if prefix and prefix not in excluded_datacite_doi_prefixes:
+            prefixes.append(prefix)
+    return prefixes
+
+# ingest an updated prefix list, one prefix per line like datacite_doi_prefixes_string below.
+# set DATACITE_PREFIXES_FILE to load one at startup instead of the list below.
+# replaces the set in one assignment, so lookups in other threads see either the old or new list.
+def load_datacite_doi_prefixes(filename):
+    global datacite_doi_prefix_set
+    with open(filename, "r") as fh:
+        prefixes = parse_datacite_doi_prefixes(fh.read())
+    datacite_doi_prefix_set = set(prefixes)
+    logger.info(u"loaded {} datacite doi prefixes from {}".format(len(datacite_doi_prefix_set), filename))
+    return datacite_doi_prefix_set
 
-# removed this one because paywalled.  see https://doi.org/10.1513/AnnalsATS.201610-815OC
-# 10.1513
+excluded_datacite_doi_prefixes = [
+    # removed this one because paywalled.  see 10.1515/fabl.1988.29.1.21
+    "10.1515",
+
+    # removed this one because paywalled.  see https://doi.org/10.1513/AnnalsATS.201610-815OC
+    "10.1513"
+]
 
 # from http://stats.datacite.org/
 datacite_doi_prefixes_string = """
@@ -962,6 +1069,11 @@ datacite_doi_prefixes_string = """
 10.20391
 10.2122"""
 
+# the registrant part of the doi (before the first /) is all we look up
+datacite_doi_prefix_set = set(parse_datacite_doi_prefixes(datacite_doi_prefixes_string))
+if os.getenv("DATACITE_PREFIXES_FILE"):
+    load_datacite_doi_prefixes(os.getenv("DATACITE_PREFIXES_FILE"))
+
 
 
 
@@ -5,9 +5,13 @@ from pdfminer.pdfpage import PDFPage
 from cStringIO import StringIO
 import requests
 import os
+from contextlib import closing
 
 from app import logger
 from http_cache import http_get
+from http_cache import PROXY_DIRECT
+from http_cache import read_bounded_content
+from http_cache import is_response_too_large
 
 
 def convert_pdf_to_txt(url):
@@ -18,14 +22,22 @@ def convert_pdf_to_txt(url):
     device = TextConverter(rsrcmgr, retstr, codec=codec, laparams=laparams)
 
     # hap speedup
-    r = http_get(url, connect_timeout=600, read_timeout=600, use_proxy=False)
-    # r = http_get(url, connect_timeout=600, read_timeout=600, use_proxy=True)
-
-    if r.status_code != 200:
-        logger.info(u"error: status code {} in convert_pdf_to_txt".format(r.status_code))
-        return None
-
-    fp = StringIO(r.content)
+    # r = http_get(url, connect_timeout=600, read_timeout=600, proxy_profile=PROXY_CRAWLERA)
+    # closed on the way out, so a pdf we stop reading doesn't keep its connection
+    with closing(http_get(url, stream=True, connect_timeout=600, read_timeout=600, proxy_profile=PROXY_DIRECT)) as r:
+
+        if r.status_code != 200:
+            logger.info(u"error: status code {} in convert_pdf_to_txt".format(r.status_code))
+            return None
+
+        content = None
+        if not is_response_too_large(r):
+            content = read_bounded_content(r)
+        if content is None:
+            logger.info(u"error: pdf too large in convert_pdf_to_txt")
+            return None
+
+    fp = StringIO(content)
 
     interpreter = PDFPageInterpreter(rsrcmgr, device)
     password = ""
@@ -0,0 +1,257 @@
+import os
+import errno
+import hashlib
+import json
+import zlib
+import shortuuid
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+import boto
+
+from app import logger
+from app import requests_cache_bucket
+
+# where http_get caches pages for callers that pass cache_enabled=True.
+# streamed responses are never cached, since storing one means reading all of it.
+# HTTP_CACHE_BACKENDS picks the tiers, fastest first, like "disk" or "disk,s3".
+# on a hit in a slower tier, the faster tiers get a copy.  unset means no page cache.
+#
+# every backend has a name, get(hash_key), which returns {"content": the body,
+# "headers": metadata dict} or None, and set(hash_key, content, metadata).
+# they all use the same hashed key, so entries written by one tier can be read back by any other.
+# keys are hashes of the url, not the body, since a page is looked up (and revalidated) by its url.
+
+HTTP_CACHE_BACKENDS = os.getenv("HTTP_CACHE_BACKENDS", "")
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", "http_cache_pages")
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", 1000*1000*1000))  # 1GB
+
+
+def build_hash_key(key):
+    json_key = json.dumps(key)
+    hash_key = hashlib.md5(json_key.encode("utf-8")).hexdigest()
+    return hash_key
+
+
+# one file per page, in folders named for the first characters of the key so no
+# folder gets too big.  each file is the metadata as one line of json, then the
+# zlib-compressed body.
+# reads touch the file's mtime, and when the folder gets bigger than max_bytes
+# the least recently used files are deleted until it's back under 90%.
+# walking the folder is slow, so adding up its size and evicting happen in a
+# background thread, never in the request that wrote the page.
+class DiskPageCache(object):
+    name = "disk"
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # None until the background thread has added up what's already on disk
+        self.total_bytes = None
+        self.lock = Lock()
+        self.eviction_needed = Event()
+        self.eviction_pid = None
+
+    def path_for(self, hash_key):
+        return os.path.join(self.cache_dir, hash_key[0:2], hash_key[2:4], hash_key)
+
+    def get(self, hash_key):
+        path = self.path_for(hash_key)
+        try:
+            with open(path, "rb") as fh:
+                record = fh.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+
+        try:
+            (metadata_line, compressed_content) = record.split("\n", 1)
+            return {
+                "content": zlib.decompress(compressed_content),
+                "headers": json.loads(metadata_line)
+            }
+        except (ValueError, zlib.error):
+            logger.info(u"corrupt disk cache entry {}, removing it".format(path))
+            removed_bytes = self.remove(path)
+            with self.lock:
+                if self.total_bytes is not None:
+                    self.total_bytes -= removed_bytes
+            return None
+
+    def set(self, hash_key, content, metadata):
+        path = self.path_for(hash_key)
+        if isinstance(content, unicode):
+            content = content.encode("utf-8")
+        record = json.dumps(metadata or {}) + "\n" + zlib.compress(content)
+
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # write then rename, so readers never see half a file
+        temp_path = u"{}.{}.tmp".format(path, shortuuid.uuid())
+        with open(temp_path, "wb") as fh:
+            fh.write(record)
+        # the rename replaces any old copy, so it no longer counts
+        try:
+            old_bytes = os.path.getsize(path)
+        except OSError:
+            old_bytes = 0
+        os.rename(temp_path, path)
+
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += len(record) - old_bytes
+            needs_eviction = self.total_bytes is None or self.total_bytes > self.max_bytes
+        if needs_eviction:
+            self.start_eviction()
+
+    # threads don't survive a fork, so start the eviction thread on first use in each process
+    def start_eviction(self):
+        with self.lock:
+            if self.eviction_pid != os.getpid():
+                thread = Thread(target=self.evict_in_background, name="disk_page_cache_eviction")
+                thread.daemon = True
+                thread.start()
+                self.eviction_pid = os.getpid()
+        self.eviction_needed.set()
+
+    def evict_in_background(self):
+        while True:
+            self.eviction_needed.wait()
+            self.eviction_needed.clear()
+            try:
+                self.evict()
+            except Exception as e:
+                logger.info(u"error evicting from disk cache: {}".format(e))
+
+    def list_files(self):
+        files = []
+        for (dir_path, dir_names, file_names) in os.walk(self.cache_dir):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file_path))
+        return files
+
+    # recounts what's on disk, and if it's over max_bytes removes the least recently used
+    # files till it's under 90%.  pages written meanwhile may be counted twice or missed,
+    # which the next recount puts right.
+    def evict(self):
+        files = sorted(self.list_files())
+        total_bytes = sum([size for (mtime, size, file_path) in files])
+        target_bytes = self.max_bytes * 0.9
+        num_removed = 0
+        if total_bytes > self.max_bytes:
+            for (mtime, size, file_path) in files:
+                if total_bytes <= target_bytes:
+                    break
+                total_bytes -= self.remove(file_path)
+                num_removed += 1
+            logger.info(u"disk cache was over {} bytes, removed {} least recently used pages".format(
+                self.max_bytes, num_removed))
+        with self.lock:
+            self.total_bytes = total_bytes
+
+    # returns how many bytes it freed
+    def remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except OSError:
+            return 0
+
+
+# the tng-requests-cache bucket.  one GET per read and one PUT per write:
+# the metadata comes back as headers on the GET and goes up with the PUT.
+class S3PageCache(object):
+    name = "s3"
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def get(self, hash_key):
+        k = boto.s3.key.Key(self.bucket)
+        k.key = hash_key
+        try:
+            file_contents = k.get_contents_as_string()
+        except boto.exception.S3ResponseError:
+            # not in cache
+            return None
+
+        headers = dict(k.metadata or {})
+        headers["content-type"] = k.content_type
+        headers["content-disposition"] = k.content_disposition
+        return {"content": file_contents, "headers": headers}
+
+    def set(self, hash_key, content, metadata):
+        k = boto.s3.key.Key(self.bucket)
+        k.key = hash_key
+        put_headers = {}
+        for (name, value) in (metadata or {}).iteritems():
+            if name.lower() == "content-type":
+                put_headers["Content-Type"] = value
+            elif name.lower() == "content-disposition":
+                put_headers["Content-Disposition"] = value
+            elif value is not None:
+                k.set_metadata(name, value)
+        k.set_contents_from_string(content, headers=put_headers)
+
+
+class TieredPageCache(object):
+    def __init__(self, backends):
+        self.backends = backends
+        self.name = u"+".join([backend.name for backend in backends])
+
+    def get(self, hash_key):
+        for (i, backend) in enumerate(self.backends):
+            try:
+                cache_data = backend.get(hash_key)
+            except Exception as e:
+                logger.info(u"error reading {} from {} page cache: {}".format(hash_key, backend.name, e))
+                continue
+            if cache_data:
+                for faster_backend in self.backends[0:i]:
+                    self.set_one(faster_backend, hash_key, cache_data["content"], cache_data["headers"])
+                return cache_data
+        return None
+
+    def set(self, hash_key, content, metadata):
+        for backend in self.backends:
+            self.set_one(backend, hash_key, content, metadata)
+
+    def set_one(self, backend, hash_key, content, metadata):
+        try:
+            backend.set(hash_key, content, metadata)
+        except Exception as e:
+            logger.info(u"error writing {} to {} page cache: {}".format(hash_key, backend.name, e))
+
+
+def build_page_cache(backend_names):
+    backends = []
+    for backend_name in backend_names.split(","):
+        backend_name = backend_name.strip().lower()
+        if not backend_name:
+            continue
+        if backend_name == "disk":
+            backends.append(DiskPageCache(HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES))
+        elif backend_name == "s3":
+            if requests_cache_bucket:
+                backends.append(S3PageCache(requests_cache_bucket))
+            else:
+                logger.info(u"no s3 credentials, so leaving s3 out of the page cache")
+        else:
+            raise ValueError(u"unknown page cache backend {}".format(backend_name))
+    if not backends:
+        return None
+    return TieredPageCache(backends)
+
+
+page_cache = build_page_cache(HTTP_CACHE_BACKENDS)
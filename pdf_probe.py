@@ -0,0 +1,205 @@
+import os
+from collections import OrderedDict
+from contextlib import closing
+from threading import Lock
+
+import requests
+
+from app import logger
+from http_cache import call_requests_get
+from http_cache import peek_content
+from http_cache import PROXY_DIRECT
+from circuit_breaker import CircuitOpenError
+from circuit_breaker import get_host
+from host_scheduler import HostBusyError
+
+# checks whether a link is a pdf without downloading it, with one request.
+# usually that's a GET for just the first PDF_PROBE_BYTES, which settles it either way
+# by the headers or a %PDF sniff.  on hosts that can't do Range (405s, 416s, 501s)
+# it's a HEAD instead, which can only say yes.  anything the probe can't settle -- or a page
+# that could be a pdf viewer, which needs the whole page to tell -- is left to the full GET.
+#
+# a 401, 403, 404 or 410 is a final answer: it's not a pdf we can get, whatever we ask for.
+# only the statuses servers use for "can't do that method" count against a host.
+
+PDF_PROBE_BYTES = int(os.getenv("PDF_PROBE_BYTES", 4096))
+PDF_PROBE_TIMEOUT_SECONDS = 30
+# skip a method on a host once it's failed this many times and more often than it's worked
+HOST_QUIRK_THRESHOLD = 2
+HOST_QUIRK_MAX_HOSTS = 10000
+
+
+# the content-type or content-disposition says pdf
+def headers_say_pdf(headers):
+    for (k, v) in headers.iteritems():
+        if v:
+            key = k.lower()
+            val = v.lower()
+
+            if key == "content-type" and "application/pdf" in val:
+                return True
+
+            if key == 'content-disposition' and "pdf" in val:
+                return True
+    return False
+
+
+class HostQuirks(object):
+    def __init__(self):
+        self.hosts = OrderedDict()
+        self.lock = Lock()
+
+    def get_counts(self, host):
+        counts = self.hosts.pop(host, None)
+        if not counts:
+            counts = {"head_worked": 0, "head_failed": 0, "range_worked": 0, "range_failed": 0}
+        self.hosts[host] = counts
+        while len(self.hosts) > HOST_QUIRK_MAX_HOSTS:
+            self.hosts.popitem(last=False)
+        return counts
+
+    def record(self, host, method, worked):
+        if not host:
+            return
+        with self.lock:
+            counts = self.get_counts(host)
+            counts["{}_{}".format(method, "worked" if worked else "failed")] += 1
+            failed = counts["{}_failed".format(method)]
+            if not worked and failed == HOST_QUIRK_THRESHOLD and failed > counts["{}_worked".format(method)]:
+                logger.info(u"{} doesn't handle {} well, not using it there any more".format(host, method))
+
+    def should_try(self, host, method):
+        if not host:
+            return True
+        with self.lock:
+            counts = self.hosts.get(host, None)
+            if not counts:
+                return True
+            failed = counts["{}_failed".format(method)]
+            return failed < HOST_QUIRK_THRESHOLD or failed <= counts["{}_worked".format(method)]
+
+    def stats(self, limit=100):
+        with self.lock:
+            rows = [dict(counts, host=host) for (host, counts) in self.hosts.iteritems()
+                    if counts["head_failed"] or counts["range_failed"]]
+        rows.sort(key=lambda row: row["head_failed"] + row["range_failed"], reverse=True)
+        return rows[:limit]
+
+
+# the link isn't something we can get, however we ask for it
+final_statuses = (401, 403, 404, 410)
+# what a server says when it can't do HEAD or Range
+unsupported_statuses = (405, 416, 501)
+
+
+class PdfProbe(object):
+    def __init__(self):
+        self.host_quirks = HostQuirks()
+        self.counts = {
+            "probes": 0,
+            "decided_by_head": 0,
+            "decided_by_range": 0,
+            "left_to_full_get": 0
+        }
+        self.lock = Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    # returns (True, status) if it's a pdf, (False, status) if it's not,
+    # or (None, None) if the full GET needs to decide.
+    # can_rule_out=False when the page could be a pdf viewer that only the whole page gives away.
+    def check(self, url, related_pub=None, proxy_profile=PROXY_DIRECT, can_rule_out=True):
+        self.count("probes")
+        host = get_host(url)
+
+        if self.host_quirks.should_try(host, "range"):
+            method = "range"
+            (is_pdf, status_code) = self.check_with_range(url, host, related_pub, proxy_profile)
+        elif self.host_quirks.should_try(host, "head"):
+            method = "head"
+            (is_pdf, status_code) = self.check_with_head(url, host, related_pub, proxy_profile)
+        else:
+            (is_pdf, status_code) = (None, None)
+
+        if is_pdf is False and not can_rule_out and status_code not in final_statuses:
+            # the first few KB of a pdf viewer page don't look like a pdf
+            is_pdf = None
+
+        if is_pdf is None:
+            self.count("left_to_full_get")
+            return (None, None)
+        self.count("decided_by_{}".format(method))
+        return (is_pdf, status_code)
+
+    # (True, status code) if the headers say pdf, (False, status code) if it's not there,
+    # otherwise (None, None)
+    def check_with_head(self, url, host, related_pub, proxy_profile):
+        try:
+            r = call_requests_get(url,
+                                  read_timeout=PDF_PROBE_TIMEOUT_SECONDS,
+                                  connect_timeout=PDF_PROBE_TIMEOUT_SECONDS,
+                                  related_pub=related_pub,
+                                  proxy_profile=proxy_profile,
+                                  method="head")
+        except (CircuitOpenError, HostBusyError):
+            raise
+        except requests.exceptions.RequestException as e:
+            logger.info(u"HEAD failed on {}: {}".format(url, e))
+            return (None, None)
+
+        r.close()
+        if r.status_code in final_statuses:
+            return (False, r.status_code)
+        if r.status_code in unsupported_statuses:
+            self.host_quirks.record(host, "head", False)
+            return (None, None)
+        if r.status_code == 200 and headers_say_pdf(r.headers):
+            self.host_quirks.record(host, "head", True)
+            return (True, r.status_code)
+        # html headers can be on a pdf too, so only the full GET can say no
+        return (None, None)
+
+    # (True or False, status code) if the first few KB settle it, otherwise (None, None)
+    def check_with_range(self, url, host, related_pub, proxy_profile):
+        headers = {"Range": "bytes=0-{}".format(PDF_PROBE_BYTES - 1)}
+        try:
+            r = call_requests_get(url,
+                                  headers=headers,
+                                  read_timeout=PDF_PROBE_TIMEOUT_SECONDS,
+                                  connect_timeout=PDF_PROBE_TIMEOUT_SECONDS,
+                                  stream=True,
+                                  related_pub=related_pub,
+                                  proxy_profile=proxy_profile)
+        except (CircuitOpenError, HostBusyError):
+            raise
+        except requests.exceptions.RequestException as e:
+            logger.info(u"ranged GET failed on {}: {}".format(url, e))
+            return (None, None)
+
+        with closing(r):
+            if r.status_code in (200, 206):
+                # a 200 means it ignored the range and is sending everything.  we only read
+                # the first chunk either way, so that's fine.
+                if r.status_code == 206:
+                    self.host_quirks.record(host, "range", True)
+                is_pdf = headers_say_pdf(r.headers) or peek_content(r, PDF_PROBE_BYTES).lstrip().startswith("%PDF")
+                return (is_pdf, r.status_code)
+
+            if r.status_code in final_statuses:
+                return (False, r.status_code)
+
+            if r.status_code in unsupported_statuses:
+                self.host_quirks.record(host, "range", False)
+            # anything else (500s, 429s) says nothing about the range, so let the full GET see it
+            return (None, None)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+        stats["hosts_with_quirks"] = self.host_quirks.stats()
+        return stats
+
+
+pdf_probe = PdfProbe()
@@ -4,6 +4,7 @@ from sqlalchemy import or_
 from sqlalchemy import sql
 from sqlalchemy import text
 from sqlalchemy import orm
+from sqlalchemy import func
 
 
 from time import time
@@ -12,7 +13,6 @@ from random import random
 import datetime
 from contextlib import closing
 from lxml import etree
-from threading import Thread
 import logging
 import requests
 from requests.auth import HTTPProxyAuth
@@ -32,54 +32,36 @@ from util import safe_commit
 from util import remove_punctuation
 from util import NoDoiException
 from util import normalize
+from util import chunks
 import oa_local
 import oa_base
 from oa_base import Base
 from oa_base import BaseMatch
 from oa_base import BaseTitleView
 import oa_manual
+import resolved_url
 from oa_local import find_normalized_license
 from open_location import OpenLocation
+from response_cache import invalidate_on_commit
 from open_location import location_sort_score
 from reported_noncompliant_copies import reported_noncompliant_url_fragments
 from webpage import OpenPublisherWebpage, PublisherWebpage, WebpageInOpenRepo, WebpageInUnknownRepo
 from http_cache import get_crawlera_session_id
+from fetch_engine import fetch_engine
 
 
+# these run on the shared fetch_engine pool, so the number of scrapes in flight
+# is capped per process however many of these are going at once
 def call_targets_in_parallel(targets):
     if not targets:
         return
-
-    # logger.info(u"calling", targets)
-    threads = []
-    for target in targets:
-        process = Thread(target=target, args=[])
-        process.start()
-        threads.append(process)
-    for process in threads:
-        try:
-            process.join(timeout=60*10)
-        except (KeyboardInterrupt, SystemExit):
-            pass
-        except Exception as e:
-            logger.info(u"thread Exception {} in call_targets_in_parallel. continuing.".format(e))
-    # logger.info(u"finished the calls to {}".format(targets))
+    call_args_in_parallel(lambda target: target(), [[target] for target in targets])
 
 def call_args_in_parallel(target, args_list):
-    # logger.info(u"calling", targets)
-    threads = []
-    for args in args_list:
-        process = Thread(target=target, args=args)
-        process.start()
-        threads.append(process)
-    for process in threads:
-        try:
-            process.join(timeout=60*10)
-        except (KeyboardInterrupt, SystemExit):
-            pass
-        except Exception as e:
-            logger.info(u"thread Exception {} in call_args_in_parallel. continuing.".format(e))
-    # logger.info(u"finished the calls to {}".format(targets))
+    tasks = fetch_engine.map(target, args_list)
+    for task in tasks:
+        if task.error:
+            logger.info(u"thread Exception {} in call_args_in_parallel. continuing.".format(task.error))
 
 
 def lookup_product_by_doi(doi):
@@ -113,12 +95,49 @@ def thread_result_wrapper(func, args, res):
     res.append(func(*args))
 
 
-# get rid of this when we get rid of POST endpoint
-# for now, simplify it so it just calls the single endpoint
+# like lookup_product, but for a whole list of biblios at once.
+# one IN query per chunk of dois; the Crossref relationships are lazy='subquery',
+# so each chunk also loads pmcid_links, base_doi_links, base_matches and
+# normalized_titles for all its rows with one query per relationship.
+def lookup_products(biblios, chunk_size=500):
+    dois = []
+    for biblio in biblios:
+        if "doi" in biblio and biblio["doi"]:
+            dois.append(clean_doi(biblio["doi"]))
+    dois = list(set(dois))
+
+    found_pubs = {}
+    for doi_chunk in chunks(dois, chunk_size):
+        for my_pub in Crossref.query.filter(Crossref.id.in_(doi_chunk)).all():
+            my_pub.reset_vars()
+            found_pubs[my_pub.id] = my_pub
+    logger.info(u"found {} of {} dois in crossref db table".format(len(found_pubs), len(dois)))
+
+    my_pubs = []
+    for biblio in biblios:
+        my_pub = None
+        if "doi" in biblio and biblio["doi"]:
+            my_pub = found_pubs.get(clean_doi(biblio["doi"]), None)
+            if not my_pub:
+                my_pub = Crossref(**biblio)
+        my_pubs.append(my_pub)
+    return my_pubs
+
+
 def get_pubs_from_biblio(biblios, run_with_hybrid=False):
-    returned_pubs = []
+    if run_with_hybrid:
+        # hybrid does a live scrape per doi anyway, so no point batching the lookup
+        return [get_pub_from_biblio(biblio, run_with_hybrid=run_with_hybrid) for biblio in biblios]
+
+    # one pub per biblio, in the same order.  like get_pub_from_biblio, a biblio
+    # without a doi or with a doi we won't look up raises NoDoiException.
     for biblio in biblios:
-        returned_pubs.append(get_pub_from_biblio(biblio, run_with_hybrid=run_with_hybrid))
+        if not biblio.get("doi", None):
+            raise NoDoiException(u"no doi in biblio {}".format(biblio))
+
+    returned_pubs = lookup_products(biblios)
+    for my_pub in set(returned_pubs):
+        my_pub.recalculate(quiet=True)
     return returned_pubs
 
 
@@ -133,6 +152,45 @@ def get_pub_from_biblio(biblio, run_with_hybrid=False, skip_all_hybrid=False):
     return my_pub
 
 
+# how old a stored response_jsonb can be and still be served as-is.  0 turns it off.
+PRECOMPUTED_RESPONSE_MAX_AGE_SECONDS = int(os.getenv("PRECOMPUTED_RESPONSE_MAX_AGE_SECONDS", 60*60*24*7))
+
+# returns the response_jsonb that Crossref.run stored, if it is fresh enough and
+# nothing it was calculated from has been scraped since.  otherwise returns None
+# and the caller should recalculate.  only loads the columns it needs.
+def get_precomputed_response(doi, max_age_seconds=None):
+    if max_age_seconds is None:
+        max_age_seconds = PRECOMPUTED_RESPONSE_MAX_AGE_SECONDS
+    if not max_age_seconds:
+        return None
+
+    doi = clean_doi(doi)
+    row = db.session.query(Crossref.response_jsonb, Crossref.updated_response, Crossref.scrape_updated).filter(
+        Crossref.id == doi).first()
+    if not row:
+        return None
+
+    (response_jsonb, updated_response, scrape_updated) = row
+    if not response_jsonb or not updated_response:
+        return None
+
+    # invalid dois get a 404 on the recalculated path, so send them there
+    if u"Invalid DOI" in (response_jsonb.get("error") or u""):
+        return None
+
+    if updated_response < datetime.datetime.utcnow() - datetime.timedelta(seconds=max_age_seconds):
+        return None
+
+    # the hybrid scrape or a base scrape has new results since the response was stored
+    if scrape_updated and scrape_updated > updated_response:
+        return None
+    latest_base_scrape = db.session.query(func.max(BaseMatch.scrape_updated)).filter(BaseMatch.doi == doi).scalar()
+    if latest_base_scrape and latest_base_scrape > updated_response:
+        return None
+
+    return response_jsonb
+
+
 class PmcidLookup(db.Model):
     doi = db.Column(db.Text, db.ForeignKey('crossref.id'), primary_key=True)
     pmcid = db.Column(db.Text)
@@ -244,6 +302,8 @@ class Crossref(db.Model):
         self.closed_base_ids = []
         self.crawlera_session_id = None
         self.version = None
+        self.location_views_key = None
+        self.location_views_cache = None
 
 
     @property
@@ -317,6 +377,7 @@ class Crossref(db.Model):
 
         # and then recalcualte everything, so can do to_dict() after this and it all works
         self.recalculate()
+        invalidate_on_commit(self)
 
 
 
@@ -332,6 +393,7 @@ class Crossref(db.Model):
             pass
         self.updated_response = datetime.datetime.utcnow()
         self.response_jsonb = self.to_dict()
+        invalidate_on_commit(self)
         # logger.info(json.dumps(self.response_jsonb, indent=4))
 
 
@@ -347,6 +409,7 @@ class Crossref(db.Model):
         self.updated_response_with_hybrid = datetime.datetime.utcnow()
         self.response_with_hybrid = self.to_dict()
         self.response = self.response_with_hybrid
+        invalidate_on_commit(self)
         # logger.info(json.dumps(self.response, indent=4))
 
 
@@ -423,11 +486,9 @@ class Crossref(db.Model):
         self.version = None
         self.evidence = None
 
-        reversed_sorted_locations = self.sorted_locations
-        reversed_sorted_locations.reverse()
-
         # go through all the locations, using valid ones to update the best open url data
-        for location in reversed_sorted_locations:
+        # (don't reverse in place, the sorted list is cached)
+        for location in reversed(self.sorted_locations):
             self.free_pdf_url = location.pdf_url
             self.free_metadata_url = location.metadata_url
             self.evidence = location.evidence
@@ -823,32 +884,56 @@ class Crossref(db.Model):
             return None
 
     @property
-    def sorted_locations(self):
-        locations = self.open_locations
-        # first sort by best_fulltext_url so ties are handled consistently
-        locations = sorted(locations, key=lambda x: x.best_fulltext_url, reverse=False)
-        # now sort by what's actually better
-        locations = sorted(locations, key=lambda x: location_sort_score(x), reverse=False)
+    def location_views(self):
+        # to_dict reads the sorted locations many times, so sort and bucket them once.
+        # the cache is keyed on which locations are in open_locations (OpenLocation
+        # compares by identity), so appending a location or resetting the list
+        # means we recompute on the next read.
+        views_key = tuple(self.open_locations)
+        if self.location_views_cache is not None and self.location_views_key == views_key:
+            return self.location_views_cache
+
+        # sort by what's actually better, then by best_fulltext_url so ties are handled consistently
+        locations = sorted(self.open_locations, key=lambda x: (location_sort_score(x), x.best_fulltext_url))
 
         # now remove noncompliant ones
         locations = [location for location in locations if not location.is_reported_noncompliant]
-        return locations
+
+        views = {"sorted": locations, "green": [], "gold": [], "blue": []}
+        for location in locations:
+            oa_color = location.oa_color
+            if oa_color in views:
+                views[oa_color].append(location)
+
+        self.location_views_key = views_key
+        self.location_views_cache = views
+        return views
+
+    # these return the cached lists, so copy them before changing them
+    @property
+    def sorted_locations(self):
+        return self.location_views["sorted"]
 
     @property
     def green_locations(self):
-        return [location for location in self.sorted_locations if location.oa_color == "green"]
+        return self.location_views["green"]
 
     @property
     def gold_locations(self):
-        return [location for location in self.sorted_locations if location.oa_color == "gold"]
+        return self.location_views["gold"]
 
     @property
     def blue_locations(self):
-        return [location for location in self.sorted_locations if location.oa_color == "blue"]
+        return self.location_views["blue"]
 
     def get_resolved_url(self):
         if hasattr(self, "my_resolved_url_cached"):
             return self.my_resolved_url_cached
+
+        self.my_resolved_url_cached = resolved_url.get_resolved_url(self.id, resolved_url.RESOLVED_URL_LANDING_PAGE)
+        if self.my_resolved_url_cached:
+            return self.my_resolved_url_cached
+
         try:
             r = requests.get("http://doi.org/{}".format(self.id),
                              stream=True,
@@ -858,6 +943,7 @@ class Crossref(db.Model):
                 )
 
             self.my_resolved_url_cached = r.url
+            resolved_url.set_resolved_url(self.id, resolved_url.RESOLVED_URL_LANDING_PAGE, r.url, u"doi.org")
 
         except Exception:  #hardly ever do this, but man it seems worth it right here
             # logger.info(u"get_resolved_url failed")
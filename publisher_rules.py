@@ -0,0 +1,79 @@
+import os
+import re
+import json
+from threading import Lock
+
+from app import logger
+from util import normalize
+
+# the publisher-specific things we look for in a page, like the icon a publisher
+# puts on its open access articles.  they live in data/publisher_rules.json:
+#   "says_free_pdf": the page is really a pdf viewer.  {"publisher", "pattern"}
+#   "says_open_access": the landing page says it's open.  {"publisher", "pattern"}
+#   "says_open_access_at_url": same, for sites we know by url.  {"url_snippet", "pattern"}
+# patterns are case-insensitive regexes where . matches newlines too.
+#
+# rules are compiled once at load and indexed by normalized publisher name, so a page
+# only gets checked against its own publisher's rules.
+
+PUBLISHER_RULES_FILE = os.getenv("PUBLISHER_RULES_FILE", "data/publisher_rules.json")
+MAX_NORMALIZED_NAMES = 10000
+
+
+class PublisherRules(object):
+    def __init__(self, rules_dict):
+        self.publisher_rules = {}
+        self.url_rules = {}
+        self.normalized_names = {}
+        self.lock = Lock()
+
+        for (rule_type, rules) in rules_dict.iteritems():
+            for rule in rules:
+                pattern = re.compile(rule["pattern"], re.IGNORECASE | re.DOTALL)
+                if "publisher" in rule:
+                    rules_by_publisher = self.publisher_rules.setdefault(rule_type, {})
+                    rules_by_publisher.setdefault(normalize(rule["publisher"]), []).append(pattern)
+                elif "url_snippet" in rule:
+                    self.url_rules.setdefault(rule_type, []).append((rule["url_snippet"].lower(), pattern))
+                else:
+                    raise ValueError(u"publisher rule needs a publisher or url_snippet: {}".format(rule))
+
+    # normalize is slow, and we see the same few thousand publisher names over and over
+    def normalize_publisher(self, publisher):
+        with self.lock:
+            normalized_name = self.normalized_names.get(publisher, None)
+        if normalized_name is None:
+            normalized_name = normalize(publisher)
+            with self.lock:
+                if len(self.normalized_names) >= MAX_NORMALIZED_NAMES:
+                    self.normalized_names = {}
+                self.normalized_names[publisher] = normalized_name
+        return normalized_name
+
+    # compiled patterns of this type for this publisher
+    def for_publisher(self, rule_type, publisher):
+        if not publisher:
+            return []
+        rules_by_publisher = self.publisher_rules.get(rule_type, {})
+        if not rules_by_publisher:
+            return []
+        return rules_by_publisher.get(self.normalize_publisher(publisher), [])
+
+    # compiled patterns of this type whose url snippet is in this url
+    def for_url(self, rule_type, url):
+        if not url:
+            return []
+        url = url.lower()
+        return [pattern for (url_snippet, pattern) in self.url_rules.get(rule_type, []) if url_snippet in url]
+
+
+def load_publisher_rules(filename):
+    with open(filename, "r") as fh:
+        rules_dict = json.load(fh)
+    my_rules = PublisherRules(rules_dict)
+    logger.info(u"loaded publisher rules for {} publishers from {}".format(
+        len(set([name for rules in my_rules.publisher_rules.values() for name in rules])), filename))
+    return my_rules
+
+
+publisher_rules = load_publisher_rules(PUBLISHER_RULES_FILE)
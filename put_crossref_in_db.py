@@ -18,6 +18,8 @@ from app import logger
 from util import JSONSerializerPython2
 from util import elapsed
 from util import safe_commit
+from resolved_url import set_resolved_urls
+from resolved_url import RESOLVED_URL_RESOURCE
 
 
 # data from https://archive.org/details/crossref_doi_metadata
@@ -133,6 +135,7 @@ def build_crossref_record(data):
 def api_to_db(query_doi=None, first=None, last=None, today=False, threads=0, chunk_size=None):
     i = 0
     records_to_save = []
+    resolved_urls_to_save = []
 
     headers={"Accept": "application/json", "User-Agent": "impactstory.org"}
 
@@ -195,8 +198,17 @@ def api_to_db(query_doi=None, first=None, last=None, today=False, threads=0, chu
             logger.info(u"got record {}".format(record))
             records_to_save.append(record)
 
+            # crossref tells us the landing page, so we won't have to resolve it later
+            try:
+                landing_url = data["resource"]["primary"]["URL"]
+                resolved_urls_to_save.append((doi, RESOLVED_URL_RESOURCE, landing_url, u"crossref api"))
+            except (KeyError, TypeError):
+                pass
+
             if len(records_to_save) >= 10:
                 safe_commit(db)
+                set_resolved_urls(resolved_urls_to_save)
+                resolved_urls_to_save = []
                 logger.info(u"last deposted date", records_to_save[-1].api["_source"]["deposited"])
                 records_to_save = []
 
@@ -205,6 +217,7 @@ def api_to_db(query_doi=None, first=None, last=None, today=False, threads=0, chu
     # make sure to get the last ones
     logger.info(u"saving last ones")
     safe_commit(db)
+    set_resolved_urls(resolved_urls_to_save)
     logger.info(u"done everything")
 
 
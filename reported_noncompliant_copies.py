@@ -12,6 +12,11 @@ lookup_raw = {
     ]
 }
 
+# normalized once at import, is checked for every location of every doi
+lookup_normalized = {}
+for (doi_key, fragment_list) in lookup_raw.iteritems():
+    lookup_normalized[clean_doi(doi_key)] = [noncompliant_url_fragment.lower() for noncompliant_url_fragment in fragment_list]
+
 
 def is_reported_noncompliant_url(dirty_doi, dirty_url):
     if not dirty_url:
@@ -28,8 +33,4 @@ def reported_noncompliant_url_fragments(dirty_doi):
     if not dirty_doi:
         return []
 
-    lookup_normalized = {}
-    for (doi_key, fragment_list) in lookup_raw.iteritems():
-        lookup_normalized[clean_doi(doi_key)] = [noncompliant_url_fragment.lower() for noncompliant_url_fragment in fragment_list]
-
     return lookup_normalized.get(clean_doi(dirty_doi), [])
@@ -0,0 +1,120 @@
+import argparse
+import datetime
+import os
+from time import time
+
+from sqlalchemy import sql
+
+from app import db
+from app import logger
+from util import chunks
+from util import clean_doi
+from util import elapsed
+from util import NoDoiException
+
+# a doi's landing page url, kept in the resolved_url table (see sql/resolved_url.sql)
+# so we don't go to crossref or doi.org for it on every scrape.  they rarely change,
+# but entries older than RESOLVED_URL_TTL_DAYS are looked up again.
+#
+# there are two kinds, kept apart because they're often different urls:
+#   RESOLVED_URL_RESOURCE is the url the doi is registered to: the resource in crossref's
+#     record, or the Location doi.org redirects to.
+#   RESOLVED_URL_LANDING_PAGE is where you end up after following all the redirects from doi.org.
+# source says where each one came from.
+#
+# to warm it up for a list of dois, one per line:
+# python resolved_url.py --filename dois.txt
+
+RESOLVED_URL_TTL_DAYS = int(os.getenv("RESOLVED_URL_TTL_DAYS", 90))
+
+RESOLVED_URL_RESOURCE = u"resource"
+RESOLVED_URL_LANDING_PAGE = u"landing page"
+
+# a row that's fresh and already has this url is left alone
+upsert_query = u"""insert into resolved_url (doi, kind, url, source, updated)
+    values (:doi, :kind, :url, :source, :updated)
+    on conflict (doi, kind) do update set url=excluded.url, source=excluded.source, updated=excluded.updated
+    where resolved_url.url is distinct from excluded.url or resolved_url.updated <= :oldest_allowed"""
+
+
+def get_oldest_allowed():
+    return datetime.datetime.utcnow() - datetime.timedelta(days=RESOLVED_URL_TTL_DAYS)
+
+
+def get_resolved_url(doi, kind):
+    try:
+        row = db.engine.execute(
+            sql.text(u"select url from resolved_url where doi=:doi and kind=:kind and updated > :oldest_allowed"),
+            doi=doi,
+            kind=kind,
+            oldest_allowed=get_oldest_allowed()).first()
+    except Exception as e:
+        # the table might not be there yet.  just resolve it the slow way.
+        logger.info(u"couldn't read resolved_url for {}: {}".format(doi, e))
+        return None
+    if row:
+        return row[0]
+    return None
+
+
+def get_fresh_dois(dois, kind):
+    rows = db.engine.execute(
+        sql.text(u"select doi from resolved_url where doi = any(:dois) and kind=:kind and updated > :oldest_allowed"),
+        dois=dois,
+        kind=kind,
+        oldest_allowed=get_oldest_allowed()).fetchall()
+    return set([row[0] for row in rows])
+
+
+# rows are (doi, kind, url, source) tuples
+def set_resolved_urls(rows):
+    now = datetime.datetime.utcnow()
+    oldest_allowed = get_oldest_allowed()
+    params = [{"doi": doi, "kind": kind, "url": url, "source": source, "updated": now, "oldest_allowed": oldest_allowed}
+              for (doi, kind, url, source) in rows if doi and url]
+    if not params:
+        return
+    try:
+        db.engine.execute(sql.text(upsert_query), params)
+    except Exception as e:
+        logger.info(u"couldn't save {} resolved urls: {}".format(len(params), e))
+
+
+def set_resolved_url(doi, kind, url, source):
+    set_resolved_urls([(doi, kind, url, source)])
+
+
+def warm_up(filename, chunk_size=100):
+    # here so this module doesn't import http_cache, which imports it
+    from http_cache import get_crossref_resolve_url
+    from fetch_engine import fetch_engine
+
+    with open(filename, "r") as fh:
+        dois = []
+        for line in fh:
+            try:
+                dois.append(clean_doi(line.strip()))
+            except NoDoiException:
+                pass
+    logger.info(u"warming up resolved_url for {} dois".format(len(dois)))
+
+    start_time = time()
+    num_resolved = 0
+    for doi_chunk in chunks(dois, chunk_size):
+        fresh_dois = get_fresh_dois(doi_chunk, RESOLVED_URL_RESOURCE)
+        dois_to_resolve = [doi for doi in doi_chunk if doi not in fresh_dois]
+        # get_crossref_resolve_url saves what it finds
+        tasks = fetch_engine.map(get_crossref_resolve_url, [[u"http://doi.org/{}".format(doi)] for doi in dois_to_resolve])
+        num_resolved += len([task for task in tasks if task.result])
+        logger.info(u"resolved {} so far, {} already fresh in this chunk, {} seconds".format(
+            num_resolved, len(fresh_dois), elapsed(start_time)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill the resolved_url table for a list of dois.")
+    parser.add_argument('--filename', type=str, help="file with one doi per line")
+    parser.add_argument('--chunk_size', nargs="?", type=int, default=100, help="how many dois to resolve at once")
+    parsed = parser.parse_args()
+
+    logger.info(u"calling warm_up with these args: {}".format(vars(parsed)))
+    warm_up(parsed.filename, chunk_size=parsed.chunk_size)
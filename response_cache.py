@@ -0,0 +1,238 @@
+import json
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from app import db
+from app import logger
+from app import redis_rq_conn
+
+# two-tier cache of DOI api responses, in front of the db.
+# each gunicorn worker keeps a small LRU in memory; behind that is redis, shared by all workers.
+# keyed by cleaned doi and whether it was a hybrid request, though the api doesn't
+# cache ?hybrid requests, since they ask for a live scrape.
+#
+# when Crossref.run, run_with_hybrid or refresh commit new results for a doi, its keys are
+# deleted from redis and from this worker's LRU.  other workers' LRUs can't be reached, so
+# they hang on to the old response for at most RESPONSE_CACHE_LOCAL_TTL_SECONDS.
+
+RESPONSE_CACHE_LOCAL_MAX_ITEMS = int(os.getenv("RESPONSE_CACHE_LOCAL_MAX_ITEMS", 5000))
+RESPONSE_CACHE_LOCAL_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_LOCAL_TTL_SECONDS", 60))
+RESPONSE_CACHE_REDIS_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_REDIS_TTL_SECONDS", 60*60*24))
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "True") == "True"
+
+# how often each worker adds its counters to the shared ones in redis
+STATS_FLUSH_SECONDS = 10
+STATS_REDIS_KEY = "response_cache:stats"
+
+
+class ResponseCache(object):
+    def __init__(self, redis_conn, max_items, local_ttl, redis_ttl):
+        self.redis_conn = redis_conn
+        self.max_items = max_items
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self.local = OrderedDict()
+        self.lock = Lock()
+        self.counts = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "invalidations": 0,
+            "redis_errors": 0
+        }
+        self.unflushed_counts = dict.fromkeys(self.counts, 0)
+        self.last_flush = time()
+
+    def key(self, doi, hybrid):
+        if hybrid:
+            return u"response:hybrid:{}".format(doi)
+        return u"response:{}".format(doi)
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+            self.unflushed_counts[name] += 1
+
+    def get(self, doi, hybrid=False):
+        key = self.key(doi, hybrid)
+
+        response = self.get_local(key)
+        if response is not None:
+            self.count("local_hits")
+            return response
+
+        response = self.get_redis(key)
+        if response is None:
+            self.count("misses")
+        else:
+            self.count("redis_hits")
+            self.set_local(key, response)
+
+        self.maybe_flush_counts()
+        return response
+
+    # like get, but doesn't touch the hit/miss counts.  for polling while someone else
+    # is working on this doi, so every poll doesn't look like a miss.
+    def peek(self, doi, hybrid=False):
+        key = self.key(doi, hybrid)
+        response = self.get_local(key)
+        if response is None:
+            response = self.get_redis(key)
+            if response is not None:
+                self.set_local(key, response)
+        return response
+
+    def get_local(self, key):
+        with self.lock:
+            if key in self.local:
+                (expires, response) = self.local.pop(key)
+                if expires > time():
+                    # move it back to the most-recently-used end
+                    self.local[key] = (expires, response)
+                    return response
+        return None
+
+    def get_redis(self, key):
+        if self.redis_conn is None:
+            return None
+        try:
+            cached = self.redis_conn.get(key)
+            if cached:
+                return json.loads(cached)
+        except Exception as e:
+            logger.info(u"response cache couldn't read {} from redis: {}".format(key, e))
+            self.count("redis_errors")
+        return None
+
+    def set(self, doi, hybrid, response):
+        key = self.key(doi, hybrid)
+        self.set_local(key, response)
+        self.count("sets")
+        if self.redis_conn is not None:
+            try:
+                self.redis_conn.set(key, json.dumps(response), ex=self.redis_ttl)
+            except Exception as e:
+                logger.info(u"response cache couldn't write {} to redis: {}".format(key, e))
+                self.count("redis_errors")
+
+    def set_local(self, key, response):
+        with self.lock:
+            self.local.pop(key, None)
+            self.local[key] = (time() + self.local_ttl, response)
+            while len(self.local) > self.max_items:
+                self.local.popitem(last=False)
+
+    def invalidate(self, dois):
+        keys = []
+        for doi in dois:
+            keys += [self.key(doi, False), self.key(doi, True)]
+        if not keys:
+            return
+
+        with self.lock:
+            for key in keys:
+                self.local.pop(key, None)
+            self.counts["invalidations"] += len(dois)
+            self.unflushed_counts["invalidations"] += len(dois)
+
+        if self.redis_conn is not None:
+            try:
+                self.redis_conn.delete(*keys)
+            except Exception as e:
+                logger.info(u"response cache couldn't invalidate {} in redis: {}".format(dois, e))
+                self.count("redis_errors")
+
+    def clear_local(self):
+        with self.lock:
+            self.local.clear()
+
+    def maybe_flush_counts(self):
+        if self.redis_conn is None or time() - self.last_flush < STATS_FLUSH_SECONDS:
+            return
+        with self.lock:
+            to_flush = self.unflushed_counts
+            self.unflushed_counts = dict.fromkeys(self.counts, 0)
+            self.last_flush = time()
+        try:
+            pipe = self.redis_conn.pipeline()
+            for (name, value) in to_flush.iteritems():
+                if value:
+                    pipe.hincrby(STATS_REDIS_KEY, name, value)
+            pipe.execute()
+        except Exception as e:
+            logger.info(u"response cache couldn't flush stats to redis: {}".format(e))
+
+    def stats(self):
+        with self.lock:
+            worker_counts = dict(self.counts)
+            worker_counts["local_items"] = len(self.local)
+
+        all_workers_counts = None
+        if self.redis_conn is not None:
+            try:
+                all_workers_counts = dict([(k, int(v)) for (k, v) in self.redis_conn.hgetall(STATS_REDIS_KEY).iteritems()])
+            except Exception as e:
+                logger.info(u"response cache couldn't read stats from redis: {}".format(e))
+
+        return {
+            "pid": os.getpid(),
+            "this_worker": worker_counts,
+            "all_workers": all_workers_counts
+        }
+
+
+response_cache = ResponseCache(
+    redis_rq_conn,
+    max_items=RESPONSE_CACHE_LOCAL_MAX_ITEMS,
+    local_ttl=RESPONSE_CACHE_LOCAL_TTL_SECONDS,
+    redis_ttl=RESPONSE_CACHE_REDIS_TTL_SECONDS
+)
+
+
+def get_cached_response(doi, hybrid=False):
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    return response_cache.get(doi, hybrid)
+
+
+def peek_cached_response(doi, hybrid=False):
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    return response_cache.peek(doi, hybrid)
+
+
+def set_cached_response(doi, hybrid, response):
+    if not RESPONSE_CACHE_ENABLED:
+        return
+    response_cache.set(doi, hybrid, response)
+
+
+# call this when a pub has new results.
+# its cache entries are dropped once its session commits, so nobody
+# can read the old response back into the cache before the new one is in the db.
+def invalidate_on_commit(my_pub):
+    if not my_pub.id:
+        return
+    # the pub's own session, which isn't this thread's when update_fn runs pubs in parallel
+    session = object_session(my_pub) or db.session()
+    session.info.setdefault("response_cache_dois", set()).add(my_pub.id)
+
+
+def invalidate_after_commit(session):
+    dois = session.info.pop("response_cache_dois", None)
+    if dois:
+        response_cache.invalidate(dois)
+
+
+def forget_after_rollback(session):
+    session.info.pop("response_cache_dois", None)
+
+
+event.listen(db.session, "after_commit", invalidate_after_commit)
+event.listen(db.session, "after_rollback", forget_after_rollback)
@@ -0,0 +1,189 @@
+import os
+import shortuuid
+from threading import Event
+from threading import Lock
+from threading import Thread
+from time import sleep
+from time import time
+
+from app import logger
+from app import redis_rq_conn
+
+# coalesces concurrent identical work, so when a doi is trending only one request
+# per key does the lookup (or the live hybrid scrape) and everyone else gets its result.
+#
+# within a process, waiters block on the leader and get its return value (or its exception).
+# across processes, the leader holds a short redis lock; other workers poll a
+# check function (usually a cache lookup) until the leader's result shows up,
+# the lock goes away, or they give up waiting and do the work themselves.
+# the leader keeps extending its lock while it works, since a hybrid scrape can take
+# longer than SINGLE_FLIGHT_LOCK_SECONDS, and if the leader dies the lock runs out soon after.
+
+SINGLE_FLIGHT_USE_REDIS = os.getenv("SINGLE_FLIGHT_USE_REDIS", "True") == "True"
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", 45))
+SINGLE_FLIGHT_LOCK_SECONDS = int(os.getenv("SINGLE_FLIGHT_LOCK_SECONDS", 60))
+SINGLE_FLIGHT_POLL_SECONDS = 0.1
+
+# only delete the lock if we still own it, in case it expired and someone else took it
+release_lock_script = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+extend_lock_script = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class Call(object):
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    def __init__(self, redis_conn=None, wait_seconds=SINGLE_FLIGHT_WAIT_SECONDS, lock_seconds=SINGLE_FLIGHT_LOCK_SECONDS):
+        self.redis_conn = redis_conn
+        self.wait_seconds = wait_seconds
+        self.lock_seconds = lock_seconds
+        self.lock = Lock()
+        self.calls = {}
+        self.counts = {
+            "leaders": 0,
+            "local_waiters": 0,
+            "redis_waiters": 0,
+            "redis_waits_satisfied": 0,
+            "wait_timeouts": 0
+        }
+        self.release_lock = None
+        self.extend_lock = None
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    # runs fn() once per key at a time and returns its result.
+    # check_fn, if given, is what other processes poll while this one holds the redis lock;
+    # it should return the finished result or None.
+    def do(self, key, fn, check_fn=None):
+        with self.lock:
+            call = self.calls.get(key, None)
+            is_leader = call is None
+            if is_leader:
+                call = Call()
+                self.calls[key] = call
+
+        if not is_leader:
+            self.count("local_waiters")
+            if call.done.wait(self.wait_seconds):
+                if call.error:
+                    raise call.error
+                return call.result
+            logger.info(u"single flight gave up waiting on {}, doing it ourselves".format(key))
+            self.count("wait_timeouts")
+            return fn()
+
+        try:
+            call.result = self.do_with_redis_lock(key, fn, check_fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def do_with_redis_lock(self, key, fn, check_fn):
+        if self.redis_conn is None or check_fn is None:
+            self.count("leaders")
+            return fn()
+
+        lock_key = u"single_flight:{}".format(key)
+        token = shortuuid.uuid()
+        try:
+            got_lock = self.redis_conn.set(lock_key, token, nx=True, ex=self.lock_seconds)
+        except Exception as e:
+            logger.info(u"single flight couldn't take redis lock {}: {}".format(lock_key, e))
+            self.count("leaders")
+            return fn()
+
+        if got_lock:
+            self.count("leaders")
+            done = Event()
+            keep_lock_thread = Thread(target=self.keep_redis_lock, args=(lock_key, token, done), name="single_flight_lock")
+            keep_lock_thread.daemon = True
+            keep_lock_thread.start()
+            try:
+                return fn()
+            finally:
+                done.set()
+                self.release_redis_lock(lock_key, token)
+
+        self.count("redis_waiters")
+        result = self.wait_for_other_process(lock_key, check_fn)
+        if result is not None:
+            self.count("redis_waits_satisfied")
+            return result
+
+        # the other process failed or is too slow.  do it ourselves.
+        self.count("leaders")
+        return fn()
+
+    def wait_for_other_process(self, lock_key, check_fn):
+        give_up_time = time() + self.wait_seconds
+        while time() < give_up_time:
+            sleep(SINGLE_FLIGHT_POLL_SECONDS)
+            result = check_fn()
+            if result is not None:
+                return result
+            try:
+                if not self.redis_conn.exists(lock_key):
+                    # leader finished without leaving a result, maybe an error.  one last look.
+                    return check_fn()
+            except Exception as e:
+                logger.info(u"single flight couldn't check redis lock {}: {}".format(lock_key, e))
+                return None
+
+        logger.info(u"single flight gave up waiting on {}, doing it ourselves".format(lock_key))
+        self.count("wait_timeouts")
+        return None
+
+    # extends the lock every third of its ttl until done is set
+    def keep_redis_lock(self, lock_key, token, done):
+        while not done.wait(self.lock_seconds / 3.0):
+            try:
+                if not self.extend_lock:
+                    self.extend_lock = self.redis_conn.register_script(extend_lock_script)
+                if not self.extend_lock(keys=[lock_key], args=[token, self.lock_seconds]):
+                    # it expired and someone else has it now
+                    return
+            except Exception as e:
+                logger.info(u"single flight couldn't extend redis lock {}: {}".format(lock_key, e))
+
+    def release_redis_lock(self, lock_key, token):
+        try:
+            if not self.release_lock:
+                self.release_lock = self.redis_conn.register_script(release_lock_script)
+            self.release_lock(keys=[lock_key], args=[token])
+        except Exception as e:
+            # it'll expire on its own
+            logger.info(u"single flight couldn't release redis lock {}: {}".format(lock_key, e))
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats["in_flight"] = len(self.calls)
+        return stats
+
+
+if SINGLE_FLIGHT_USE_REDIS:
+    single_flight = SingleFlight(redis_rq_conn)
+else:
+    single_flight = SingleFlight()
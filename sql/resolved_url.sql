@@ -0,0 +1,17 @@
+-- where each doi's landing page is, so scrapes don't have to ask crossref or doi.org every time.
+-- filled in by http_cache.get_crossref_resolve_url, Crossref.get_resolved_url,
+-- put_crossref_in_db.py and python resolved_url.py --filename dois.txt
+-- kind is "resource" (the url the doi is registered to) or "landing page" (after all redirects).
+create table if not exists resolved_url (
+    doi text not null,
+    kind text not null default 'resource',
+    url text not null,
+    source text,
+    updated timestamp without time zone not null default (now() at time zone 'utc'),
+    primary key (doi, kind)
+);
+
+-- for a table made before kind was added:
+-- alter table resolved_url add column kind text not null default 'resource';
+-- update resolved_url set kind='landing page' where source='doi.org';
+-- alter table resolved_url drop constraint resolved_url_pkey, add primary key (doi, kind);
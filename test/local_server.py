@@ -0,0 +1,103 @@
+import socket
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Thread
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    # the scrapers stop reading a page early on purpose, so a client hanging up
+    # in the middle of a body isn't worth a traceback
+    def handle_error(self, request, client_address):
+        pass
+
+
+# a web server on localhost for the scraping tests, so they go through the real
+# http stack without going out to the network.
+# pages maps a path to (status code, headers dict, body), and every request is
+# kept in requests as (method, path, headers dict).  POST bodies are kept in posted
+# as (path, body).
+class LocalServer(object):
+    def __init__(self, pages=None):
+        self.pages = pages or {}
+        self.requests = []
+        self.posted = []
+        self.connections = set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                server.connections.add(self.connection)
+
+            def finish(self):
+                server.connections.discard(self.connection)
+                BaseHTTPRequestHandler.finish(self)
+
+            def do_GET(self):
+                self.respond(send_body=True)
+
+            def do_HEAD(self):
+                self.respond(send_body=False)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server.posted.append((self.path, body))
+                self.respond(send_body=True)
+
+            def respond(self, send_body):
+                server.requests.append((self.command, self.path, dict(self.headers)))
+                (status_code, headers, body) = server.pages.get(self.path, (404, {}, "not found"))
+                if callable(body):
+                    (status_code, headers, body) = body(self)
+                self.send_response(status_code)
+                headers = dict(headers)
+                headers.setdefault("Content-Length", str(len(body)))
+                if headers["Content-Length"] is None:
+                    # no length, so the body ends when the connection does
+                    headers["Connection"] = "close"
+                    self.close_connection = True
+                for (name, value) in headers.iteritems():
+                    if value is not None:
+                        self.send_header(name, value)
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    def url(self, path):
+        return u"http://127.0.0.1:{}{}".format(self.httpd.server_address[1], path)
+
+    def start(self):
+        # test_publication installs requests_cache for the whole run, which would
+        # answer requests to this server from its cache
+        try:
+            import requests_cache
+            requests_cache.uninstall_cache()
+        except ImportError:
+            pass
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        # keep-alive connections would leave their handler threads waiting for another request
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def paths_requested(self, method="GET"):
+        return [path for (request_method, path, headers) in self.requests if request_method == method]
@@ -0,0 +1,155 @@
+import unittest
+import requests
+from time import time
+from nose.tools import assert_equals
+from nose.tools import assert_true
+from nose.tools import assert_is_none
+from nose.tools import assert_raises
+
+from circuit_breaker import CircuitBreaker
+from circuit_breaker import CircuitOpenError
+from circuit_breaker import CIRCUIT_COOLDOWN_SECONDS
+from circuit_breaker import CIRCUIT_FAILURE_THRESHOLD
+from circuit_breaker import circuit_breaker
+from host_scheduler import host_scheduler
+from host_scheduler import HostBucket
+from host_scheduler import HostBusyError
+from http_cache import http_get
+from http_cache import get_shared_adapter
+from http_cache import is_origin_failure
+
+url = "http://repository.example.edu/handle/123"
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=3, window_seconds=60)
+
+    def circuit(self):
+        return self.breaker.circuits["repository.example.edu"]
+
+    def open_it(self):
+        for i in range(3):
+            self.breaker.record_failure(url)
+
+    def cool_down(self):
+        self.circuit().open_until = time() - 1
+
+    def test_closed_until_threshold(self):
+        self.breaker.record_failure(url)
+        self.breaker.record_failure(url)
+        self.breaker.check(url)
+        assert_is_none(self.circuit().open_until)
+
+    def test_opens_at_threshold(self):
+        self.open_it()
+        assert_raises(CircuitOpenError, self.breaker.check, url)
+        assert_equals(self.circuit().skipped, 1)
+        # other hosts aren't affected
+        self.breaker.check("http://www.example.com/")
+
+    def test_old_failures_dont_count(self):
+        self.breaker.record_failure(url)
+        self.breaker.record_failure(url)
+        self.circuit().failure_times = [t - 120 for t in self.circuit().failure_times]
+        self.breaker.record_failure(url)
+        self.breaker.check(url)
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure(url)
+        self.breaker.record_failure(url)
+        self.breaker.record_success(url)
+        self.breaker.record_failure(url)
+        self.breaker.check(url)
+
+    def test_half_open_lets_one_trial_through(self):
+        self.open_it()
+        self.cool_down()
+        self.breaker.check(url)
+        assert_true(self.circuit().trial_in_flight)
+        # only one trial at a time
+        assert_raises(CircuitOpenError, self.breaker.check, url)
+
+    def test_trial_success_closes(self):
+        self.open_it()
+        self.cool_down()
+        self.breaker.check(url)
+        self.breaker.record_success(url)
+        assert_is_none(self.circuit().open_until)
+        assert_equals(self.circuit().cooldown, CIRCUIT_COOLDOWN_SECONDS)
+        self.breaker.check(url)
+        self.breaker.check(url)
+
+    def test_trial_failure_reopens_for_longer(self):
+        self.open_it()
+        self.cool_down()
+        self.breaker.check(url)
+        self.breaker.record_failure(url)
+        assert_equals(self.circuit().cooldown, CIRCUIT_COOLDOWN_SECONDS * 2)
+        assert_equals(self.circuit().times_opened, 2)
+        assert_raises(CircuitOpenError, self.breaker.check, url)
+
+    def test_stuck_trial_lets_another_through(self):
+        self.open_it()
+        self.cool_down()
+        self.breaker.check(url)
+        self.circuit().trial_started = time() - 60*60
+        self.breaker.check(url)
+
+    def test_released_trial_lets_another_through(self):
+        self.open_it()
+        self.cool_down()
+        self.breaker.check(url)
+        self.breaker.release_trial(url)
+        self.breaker.check(url)
+        assert_true(self.circuit().trial_in_flight)
+
+    def test_stats(self):
+        self.open_it()
+        stats = self.breaker.stats()
+        assert_equals(stats["hosts_tracked"], 1)
+        assert_equals(stats["open"][0]["host"], "repository.example.edu")
+
+
+class TestDelayedAdapterCircuit(unittest.TestCase):
+
+    def setUp(self):
+        host_scheduler.buckets["127.0.0.1"] = HostBucket(1, 1)
+        for i in range(CIRCUIT_FAILURE_THRESHOLD):
+            circuit_breaker.record_failure("http://127.0.0.1/")
+
+    def tearDown(self):
+        circuit_breaker.circuits.pop("127.0.0.1", None)
+        host_scheduler.buckets.pop("127.0.0.1", None)
+
+    def test_open_circuit_doesnt_wait_for_a_turn(self):
+        start = time()
+        for i in range(3):
+            assert_raises(CircuitOpenError, http_get, "http://127.0.0.1:1/page")
+        assert_true(time() - start < 1)
+        assert_equals(host_scheduler.buckets["127.0.0.1"].requests, 0)
+
+    def test_trial_released_when_host_is_busy(self):
+        circuit_breaker.circuits["127.0.0.1"].open_until = time() - 1
+        host_scheduler.buckets["127.0.0.1"].block(time() + 60*60)
+        assert_raises(HostBusyError, http_get, "http://127.0.0.1:1/page")
+        assert_true(not circuit_breaker.circuits["127.0.0.1"].trial_in_flight)
+
+    def test_proxy_failure_isnt_the_hosts(self):
+        host_scheduler.buckets["example.com"] = HostBucket(1000, 1000)
+        try:
+            request = requests.Request("GET", "http://publisher.example.com/article").prepare()
+            # nothing listens on port 1, so connecting to the proxy fails
+            assert_raises(requests.exceptions.ConnectionError, get_shared_adapter().send, request,
+                          timeout=5, proxies={"http": "http://127.0.0.1:1"})
+            assert_is_none(circuit_breaker.circuits.get("publisher.example.com", None))
+        finally:
+            host_scheduler.buckets.pop("example.com", None)
+
+    def test_which_failures_are_the_hosts(self):
+        assert_true(is_origin_failure(requests.exceptions.ConnectionError()))
+        assert_true(is_origin_failure(requests.exceptions.ConnectTimeout()))
+        assert_true(is_origin_failure(requests.exceptions.ReadTimeout(), proxied=True))
+        assert_true(not is_origin_failure(requests.exceptions.ProxyError()))
+        assert_true(not is_origin_failure(requests.exceptions.ConnectTimeout(), proxied=True))
@@ -0,0 +1,66 @@
+import unittest
+from nose.tools import assert_equals
+from nose.tools import assert_true
+
+import http_cache
+from http_cache import get_requests_session
+from crawlera_sessions import CrawleraSessionPool
+from host_scheduler import host_scheduler
+from host_scheduler import HostBucket
+from local_server import LocalServer
+
+
+class TestCrawleraSessionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = CrawleraSessionPool(size=2, max_uses=3)
+        self.pool.add("s1")
+        self.pool.add("s2")
+
+    def test_handing_out_isnt_a_use(self):
+        for i in range(10):
+            with self.pool.lock:
+                self.pool.take()
+        assert_equals(self.pool.sessions, ["s1", "s2"])
+        assert_equals(self.pool.stats()["handed_out"], 10)
+
+    def test_retired_after_max_requests(self):
+        for i in range(2):
+            self.pool.record_use("s1")
+        assert_true(not self.pool.is_used_up("s1"))
+        self.pool.record_use("s1")
+        assert_true(self.pool.is_used_up("s1"))
+        assert_equals(self.pool.sessions, ["s2"])
+        assert_equals(self.pool.stats()["retired_for_uses"], 1)
+
+    def test_other_sessions_arent_counted(self):
+        self.pool.record_use("not-ours")
+        assert_true(not self.pool.is_used_up("not-ours"))
+        assert_equals(self.pool.stats()["requests"], 0)
+
+
+class TestRequestsCounted(unittest.TestCase):
+
+    def setUp(self):
+        host_scheduler.buckets["example.com"] = HostBucket(1000, 1000)
+        self.old_pool = http_cache.crawlera_session_pool
+        http_cache.crawlera_session_pool = CrawleraSessionPool(size=1, max_uses=50)
+        http_cache.crawlera_session_pool.add("s1")
+        # a proxy is asked for the whole url
+        self.proxy = LocalServer({
+            "http://publisher.example.com/doi": (302, {"Location": "http://publisher.example.com/article"}, ""),
+            "http://publisher.example.com/article": (200, {}, "the article")
+        }).start()
+
+    def tearDown(self):
+        self.proxy.stop()
+        http_cache.crawlera_session_pool = self.old_pool
+        host_scheduler.buckets.pop("example.com", None)
+
+    def test_each_proxied_request_counts(self):
+        r = get_requests_session().get("http://publisher.example.com/doi",
+                                       headers={"X-Crawlera-Session": "s1"},
+                                       proxies={"http": self.proxy.url("")})
+        assert_equals(r.content, "the article")
+        # the redirect hop went through the session too
+        assert_equals(http_cache.crawlera_session_pool.uses["s1"], 2)
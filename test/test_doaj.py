@@ -0,0 +1,67 @@
+import unittest
+from ddt import ddt, data
+from nose.tools import assert_equals
+
+from oa_local import is_open_via_doaj_issn
+from oa_local import is_open_via_doaj_journal
+from oa_local import DoajLookup
+
+
+# (issns, pub year, license) from data/doaj_issns.json.
+# False is not in doaj; None is in doaj without a license.
+issn_lookups = [
+    (["1932-6203"], None, "cc-by"),                 # PLOS ONE
+    (["1932-6203"], 2010, "cc-by"),
+    (["1932-6203"], 2005, False),                   # before it was in doaj
+    # 2178-4884 has a CC BY-NC row from 2012, then a CC BY row from 2009
+    (["2178-4884"], None, "cc-by-nc"),
+    (["2178-4884"], 2013, "cc-by-nc"),
+    (["2178-4884"], 2010, "cc-by"),
+    (["2178-4884"], 2005, False),
+    (["0001-3714"], 2000, None),
+    (["0000-0000"], None, False),
+    (["0000-0000", "2045-2322"], 2012, "cc-by"),    # the first issn that's in doaj
+    (["2459-3338", "1932-6203"], 2012, "cc-by-nc-nd"),
+    ([], None, False),
+    (None, None, False),
+]
+
+# (journal names, pub year, license) from data/doaj_titles.json
+journal_lookups = [
+    ([u"PLOS ONE"], 2010, "cc-by"),
+    ([u"plos one"], 2010, "cc-by"),
+    (u"Nature Communications", 2016, "cc-by"),
+    (u"Nature Communications", 2014, False),
+    # two Journal of Botany rows: CC BY-NC-ND from 2005, then CC BY from 2009
+    ([u"Journal of Botany"], 2006, "cc-by-nc-nd"),
+    ([u"Journal of Botany"], 2004, False),
+    ([u"Not A Journal", u"Scientific Reports"], 2012, "cc-by"),
+    ([None, u"Not A Journal"], 2012, False),
+    (None, None, False),
+]
+
+
+@ddt
+class TestDoajLookup(unittest.TestCase):
+
+    @data(*issn_lookups)
+    def test_issn_lookups(self, test_data):
+        (issns, pub_year, license) = test_data
+        assert_equals(is_open_via_doaj_issn(issns, pub_year), license)
+
+    @data(*journal_lookups)
+    def test_journal_lookups(self, test_data):
+        (journals, pub_year, license) = test_data
+        assert_equals(is_open_via_doaj_journal(journals, pub_year), license)
+
+    def test_first_open_row_wins(self):
+        lookup = DoajLookup(
+            [("1234-5678", "CC BY", 2010), ("1234-5678", "CC BY-NC", 2000), ("1234-5678", "CC BY-SA", None)],
+            [("Journal of Tests", "CC BY-ND", 2005)])
+        assert_equals(lookup.license_for_issn("1234-5678"), "cc-by")
+        assert_equals(lookup.license_for_issn("1234-5678", 2012), "cc-by")
+        assert_equals(lookup.license_for_issn("1234-5678", 2005), "cc-by-nc")
+        assert_equals(lookup.license_for_issn("1234-5678", 1995), "cc-by-sa")
+        assert_equals(lookup.license_for_issn("0000-0000"), False)
+        assert_equals(lookup.license_for_title("JOURNAL OF TESTS", 2006), "cc-by-nd")
+        assert_equals(lookup.license_for_title("journal of tests", 2004), False)
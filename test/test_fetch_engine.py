@@ -0,0 +1,146 @@
+import unittest
+from threading import Event
+from threading import Lock
+from threading import current_thread
+from time import sleep
+from time import time
+from nose.tools import assert_equals
+from nose.tools import assert_is_none
+from nose.tools import assert_raises
+from nose.tools import assert_true
+
+from fetch_engine import FetchEngine
+from fetch_engine import DeadlineExceeded
+from fetch_engine import TaskCancelled
+from fetch_engine import get_task_deadline
+from http_cache import http_get
+from host_scheduler import host_scheduler
+from host_scheduler import HostBucket
+from local_server import LocalServer
+
+
+# counts how many calls are in it at once
+class Gauge(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.current = 0
+        self.most = 0
+
+    def hold(self, seconds):
+        with self.lock:
+            self.current += 1
+            self.most = max(self.most, self.current)
+        sleep(seconds)
+        with self.lock:
+            self.current -= 1
+
+
+class TestFetchEngine(unittest.TestCase):
+
+    def test_concurrency_cap(self):
+        engine = FetchEngine(concurrency=2)
+        gauge = Gauge()
+        tasks = engine.map(gauge.hold, [[0.05]] * 6)
+        assert_equals([task.error for task in tasks], [None] * 6)
+        assert_equals(gauge.most, 2)
+
+    def test_map_keeps_order(self):
+        engine = FetchEngine(concurrency=4)
+        tasks = engine.map(lambda n: sleep(0.01 * (5 - n)) or n * 10, [[n] for n in range(5)])
+        assert_equals([task.result for task in tasks], [0, 10, 20, 30, 40])
+
+    def test_skipped_if_not_started_by_deadline(self):
+        engine = FetchEngine(concurrency=1)
+        release = Event()
+        ran = []
+        blocker = engine.submit(release.wait)
+        late = engine.submit(ran.append, ["late"], deadline_seconds=0.05)
+        sleep(0.1)
+        release.set()
+        blocker.wait()
+        late.done.wait(1)
+        assert_true(isinstance(late.error, DeadlineExceeded))
+        assert_equals(ran, [])
+        assert_equals(engine.stats()["skipped_past_deadline"], 1)
+
+    def test_wait_gives_up_at_deadline(self):
+        engine = FetchEngine(concurrency=1)
+        release = Event()
+        task = engine.submit(release.wait, deadline_seconds=0.05)
+        start = time()
+        assert_true(not task.wait())
+        assert_true(time() - start < 1)
+        assert_true(isinstance(task.error, DeadlineExceeded))
+        release.set()
+
+    def test_running_task_stopped_at_its_next_request(self):
+        host_scheduler.buckets["127.0.0.1"] = HostBucket(1000, 1000)
+        server = LocalServer({"/page": (200, {}, "hi")}).start()
+        try:
+            def fetch_twice():
+                http_get(server.url("/page"))
+                sleep(0.3)
+                http_get(server.url("/page"))
+
+            engine = FetchEngine(concurrency=1)
+            task = engine.submit(fetch_twice, deadline_seconds=0.2)
+            task.done.wait(5)
+            assert_true(isinstance(task.error, DeadlineExceeded))
+            assert_equals(server.paths_requested(), ["/page"])
+        finally:
+            server.stop()
+
+    def test_deadline_only_set_while_task_runs(self):
+        engine = FetchEngine(concurrency=1)
+        task = engine.submit(get_task_deadline, deadline_seconds=10)
+        task.wait()
+        assert_equals(task.result, task.deadline)
+        assert_is_none(get_task_deadline())
+
+    def test_cancel(self):
+        engine = FetchEngine(concurrency=1)
+        release = Event()
+        ran = []
+        blocker = engine.submit(release.wait)
+        cancelled = engine.submit(ran.append, ["cancelled"])
+        cancelled.cancel()
+        release.set()
+        blocker.wait()
+        cancelled.wait()
+        assert_true(isinstance(cancelled.error, TaskCancelled))
+        assert_equals(ran, [])
+        assert_equals(engine.stats()["cancelled"], 1)
+
+    def test_nested_work_runs_in_parallel(self):
+        engine = FetchEngine(concurrency=1, nested_concurrency=4)
+        gauge = Gauge()
+        outer = engine.submit(lambda: engine.map(gauge.hold, [[0.1]] * 4))
+        assert_true(outer.wait())
+        assert_equals([task.error for task in outer.result], [None] * 4)
+        assert_equals(gauge.most, 4)
+        assert_equals(engine.stats()["nested"]["submitted"], 4)
+
+    def test_nested_work_gets_the_outer_deadline(self):
+        engine = FetchEngine(concurrency=1)
+
+        def submit_inner():
+            inner = engine.submit(get_task_deadline, deadline_seconds=600)
+            inner.wait()
+            return inner.result
+
+        outer = engine.submit(submit_inner, deadline_seconds=5)
+        outer.wait()
+        assert_equals(outer.result, outer.deadline)
+
+    def test_inline_past_max_nesting(self):
+        engine = FetchEngine(concurrency=1, max_nesting=1)
+        outer = engine.submit(lambda: engine.submit(lambda: current_thread().name).result == current_thread().name)
+        outer.wait()
+        assert_true(outer.result)
+        assert_is_none(engine.nested_engine)
+        assert_equals(engine.stats()["ran_inline"], 1)
+
+    def test_timeout_is_a_requests_timeout(self):
+        import requests
+        with assert_raises(requests.exceptions.Timeout):
+            raise DeadlineExceeded(u"past it")
@@ -0,0 +1,93 @@
+import unittest
+from nose.tools import assert_equals
+from nose.tools import assert_almost_equals
+from nose.tools import assert_is_none
+from nose.tools import assert_raises
+from nose.tools import assert_true
+
+from host_scheduler import HostBucket
+from host_scheduler import HostScheduler
+from host_scheduler import HostBusyError
+from host_scheduler import get_registered_domain
+from host_scheduler import HOST_RATE_PER_SECOND
+from host_scheduler import HOST_BURST
+from host_scheduler import HOST_MAX_WAIT_SECONDS
+from fetch_engine import FETCH_MAX_THREADS
+
+
+class TestHostBucket(unittest.TestCase):
+
+    def test_burst_then_spaced_at_rate(self):
+        bucket = HostBucket(rate=2, burst=3)
+        now = bucket.last_refill
+        waits = [bucket.reserve(now) for i in range(5)]
+        assert_equals(waits[:3], [0, 0, 0])
+        assert_almost_equals(waits[3], 0.5)
+        assert_almost_equals(waits[4], 1.0)
+
+    def test_waiters_spaced_at_reduced_rate_after_block(self):
+        bucket = HostBucket(rate=2, burst=5)
+        now = bucket.last_refill
+        bucket.rate = 1
+        bucket.block(now + 10)
+        waits = [bucket.reserve(now) for i in range(4)]
+        assert_almost_equals(waits[0], 10)
+        assert_almost_equals(waits[1], 11)
+        assert_almost_equals(waits[2], 12)
+        assert_almost_equals(waits[3], 13)
+
+    def test_no_burst_right_after_block(self):
+        bucket = HostBucket(rate=1, burst=5)
+        now = bucket.last_refill
+        bucket.block(now + 10)
+        # just after the block ends there's one token, not a burst's worth
+        waits = [bucket.reserve(now + 10.5) for i in range(3)]
+        assert_almost_equals(waits[0], 0)
+        assert_almost_equals(waits[1], 0.5)
+        assert_almost_equals(waits[2], 1.5)
+
+    def test_shorter_block_doesnt_shorten_a_longer_one(self):
+        bucket = HostBucket(rate=1, burst=5)
+        now = bucket.last_refill
+        bucket.block(now + 10)
+        bucket.block(now + 5)
+        assert_equals(bucket.blocked_until, now + 10)
+        assert_equals(bucket.blocks, 1)
+
+    def test_turns_away_past_max_wait(self):
+        bucket = HostBucket(rate=1, burst=1)
+        now = bucket.last_refill
+        bucket.reserve(now)
+        bucket.reserve(now)
+        assert_is_none(bucket.reserve(now, max_wait=1.5))
+        assert_equals(bucket.turned_away, 1)
+        # turning one away doesn't use up a token
+        assert_almost_equals(bucket.reserve(now, max_wait=2), 2)
+
+    def test_every_fetch_thread_gets_a_turn_by_default(self):
+        bucket = HostBucket(rate=HOST_RATE_PER_SECOND, burst=HOST_BURST)
+        now = bucket.last_refill
+        for i in range(FETCH_MAX_THREADS):
+            assert_true(bucket.reserve(now, max_wait=HOST_MAX_WAIT_SECONDS) is not None)
+        assert_equals(bucket.turned_away, 0)
+
+
+class TestHostScheduler(unittest.TestCase):
+
+    def test_throttle_halves_rate_and_blocks(self):
+        scheduler = HostScheduler(rate=2, burst=2)
+        scheduler.record_response("http://www.example.com/a", 429, {"Retry-After": "30"})
+        bucket = scheduler.buckets["example.com"]
+        assert_equals(bucket.rate, 1)
+        assert_equals(bucket.throttled, 1)
+        assert_equals(bucket.blocks, 1)
+
+    def test_wait_for_turn_raises_when_too_long(self):
+        scheduler = HostScheduler(rate=2, burst=2)
+        scheduler.record_response("http://www.example.com/a", 503, {"Retry-After": "30"})
+        assert_raises(HostBusyError, scheduler.wait_for_turn, "http://example.com/b", 5)
+
+    def test_registered_domain(self):
+        assert_equals(get_registered_domain("https://www.sciencedirect.com/x"), "sciencedirect.com")
+        assert_equals(get_registered_domain("http://eprints.lib.ox.ac.uk/1"), "ox.ac.uk")
+        assert_equals(get_registered_domain("http://127.0.0.1:8000/"), "127.0.0.1")
@@ -0,0 +1,150 @@
+import requests
+import shutil
+import tempfile
+import unittest
+from nose.tools import assert_equals
+from nose.tools import assert_raises
+from nose.tools import assert_is_none
+from nose.tools import assert_true
+
+import http_cache
+from http_cache import http_get
+from http_cache import is_response_too_large
+from http_cache import is_unread_stream
+from http_cache import get_connection_stats
+from http_cache import get_shared_adapter
+from http_cache import read_bounded_content
+from host_scheduler import host_scheduler
+from host_scheduler import HostBucket
+from page_cache import TieredPageCache
+from page_cache import DiskPageCache
+from page_cache import build_hash_key
+from oa_pdf import convert_pdf_to_txt
+from local_server import LocalServer
+
+
+class FakePub(object):
+    def __init__(self, doi):
+        self.doi = doi
+        self.tdm_api = None
+        self.publisher = None
+
+    def is_same_publisher(self, publisher):
+        return False
+
+
+class TestHttpGetCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.old_page_cache = http_cache.page_cache
+        http_cache.page_cache = TieredPageCache([DiskPageCache(self.cache_dir, 1000*1000)])
+        host_scheduler.buckets["127.0.0.1"] = HostBucket(1000, 1000)
+        self.server = LocalServer({
+            "/landing": (200, {"Content-Type": "text/html", "ETag": '"v1"'}, "<html>landing page</html>")
+        }).start()
+        self.pub = FakePub("10.123/abc")
+
+    def tearDown(self):
+        self.server.stop()
+        http_cache.page_cache = self.old_page_cache
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def is_cached(self, url):
+        return http_cache.page_cache.get(build_hash_key(url)) is not None
+
+    def test_not_cached_by_default(self):
+        url = self.server.url("/landing")
+        r = http_get(url, related_pub=self.pub)
+        assert_equals(r.content, "<html>landing page</html>")
+        assert_true(not self.is_cached(url))
+
+    def test_cached_when_caller_asks(self):
+        url = self.server.url("/landing")
+        http_get(url, related_pub=self.pub, cache_enabled=True)
+        assert_true(self.is_cached(url))
+        r = http_get(url, related_pub=self.pub, cache_enabled=True)
+        assert_equals(r.content, "<html>landing page</html>")
+        assert_equals(self.server.paths_requested(), ["/landing"])
+
+    def test_streamed_responses_never_cached(self):
+        url = self.server.url("/landing")
+        r = http_get(url, stream=True, related_pub=self.pub, cache_enabled=True)
+        r.close()
+        assert_true(not self.is_cached(url))
+
+    def test_streamed_request_doesnt_use_cached_copy(self):
+        url = self.server.url("/landing")
+        http_get(url, related_pub=self.pub, cache_enabled=True)
+        r = http_get(url, stream=True, related_pub=self.pub, cache_enabled=True)
+        assert_true(not isinstance(r, http_cache.CachedResponse))
+        r.close()
+        assert_equals(self.server.paths_requested(), ["/landing", "/landing"])
+
+
+class TestBoundedReads(unittest.TestCase):
+
+    def setUp(self):
+        host_scheduler.buckets["127.0.0.1"] = HostBucket(1000, 1000)
+        self.server = LocalServer({
+            "/no-length": (200, {"Content-Length": None}, "x" * 5000),
+            "/says-huge": (200, {"Content-Length": str(http_cache.MAX_BODY_BYTES + 1)}, "x" * 10)
+        }).start()
+        self.old_max_body_bytes = http_cache.MAX_BODY_BYTES
+
+    def tearDown(self):
+        http_cache.MAX_BODY_BYTES = self.old_max_body_bytes
+        self.server.stop()
+
+    def test_too_large_check_doesnt_read_the_body(self):
+        r = http_get(self.server.url("/no-length"), stream=True)
+        assert_true(not is_response_too_large(r))
+        assert_true(is_unread_stream(r))
+        r.close()
+
+    def test_too_large_from_header(self):
+        r = http_get(self.server.url("/says-huge"), stream=True)
+        assert_true(is_response_too_large(r))
+        r.close()
+
+    def test_bounded_read_stops_at_the_cap(self):
+        r = http_get(self.server.url("/no-length"), stream=True)
+        assert_is_none(read_bounded_content(r, max_bytes=1000))
+        r.close()
+        r = http_get(self.server.url("/no-length"), stream=True)
+        assert_equals(len(read_bounded_content(r, max_bytes=10000)), 5000)
+        assert_equals(len(r.content), 5000)
+
+    def test_pdf_too_large_to_convert(self):
+        http_cache.MAX_BODY_BYTES = 1000
+        assert_is_none(convert_pdf_to_txt(self.server.url("/no-length")))
+
+
+class TestConnectionStats(unittest.TestCase):
+
+    def setUp(self):
+        host_scheduler.buckets["127.0.0.1"] = HostBucket(1000, 1000)
+        self.server = LocalServer({"/page": (200, {}, "hi")}).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_keep_alive_connection_reused(self):
+        before = get_connection_stats()
+        for i in range(3):
+            assert_equals(http_get(self.server.url("/page")).content, "hi")
+        after = get_connection_stats()
+        assert_equals(after["requests"] - before["requests"], 3)
+        assert_equals(after["new_connections"] - before["new_connections"], 1)
+        assert_equals(after["reused_connections"] - before["reused_connections"], 2)
+
+    def test_failed_connects_dont_hide_reuse(self):
+        host_scheduler.buckets["example.com"] = HostBucket(1000, 1000)
+        try:
+            # nothing listens on port 1, so every try at connecting to the proxy fails
+            request = requests.Request("GET", "http://publisher.example.com/article").prepare()
+            assert_raises(requests.exceptions.ConnectionError, get_shared_adapter().send, request,
+                          timeout=5, proxies={"http": "http://127.0.0.1:1"})
+        finally:
+            host_scheduler.buckets.pop("example.com", None)
+        self.test_keep_alive_connection_reused()
@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from threading import Event
+from nose.tools import assert_equals
+
+import log_shipper
+from log_shipper import LogShipper
+from local_server import LocalServer
+
+
+def read_events(file_name):
+    with open(file_name) as fh:
+        return [json.loads(line) for line in fh]
+
+
+# a shipper whose sends wait until the test lets them go
+class BlockedShipper(LogShipper):
+    def __init__(self, **kwargs):
+        super(BlockedShipper, self).__init__(**kwargs)
+        self.sending = Event()
+        self.unblocked = Event()
+        self.batches = []
+
+    def send(self, batch):
+        self.sending.set()
+        self.unblocked.wait(10)
+        self.batches.append(batch)
+
+
+class TestLogShipperFile(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.temp_dir, "events.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_stop_sends_whats_queued(self):
+        shipper = LogShipper(file_name=self.file_name, flush_seconds=60)
+        shipper.ship("search", {"q": "cats"})
+        shipper.ship("doi", {"doi": "10.123/abc"})
+        shipper.ship("search", {"q": "dogs"})
+        shipper.stop()
+        assert_equals(read_events(self.file_name), [
+            {"tag": "search", "event": {"q": "cats"}},
+            {"tag": "doi", "event": {"doi": "10.123/abc"}},
+            {"tag": "search", "event": {"q": "dogs"}}
+        ])
+        assert_equals(shipper.stats()["shipped"], 3)
+        assert_equals(shipper.thread.is_alive(), False)
+
+    def test_sent_in_batches(self):
+        shipper = BlockedShipper(batch_size=2, flush_seconds=60)
+        shipper.unblocked.set()
+        for i in range(5):
+            shipper.ship("search", {"i": i})
+        shipper.stop()
+        assert_equals([len(batch) for batch in shipper.batches], [2, 2, 1])
+        assert_equals([event["i"] for batch in shipper.batches for (tag, event) in batch], range(5))
+
+    def test_dropped_when_the_queue_is_full(self):
+        shipper = BlockedShipper(queue_size=1, batch_size=1, flush_seconds=0.1)
+        shipper.ship("search", {"i": 0})
+        shipper.sending.wait(10)
+        # the thread is stuck sending the first event, so the queue holds one more
+        shipper.ship("search", {"i": 1})
+        shipper.ship("search", {"i": 2})
+        shipper.ship("search", {"i": 3})
+        assert_equals(shipper.stats()["dropped"], 2)
+        shipper.unblocked.set()
+        shipper.stop()
+        assert_equals([event["i"] for batch in shipper.batches for (tag, event) in batch], [0, 1])
+        assert_equals(shipper.stats()["shipped"], 2)
+
+
+class TestLogShipperLoggly(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer({
+            "/bulk/tag/search/": (200, {}, "ok"),
+            "/bulk/tag/doi/": (200, {}, "ok")
+        }).start()
+        self.old_url = log_shipper.LOGGLY_BULK_URL
+        log_shipper.LOGGLY_BULK_URL = self.server.url("/bulk/tag/{}/")
+
+    def tearDown(self):
+        log_shipper.LOGGLY_BULK_URL = self.old_url
+        self.server.stop()
+
+    def test_one_post_per_tag(self):
+        shipper = LogShipper(flush_seconds=60)
+        shipper.ship("search", {"q": "cats"})
+        shipper.ship("doi", {"doi": "10.123/abc"})
+        shipper.ship("search", {"q": "dogs"})
+        shipper.stop()
+        assert_equals(sorted(self.server.posted), [
+            ("/bulk/tag/doi/", '{"doi": "10.123/abc"}'),
+            ("/bulk/tag/search/", '{"q": "cats"}\n{"q": "dogs"}')
+        ])
+        assert_equals(shipper.stats()["shipped"], 3)
+
+    def test_failed_sends_counted(self):
+        shipper = LogShipper(flush_seconds=60)
+        shipper.ship("not-a-tag", {"q": "cats"})
+        shipper.stop()
+        assert_equals(shipper.stats()["failed"], 1)
+        assert_equals(shipper.stats()["shipped"], 0)
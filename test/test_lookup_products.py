@@ -0,0 +1,95 @@
+import unittest
+from nose.tools import assert_equals
+from nose.tools import assert_is_none
+from nose.tools import assert_raises
+from nose.tools import assert_true
+
+import publication
+from publication import lookup_products
+from publication import get_pubs_from_biblio
+from util import NoDoiException
+
+
+# stands in for the Crossref table: the rows in it, and every IN query made against it
+class FakeCrossref(object):
+    rows = {}
+    queries = []
+
+    def __init__(self, **biblio):
+        self.id = biblio["doi"]
+        self.from_db = False
+        self.times_recalculated = 0
+
+    def reset_vars(self):
+        pass
+
+    def recalculate(self, quiet=False):
+        self.times_recalculated += 1
+
+
+class FakeIdColumn(object):
+    def in_(self, dois):
+        FakeCrossref.queries.append(list(dois))
+        return list(dois)
+
+
+class FakeQuery(object):
+    def filter(self, dois):
+        self.dois = dois
+        return self
+
+    def all(self):
+        return [FakeCrossref.rows[doi] for doi in self.dois if doi in FakeCrossref.rows]
+
+
+def make_row(doi):
+    my_pub = FakeCrossref(doi=doi)
+    my_pub.from_db = True
+    return my_pub
+
+
+class TestLookupProducts(unittest.TestCase):
+
+    def setUp(self):
+        self.old_crossref = publication.Crossref
+        FakeCrossref.id = FakeIdColumn()
+        FakeCrossref.query = FakeQuery()
+        FakeCrossref.rows = dict([(doi, make_row(doi)) for doi in [u"10.1/a", u"10.1/b", u"10.1/c", u"10.1/d"]])
+        FakeCrossref.queries = []
+        publication.Crossref = FakeCrossref
+
+    def tearDown(self):
+        publication.Crossref = self.old_crossref
+
+    def test_one_query_per_chunk(self):
+        biblios = [{"doi": doi} for doi in [u"10.1/a", u"10.1/b", u"10.1/c", u"10.1/d", u"10.1/e"]]
+        my_pubs = lookup_products(biblios, chunk_size=2)
+        assert_equals(len(FakeCrossref.queries), 3)
+        assert_true(all([len(dois) <= 2 for dois in FakeCrossref.queries]))
+        assert_equals(sorted(sum(FakeCrossref.queries, [])), [u"10.1/a", u"10.1/b", u"10.1/c", u"10.1/d", u"10.1/e"])
+        assert_equals(len(my_pubs), 5)
+
+    def test_one_pub_per_biblio_in_order(self):
+        biblios = [{"doi": u"10.1/c"}, {"doi": u"10.1/new"}, {"doi": u"https://doi.org/10.1/A"}, {}, {"doi": u"10.1/c"}]
+        my_pubs = lookup_products(biblios)
+        assert_equals(my_pubs[0].id, u"10.1/c")
+        assert_true(my_pubs[0].from_db)
+        # not in the table, so a fresh one like lookup_product makes
+        assert_equals(my_pubs[1].id, u"10.1/new")
+        assert_true(not my_pubs[1].from_db)
+        # dois are cleaned before they're looked up
+        assert_true(my_pubs[2] is FakeCrossref.rows[u"10.1/a"])
+        assert_is_none(my_pubs[3])
+        # the same doi twice is the same pub, looked up once
+        assert_true(my_pubs[4] is my_pubs[0])
+        assert_equals(sorted(FakeCrossref.queries[0]), [u"10.1/a", u"10.1/c", u"10.1/new"])
+
+    def test_get_pubs_recalculates_each_pub_once(self):
+        biblios = [{"doi": u"10.1/b"}, {"doi": u"10.1/b"}, {"doi": u"10.1/d"}]
+        my_pubs = get_pubs_from_biblio(biblios)
+        assert_equals([my_pub.id for my_pub in my_pubs], [u"10.1/b", u"10.1/b", u"10.1/d"])
+        assert_equals([my_pub.times_recalculated for my_pub in my_pubs], [1, 1, 1])
+
+    def test_get_pubs_needs_a_doi_for_every_biblio(self):
+        assert_raises(NoDoiException, get_pubs_from_biblio, [{"doi": u"10.1/b"}, {"title": u"no doi"}])
+        assert_equals(FakeCrossref.queries, [])
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+from ddt import ddt, data
+from nose.tools import assert_equals
+from nose.tools import assert_true
+
+import oa_local
+from oa_local import find_normalized_license
+from oa_local import is_open_via_datacite_prefix
+from oa_local import load_datacite_doi_prefixes
+
+
+# (text on the page, license find_normalized_license should say)
+license_texts = [
+    (u"<p>This article is under CC BY-NC-ND 4.0</p>", "cc-by-nc-nd"),
+    (u"Creative Commons Attribution-NonCommercial-NoDerivs", "cc-by-nc-nd"),
+    (u"CCBYNCSA", "cc-by-nc-sa"),
+    (u"Creative Commons Attribution-ShareAlike", "cc-by-sa"),
+    (u"cc by nd", "cc-by-nd"),
+    (u"http://creativecommons.org/licenses/by-nc/3.0/", "cc-by-nc"),
+    (u"https://creativecommons.org/licenses/by/4.0/legalcode", "cc-by"),
+    (u"Creative Commons Attribution License", "cc-by"),
+    (u"CC-BY", "cc-by"),
+    (u"c c - b y", "cc-by"),
+    ("CC BY-SA", "cc-by-sa"),
+    (u"https://creativecommons.org/publicdomain/zero/1.0/", "cc0"),
+    (u"this work is in the public domain", "pd"),
+    (u"publicdomain, but works not in the public domain are excluded", None),
+    (u"http://www.elsevier.com/open-access/userlicense/1.0/", "elsevier-specific: oa user license"),
+    (u"http://pubs.acs.org/page/policy/authorchoice_termsofuse.html", "acs-specific: authorchoice/editors choice usage agreement"),
+    (u"http://www.koreanjpathol.org/authors/access.php", "cc-by-nc"),
+    # the more specific license wins, wherever each one is on the page
+    (u"Licensed CC BY, see also CC BY-NC-ND", "cc-by-nc-nd"),
+    (u"CC BY-NC-ND, see also CC BY", "cc-by-nc-nd"),
+    (u"http://creativecommons.org/licenses/by/4.0/ and Creative Commons Zero", "cc-by"),
+    (u"<a href='http://creativecommons.org/about'>about creative commons</a>", None),
+    (u"all rights reserved", None),
+    (u"\u00e9t\u00e9 " * 100, None),
+    (u"", None),
+    (None, None),
+]
+
+
+@ddt
+class TestFindNormalizedLicense(unittest.TestCase):
+
+    @data(*license_texts)
+    def test_license_texts(self, test_data):
+        (text, license) = test_data
+        assert_equals(find_normalized_license(text), license)
+
+
+class TestDatacitePrefixes(unittest.TestCase):
+
+    def setUp(self):
+        self.old_prefix_set = oa_local.datacite_doi_prefix_set
+
+    def tearDown(self):
+        oa_local.datacite_doi_prefix_set = self.old_prefix_set
+
+    def test_registrant_matches(self):
+        assert_true(is_open_via_datacite_prefix(u"10.5061/dryad.abc123"))
+        assert_true(is_open_via_datacite_prefix(u"10.5281/zenodo.12345"))
+        # the doi suffix can have more slashes
+        assert_true(is_open_via_datacite_prefix(u"10.6084/m9.figshare.1/2"))
+
+    def test_longer_registrant_doesnt_match(self):
+        assert_true(not is_open_via_datacite_prefix(u"10.50610/dryad.abc123"))
+        assert_true(not is_open_via_datacite_prefix(u"10.50619/dryad.abc123"))
+        assert_true(not is_open_via_datacite_prefix(u"10.52811/zenodo.12345"))
+        assert_true(not is_open_via_datacite_prefix(u"10.1016/j.cell.2017.01.001"))
+
+    def test_not_a_doi(self):
+        for doi in [None, u"", u"10.5061", u"dryad.abc123"]:
+            assert_true(not is_open_via_datacite_prefix(doi))
+
+    def test_paywalled_prefixes_excluded(self):
+        assert_true(not is_open_via_datacite_prefix(u"10.1515/fabl.1988.29.1.21"))
+        assert_true(not is_open_via_datacite_prefix(u"10.1513/AnnalsATS.201610-815OC"))
+
+    def test_load_prefix_file(self):
+        (fd, filename) = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as fh:
+            fh.write("10.9999\n  10.8888/ \n\n10.1515\n")
+        try:
+            load_datacite_doi_prefixes(filename)
+        finally:
+            os.remove(filename)
+        assert_equals(oa_local.datacite_doi_prefix_set, set(["10.9999", "10.8888"]))
+        assert_true(is_open_via_datacite_prefix(u"10.8888/abc"))
+        assert_true(not is_open_via_datacite_prefix(u"10.5061/dryad.abc123"))
+        # excluded even when the file has it
+        assert_true(not is_open_via_datacite_prefix(u"10.1515/abc"))
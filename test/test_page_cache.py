@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+from threading import current_thread
+from time import sleep
+from time import time
+from nose.tools import assert_equals
+from nose.tools import assert_is_none
+from nose.tools import assert_true
+
+from page_cache import DiskPageCache
+
+
+class TestDiskPageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def bytes_on_disk(self, cache):
+        return sum([size for (mtime, size, file_path) in cache.list_files()])
+
+    # eviction happens in the background
+    def wait_for(self, condition):
+        give_up_at = time() + 5
+        while not condition() and time() < give_up_at:
+            sleep(0.01)
+        assert_true(condition())
+
+    def test_round_trip(self):
+        cache = DiskPageCache(self.cache_dir, 1000*1000)
+        cache.set("abcdef", u"<html>hi</html>", {"content-type": "text/html"})
+        cache_data = cache.get("abcdef")
+        assert_equals(cache_data["content"], "<html>hi</html>")
+        assert_equals(cache_data["headers"], {"content-type": "text/html"})
+        assert_is_none(cache.get("123456"))
+
+    def test_overwrite_doesnt_double_count(self):
+        cache = DiskPageCache(self.cache_dir, 1000*1000)
+        cache.set("abcdef", "first", {})
+        self.wait_for(lambda: cache.total_bytes is not None)
+        cache.set("abcdef", "second version, longer", {})
+        cache.set("abcdef", "third", {})
+        assert_equals(cache.total_bytes, self.bytes_on_disk(cache))
+
+    def test_evicts_least_recently_used(self):
+        # random bytes so zlib can't shrink them
+        pages = [os.urandom(400) for i in range(5)]
+        cache = DiskPageCache(self.cache_dir, 2000)
+        for (i, page) in enumerate(pages):
+            hash_key = u"{}0000000".format(i)
+            cache.set(hash_key, page, {})
+            # make sure mtimes are in order
+            os.utime(cache.path_for(hash_key), (1000 + i, 1000 + i))
+
+        cache.set(u"9000000", os.urandom(400), {})
+        self.wait_for(lambda: cache.total_bytes is not None and cache.total_bytes <= 2000 * 0.9)
+        assert_equals(cache.total_bytes, self.bytes_on_disk(cache))
+        assert_is_none(cache.get(u"0000000"))
+        assert_true(cache.get(u"9000000") is not None)
+
+    def test_corrupt_entry_is_removed_and_uncounted(self):
+        cache = DiskPageCache(self.cache_dir, 1000*1000)
+        cache.set("abcdef", "good", {})
+        cache.set("fedcba", "will be corrupted", {})
+        self.wait_for(lambda: cache.total_bytes == self.bytes_on_disk(cache))
+        # same size, so only the removal changes the total
+        path = cache.path_for("fedcba")
+        corrupt_record = "x" * os.path.getsize(path)
+        with open(path, "wb") as fh:
+            fh.write(corrupt_record)
+        assert_is_none(cache.get("fedcba"))
+        assert_equals(cache.total_bytes, self.bytes_on_disk(cache))
+
+    def test_set_doesnt_walk_the_folder(self):
+        cache = DiskPageCache(self.cache_dir, 1000)
+        walked_in = []
+        list_files = cache.list_files
+        def recording_list_files():
+            walked_in.append(current_thread().name)
+            return list_files()
+        cache.list_files = recording_list_files
+        for i in range(5):
+            cache.set(u"{}0000000".format(i), os.urandom(400), {})
+        self.wait_for(lambda: cache.total_bytes is not None and cache.total_bytes <= 1000)
+        assert_true(walked_in)
+        assert_true(current_thread().name not in walked_in)
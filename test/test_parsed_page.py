@@ -0,0 +1,78 @@
+import unittest
+from nose.tools import assert_equals
+
+from webpage import Webpage
+from webpage import ParsedPage
+from webpage import StreamingPageScanner
+from webpage import get_pdf_in_meta
+from webpage import get_useful_links
+from webpage import find_doc_download_link
+
+
+class FakePub(object):
+    def __init__(self, doi):
+        self.doi = doi
+        self.tdm_api = None
+        self.publisher = None
+
+    def is_same_publisher(self, publisher):
+        return False
+
+
+landing_page = u"""<html><head>
+<meta name="citation_title" content="An article">
+<meta name="citation_pdf_url" content="/article.pdf">
+</head><body>
+<a href="/about">About&nbsp;Us</a>
+<a href="/manuscript.doc">Manuscript (.doc)</a>
+<a href="/download.pdf"><img src="/icons/pdf.png"></a>
+<a href="/icon-only"><img src="/icons/logo.png"></a>
+<a name="no-href">No href</a>
+<div class="relatedItem"><a href="/other.pdf">Another article PDF</a></div>
+</body></html>""".encode("utf-8")
+
+
+def hrefs_and_anchors(links):
+    return [(link.href, link.anchor) for link in links]
+
+
+class TestParsedPage(unittest.TestCase):
+
+    def test_useful_links(self):
+        parsed_page = ParsedPage(landing_page)
+        assert_equals(hrefs_and_anchors(get_useful_links(parsed_page)), [
+            ("/about", u"about us"),
+            ("/manuscript.doc", u"manuscript (.doc)"),
+            ("/download.pdf", u"image: /icons/pdf.png")
+        ])
+
+    def test_every_heuristic_shares_one_parse(self):
+        parsed_page = ParsedPage(landing_page)
+        assert_equals(get_pdf_in_meta(parsed_page).href, "/article.pdf")
+        assert_equals(find_doc_download_link(parsed_page).href, "/manuscript.doc")
+        webpage = Webpage(url=u"http://example.com/landing", related_pub=FakePub("10.123/abc"))
+        assert_equals(webpage.find_pdf_link(parsed_page).href, "/article.pdf")
+        assert_equals(len(get_useful_links(parsed_page)), 3)
+        assert_equals(parsed_page.num_parses, 1)
+
+    def test_meta_tags_kept_when_links_clear_sections(self):
+        page = landing_page.replace('<div class="relatedItem">', '<div class="relatedItem"><meta name="in_related" content="x">')
+        parsed_page = ParsedPage(page)
+        get_useful_links(parsed_page)
+        assert_equals([meta["name"] for meta in parsed_page.meta_tags], ["citation_title", "citation_pdf_url", "in_related"])
+
+    def test_unparseable_page(self):
+        parsed_page = ParsedPage("")
+        assert_equals(parsed_page.tree, None)
+        assert_equals(parsed_page.meta_tags, [])
+        assert_equals(get_useful_links(parsed_page), [])
+        assert_equals(parsed_page.num_parses, 1)
+
+    def test_scanner_hands_over_its_tree(self):
+        scanner = StreamingPageScanner()
+        for i in range(0, len(landing_page), 100):
+            scanner.feed(landing_page[i:i + 100])
+        parsed_page = scanner.finish(landing_page)
+        assert_equals(hrefs_and_anchors(get_useful_links(parsed_page))[0], ("/about", u"about us"))
+        assert_equals(get_pdf_in_meta(parsed_page).href, "/article.pdf")
+        assert_equals(parsed_page.num_parses, 0)
@@ -0,0 +1,148 @@
+import unittest
+from time import sleep
+from nose.tools import assert_equals
+
+from host_scheduler import host_scheduler
+from host_scheduler import HostBucket
+from webpage import Webpage
+from webpage import ParsedPage
+from oa_base import Base
+from local_server import LocalServer
+
+
+class FakePub(object):
+    def __init__(self, doi, publisher=None):
+        self.doi = doi
+        self.tdm_api = None
+        self.publisher = publisher
+
+    def is_same_publisher(self, publisher):
+        return self.publisher == publisher
+
+
+links_page = u"""<html><head>
+<meta name="citation_pdf_url" content="/meta.pdf">
+<script>var article = {"pdfUrl":"/js.pdf"};</script>
+</head><body>
+<a href="/figure.pdf">Figure 1 PDF</a>
+<a href="/one">PDF</a>
+<a href="/two.pdf">Full text PDF</a>
+<a href="/download">Download</a>
+<a href="/citation">Download citation</a>
+<a href="/full-text">Full text</a>
+<a href="/icon">Get it <img src="/icons/pdf.png"></a>
+<a href="/titled" title="PDF version">Here</a>
+<a href="/three">pdf</a>
+<a href="/about">About</a>
+</body></html>""".encode("utf-8")
+
+
+def hrefs_and_scores(candidates):
+    return [(link.href, score) for (score, link) in candidates]
+
+
+class TestRankPdfLinks(unittest.TestCase):
+
+    def rank(self, publisher=None):
+        webpage = Webpage(url=u"http://example.com/landing", related_pub=FakePub("10.123/abc", publisher))
+        return hrefs_and_scores(webpage.rank_pdf_links(ParsedPage(links_page)))
+
+    def test_best_first_ties_in_page_order(self):
+        assert_equals(self.rank(), [
+            ("/meta.pdf", 100),
+            ("/js.pdf", 90),
+            ("/two.pdf", 55),
+            ("/one", 50),
+            ("/three", 50),
+            ("/download", 40),
+            ("/full-text", 30),
+            ("/icon", 20),
+            ("/titled", 10)
+        ])
+
+    def test_full_text_isnt_the_pdf_at_ovid(self):
+        assert_equals("/full-text" in [href for (href, score) in self.rank("Ovid Technologies (Wolters Kluwer Health)")], False)
+
+    def test_find_pdf_link_takes_the_best(self):
+        webpage = Webpage(url=u"http://example.com/landing", related_pub=FakePub("10.123/abc"))
+        assert_equals(webpage.find_pdf_link(ParsedPage(links_page)).href, "/meta.pdf")
+        assert_equals(webpage.find_pdf_link(ParsedPage("<html><body><a href='/about'>About</a></body></html>")), None)
+
+
+class TestFindVerifiedPdfLink(unittest.TestCase):
+
+    def setUp(self):
+        host_scheduler.buckets["127.0.0.1"] = HostBucket(1000, 1000)
+        self.server = LocalServer({
+            "/meta.pdf": (404, {}, "not found"),
+            "/js.pdf": (200, {"Content-Type": "application/pdf"}, "%PDF-1.4 from the script"),
+            "/two.pdf": (200, {"Content-Type": "application/pdf"}, "%PDF-1.4 full text"),
+            "/one": (200, {"Content-Type": "application/pdf"}, "%PDF-1.4 one")
+        }).start()
+        self.webpage = Webpage(url=self.server.url("/landing"), related_pub=FakePub("10.123/abc"))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def paths_checked(self):
+        return sorted(set([path for (method, path, headers) in self.server.requests]))
+
+    def test_best_ranked_real_pdf(self):
+        link = self.webpage.find_verified_pdf_link(ParsedPage(links_page), self.server.url("/landing"))
+        assert_equals(link.href, "/js.pdf")
+        # only the top PDF_CANDIDATES_TO_CHECK are checked
+        assert_equals(self.paths_checked(), ["/js.pdf", "/meta.pdf", "/two.pdf"])
+        assert_equals("status_code=404" in self.webpage.error, True)
+
+    def test_skipped_links_arent_checked_again(self):
+        link = self.webpage.find_verified_pdf_link(ParsedPage(links_page), self.server.url("/landing"),
+                                                   skip_hrefs=[self.server.url("/js.pdf")])
+        assert_equals(link.href, "/two.pdf")
+        assert_equals(self.paths_checked(), ["/meta.pdf", "/one", "/two.pdf"])
+
+    def test_none_are_pdfs(self):
+        page = u"<html><body><a href='/meta.pdf'>PDF</a><a href='/missing.pdf'>PDF</a></body></html>"
+        assert_equals(self.webpage.find_verified_pdf_link(ParsedPage(page), self.server.url("/landing")), None)
+
+
+class FakeWebpage(object):
+    def __init__(self, name, is_open, seconds=0, error=None):
+        self.name = name
+        self.has_fulltext_url = is_open
+        self.fulltext_url = u"http://example.com/{}".format(name) if is_open else None
+        self.seconds = seconds
+        self.error = error
+        self.scraped = False
+
+    def scrape_for_fulltext_link(self):
+        sleep(self.seconds)
+        self.scraped = True
+        if self.error:
+            raise self.error
+
+
+# Base needs postgres to be instantiated, so this borrows the code under test
+class BaseRecord(object):
+    scrape_for_fulltext = Base.__dict__["scrape_for_fulltext"]
+
+    def __init__(self, webpages):
+        self.all_webpages = webpages
+
+    def set_webpages(self):
+        self.open_webpages = []
+        self.webpages = self.all_webpages
+
+
+class TestBaseScrapeForFulltext(unittest.TestCase):
+
+    def test_first_open_page_in_order(self):
+        webpages = [FakeWebpage("closed", False),
+                    FakeWebpage("broken", True, error=ValueError("boom")),
+                    FakeWebpage("slow-open", True, seconds=0.5),
+                    FakeWebpage("fast-open", True)]
+        record = BaseRecord(webpages).scrape_for_fulltext()
+        assert_equals([my_webpage.name for my_webpage in record.open_webpages], ["slow-open"])
+
+    def test_none_open(self):
+        record = BaseRecord([FakeWebpage("a", False), FakeWebpage("b", False)]).scrape_for_fulltext()
+        assert_equals(record.open_webpages, [])
@@ -0,0 +1,134 @@
+import unittest
+from nose.tools import assert_equals
+
+from host_scheduler import host_scheduler
+from host_scheduler import HostBucket
+from pdf_probe import PdfProbe
+from pdf_probe import HOST_QUIRK_THRESHOLD
+from webpage import Webpage
+from webpage import DuckLink
+from local_server import LocalServer
+
+pdf_body = "%PDF-1.4 " + "x" * 10000
+html_body = "<html>" + "x" * 10000 + "</html>"
+
+
+# serves the first bytes asked for with a 206, like most servers do
+def ranged(content_type, body):
+    def respond(handler):
+        range_header = handler.headers.get("Range")
+        if range_header:
+            last_byte = int(range_header.split("-")[1])
+            return (206, {"Content-Type": content_type}, body[:last_byte + 1])
+        return (200, {"Content-Type": content_type}, body)
+    return respond
+
+
+# answers a Range request with status_code, and everything else normally
+def no_ranges(status_code, content_type, body):
+    def respond(handler):
+        if handler.headers.get("Range"):
+            return (status_code, {}, "")
+        return (200, {"Content-Type": content_type}, body)
+    return respond
+
+
+class TestPdfProbe(unittest.TestCase):
+
+    def setUp(self):
+        host_scheduler.buckets["127.0.0.1"] = HostBucket(1000, 1000)
+        self.server = LocalServer({
+            "/ranged.pdf": (200, {}, ranged("application/pdf", pdf_body)),
+            "/ranged.html": (200, {}, ranged("text/html", html_body)),
+            "/octet.pdf": (200, {}, ranged("application/octet-stream", pdf_body)),
+            "/whole.pdf": (200, {"Content-Type": "application/pdf"}, pdf_body),
+            "/no-ranges.pdf": (200, {}, no_ranges(416, "application/pdf", pdf_body)),
+            "/no-ranges.html": (200, {}, no_ranges(416, "text/html", html_body)),
+            "/gone": (410, {}, "gone"),
+            "/forbidden": (403, {}, "forbidden"),
+            "/busy": (429, {}, "slow down")
+        }).start()
+        self.probe = PdfProbe()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def check(self, path, can_rule_out=True):
+        return self.probe.check(self.server.url(path), can_rule_out=can_rule_out)
+
+    def methods_and_ranges(self):
+        return [(method, headers.get("range")) for (method, path, headers) in self.server.requests]
+
+    def test_ranged_get_settles_it(self):
+        assert_equals(self.check("/ranged.pdf"), (True, 206))
+        assert_equals(self.check("/ranged.html"), (False, 206))
+        assert_equals(self.methods_and_ranges(), [("GET", "bytes=0-4095"), ("GET", "bytes=0-4095")])
+        assert_equals(self.probe.stats()["decided_by_range"], 2)
+
+    def test_sniffs_the_first_bytes(self):
+        assert_equals(self.check("/octet.pdf"), (True, 206))
+
+    def test_server_that_ignores_the_range(self):
+        assert_equals(self.check("/whole.pdf"), (True, 200))
+
+    def test_missing_is_final(self):
+        assert_equals(self.check("/gone"), (False, 410))
+        assert_equals(self.check("/forbidden", can_rule_out=False), (False, 403))
+        assert_equals(len(self.server.requests), 2)
+
+    def test_left_to_the_full_get(self):
+        # could be a pdf viewer page
+        assert_equals(self.check("/ranged.html", can_rule_out=False), (None, None))
+        # a 429 says nothing about the range
+        assert_equals(self.check("/busy"), (None, None))
+        assert_equals(self.probe.stats()["left_to_full_get"], 2)
+        assert_equals(self.probe.host_quirks.stats(), [])
+
+    def test_head_once_the_host_cant_do_ranges(self):
+        for i in range(HOST_QUIRK_THRESHOLD):
+            assert_equals(self.check("/no-ranges.pdf"), (None, None))
+        self.server.requests = []
+        assert_equals(self.check("/no-ranges.pdf"), (True, 200))
+        # a HEAD can only say yes
+        assert_equals(self.check("/no-ranges.html"), (None, None))
+        assert_equals(self.methods_and_ranges(), [("HEAD", None), ("HEAD", None)])
+        assert_equals(self.probe.stats()["decided_by_head"], 1)
+
+
+class FakePub(object):
+    def __init__(self, doi):
+        self.doi = doi
+        self.tdm_api = None
+        self.publisher = None
+
+    def is_same_publisher(self, publisher):
+        return False
+
+
+class TestGetsAPdf(unittest.TestCase):
+
+    def setUp(self):
+        host_scheduler.buckets["127.0.0.1"] = HostBucket(1000, 1000)
+        self.server = LocalServer({
+            "/ranged.pdf": (200, {}, ranged("application/pdf", pdf_body)),
+            "/gone": (410, {}, "gone"),
+            "/busy": (429, {}, "slow down")
+        }).start()
+        self.webpage = Webpage(url=self.server.url("/landing"), related_pub=FakePub("10.123/abc"))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def gets_a_pdf(self, path):
+        return self.webpage.gets_a_pdf(DuckLink(href=path, anchor="pdf"), self.server.url("/landing"))
+
+    def test_one_request_when_the_probe_decides(self):
+        assert_equals(self.gets_a_pdf("/ranged.pdf"), True)
+        assert_equals(self.gets_a_pdf("/gone"), False)
+        assert_equals(len(self.server.requests), 2)
+        assert_equals(self.webpage.error, u"ERROR: status_code=410 on {} in gets_a_pdf".format(self.server.url("/gone")))
+
+    def test_full_get_when_it_cant(self):
+        assert_equals(self.gets_a_pdf("/busy"), False)
+        assert_equals([headers.get("range") for (method, path, headers) in self.server.requests], ["bytes=0-4095", None])
+        assert_equals(self.webpage.error, u"ERROR: status_code=429 on {} in gets_a_pdf".format(self.server.url("/busy")))
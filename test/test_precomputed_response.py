@@ -0,0 +1,138 @@
+import datetime
+import json
+import unittest
+from nose.tools import assert_equals
+from nose.tools import assert_is_none
+
+import publication
+import views
+from app import app
+from publication import get_precomputed_response
+
+
+# answers get_precomputed_response's two queries: the crossref row, then the latest base scrape
+class FakeQuery(object):
+    def __init__(self, row=None, scalar=None):
+        self.row = row
+        self.scalar_value = scalar
+
+    def filter(self, *args):
+        return self
+
+    def first(self):
+        return self.row
+
+    def scalar(self):
+        return self.scalar_value
+
+
+class FakeSession(object):
+    def __init__(self, row, latest_base_scrape=None):
+        self.queries = [FakeQuery(row=row), FakeQuery(scalar=latest_base_scrape)]
+        self.num_queries = 0
+
+    def query(self, *columns):
+        query = self.queries[self.num_queries]
+        self.num_queries += 1
+        return query
+
+
+class FakeDb(object):
+    def __init__(self, session):
+        self.session = session
+
+
+def ago(**kwargs):
+    return datetime.datetime.utcnow() - datetime.timedelta(**kwargs)
+
+
+class TestGetPrecomputedResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.old_db = publication.db
+        self.response = {"doi": "10.123/abc", "is_oa": True}
+
+    def tearDown(self):
+        publication.db = self.old_db
+
+    def precomputed(self, row, latest_base_scrape=None, max_age_seconds=60*60):
+        publication.db = FakeDb(FakeSession(row, latest_base_scrape))
+        return get_precomputed_response(u"10.123/ABC", max_age_seconds=max_age_seconds)
+
+    def test_fresh_response_served(self):
+        assert_equals(self.precomputed((self.response, ago(minutes=5), ago(days=1))), self.response)
+        assert_equals(self.precomputed((self.response, ago(minutes=5), None), latest_base_scrape=ago(days=1)),
+                      self.response)
+
+    def test_too_old(self):
+        assert_is_none(self.precomputed((self.response, ago(hours=2), None)))
+
+    def test_scraped_since(self):
+        assert_is_none(self.precomputed((self.response, ago(minutes=5), ago(minutes=1))))
+        assert_is_none(self.precomputed((self.response, ago(minutes=5), None), latest_base_scrape=ago(minutes=1)))
+
+    def test_nothing_stored(self):
+        assert_is_none(self.precomputed(None))
+        assert_is_none(self.precomputed((None, ago(minutes=5), None)))
+        assert_is_none(self.precomputed((self.response, None, None)))
+
+    def test_invalid_doi_goes_to_the_404_path(self):
+        response = {"doi": "10.123/abc", "error": "Invalid DOI"}
+        assert_is_none(self.precomputed((response, ago(minutes=5), None)))
+
+    def test_turned_off(self):
+        publication.db = FakeDb(FakeSession((self.response, ago(minutes=5), None)))
+        assert_is_none(get_precomputed_response(u"10.123/abc", max_age_seconds=0))
+        assert_equals(publication.db.session.num_queries, 0)
+
+
+class FakePub(object):
+    def __init__(self, doi):
+        self.doi = doi
+
+    def to_dict(self):
+        return {"doi": self.doi, "is_oa": False, "oa_color": None, "source": "recalculated"}
+
+
+class TestDoiEndpointPrecomputed(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.old_get_precomputed_response = publication.get_precomputed_response
+        self.old_get_pub_from_biblio = publication.get_pub_from_biblio
+        self.old_cache_enabled = views.RESPONSE_CACHE_ENABLED
+        views.RESPONSE_CACHE_ENABLED = False
+        # keep the request log away from loggly
+        self.old_log_request = views.log_request
+        views.log_request = lambda resp: None
+        self.lookups = []
+        publication.get_precomputed_response = lambda doi: {"doi": doi, "is_oa": True, "oa_color": "gold", "source": "precomputed"}
+        publication.get_pub_from_biblio = self.fake_get_pub_from_biblio
+
+    def tearDown(self):
+        publication.get_precomputed_response = self.old_get_precomputed_response
+        publication.get_pub_from_biblio = self.old_get_pub_from_biblio
+        views.RESPONSE_CACHE_ENABLED = self.old_cache_enabled
+        views.log_request = self.old_log_request
+
+    def fake_get_pub_from_biblio(self, biblio, run_with_hybrid=False, skip_all_hybrid=False):
+        self.lookups.append(biblio["doi"])
+        return FakePub(biblio["doi"])
+
+    def get(self, path):
+        r = self.client.get(path, headers={"X-Forwarded-Proto": "https"})
+        return (r.headers["X-Response-Source"], json.loads(r.data)["results"][0]["source"])
+
+    def test_precomputed_served_without_loading_the_pub(self):
+        assert_equals(self.get("/10.123/abc"), ("precomputed", "precomputed"))
+        assert_equals(self.get("/v1/publication/doi/10.123/abc"), ("precomputed", "precomputed"))
+        assert_equals(self.lookups, [])
+
+    def test_recalculated_when_not_precomputed(self):
+        publication.get_precomputed_response = lambda doi: None
+        assert_equals(self.get("/10.123/abc"), ("recalculated", "recalculated"))
+        assert_equals(self.lookups, ["10.123/abc"])
+
+    def test_hybrid_never_precomputed(self):
+        assert_equals(self.get("/10.123/abc?hybrid"), ("refreshed", "recalculated"))
+        assert_equals(self.lookups, ["10.123/abc"])
@@ -0,0 +1,53 @@
+import os
+import unittest
+from nose.tools import assert_equals
+from nose.tools import assert_raises
+
+from http_cache import http_get
+from http_cache import get_proxies
+from http_cache import PROXY_DIRECT
+from http_cache import PROXY_STATIC_IP
+from local_server import LocalServer
+
+
+class TestProxyProfiles(unittest.TestCase):
+
+    def setUp(self):
+        self.old_environ = dict(os.environ)
+        self.server = LocalServer({
+            "/page": (200, {}, "direct"),
+            # a proxy is asked for the whole url
+            "http://publisher.example.com/page": (200, {}, "proxied")
+        }).start()
+        os.environ["STATIC_IP_PROXY"] = self.server.url("")
+
+    def tearDown(self):
+        self.server.stop()
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+
+    def test_get_proxies(self):
+        assert_equals(get_proxies(PROXY_DIRECT), {"http": None, "https": None})
+        assert_equals(get_proxies(PROXY_STATIC_IP), {"http": self.server.url(""), "https": self.server.url("")})
+        assert_raises(ValueError, get_proxies, "sometimes")
+
+    def test_direct_ignores_proxy_environment(self):
+        os.environ["HTTP_PROXY"] = "http://127.0.0.1:1"
+        os.environ["http_proxy"] = "http://127.0.0.1:1"
+        r = http_get(self.server.url("/page"))
+        assert_equals(r.content, "direct")
+
+    def test_static_ip_goes_through_the_proxy(self):
+        r = http_get("http://publisher.example.com/page", proxy_profile=PROXY_STATIC_IP)
+        assert_equals(r.content, "proxied")
+        assert_equals(self.server.paths_requested(), ["http://publisher.example.com/page"])
+
+    def test_environment_and_headers_left_alone(self):
+        environ = dict(os.environ)
+        headers = {"Accept": "text/html"}
+        http_get("http://publisher.example.com/page", headers=headers, proxy_profile=PROXY_STATIC_IP)
+        http_get(self.server.url("/page"), headers=headers)
+        assert_equals(dict(os.environ), environ)
+        assert_equals(headers, {"Accept": "text/html"})
+        for (method, path, request_headers) in self.server.requests:
+            assert_equals(request_headers["from"], "team@impactstory.org")
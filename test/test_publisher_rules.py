@@ -0,0 +1,122 @@
+import re
+import unittest
+from ddt import ddt, data
+from nose.tools import assert_equals
+from nose.tools import assert_raises
+
+from http_cache import http_get
+from host_scheduler import host_scheduler
+from host_scheduler import HostBucket
+from publisher_rules import publisher_rules
+from publisher_rules import PublisherRules
+from webpage import Webpage
+from local_server import LocalServer
+
+
+# the inline lists these rules came from in webpage.py
+old_says_free_publisher_patterns = [
+    ("Wiley-Blackwell", u'<span class="freeAccess" title="You have free access to this content">'),
+    ("Wiley-Blackwell", u'<iframe id="pdfDocument"'),
+    ("JSTOR", ur'<li class="download-pdf-button">.*Download PDF.*</li>'),
+    ("Institute of Electrical and Electronics Engineers (IEEE)", ur'<frame src="http://ieeexplore.ieee.org/.*?pdf.*?</frameset>'),
+    ("IOP Publishing", ur'Full Refereed Journal Article')
+]
+
+old_says_open_access_patterns = [
+    ("Informa UK Limited", u"/accessOA.png"),
+    ("Oxford University Press (OUP)", u"<i class='icon-availability_open'"),
+    ("Institute of Electrical and Electronics Engineers (IEEE)", ur'"isOpenAccess":true'),
+    ("Institute of Electrical and Electronics Engineers (IEEE)", ur'"openAccessFlag":"yes"'),
+    ("Royal Society of Chemistry (RSC)", u"/open_access_blue.png"),
+    ("Cambridge University Press (CUP)", u'<span class="icon access open-access cursorDefault">'),
+]
+
+# (rule type, publisher, page, whether it says so)
+page_checks = [
+    ("says_free_pdf", "Wiley-Blackwell", u'<html><iframe id="pdfDocument" src="/pdf"></html>', True),
+    ("says_free_pdf", "wiley blackwell", u'<html><IFRAME ID="pdfDocument" src="/pdf"></html>', True),
+    ("says_free_pdf", "JSTOR", u'<html><iframe id="pdfDocument" src="/pdf"></html>', False),
+    ("says_free_pdf", "JSTOR", u'<li class="download-pdf-button">\n  <a>Download PDF</a>\n</li>', True),
+    ("says_free_pdf", "Institute of Electrical and Electronics Engineers (IEEE)",
+        u'<frameset><frame src="http://ieeexplore.ieee.org/stamp/x.pdf"></frameset>', True),
+    ("says_free_pdf", "IOP Publishing", u"<h1>full refereed journal article</h1>", True),
+    ("says_free_pdf", "IOP Publishing", u"<h1>Journal Article</h1>", False),
+    ("says_open_access", "Informa UK Limited", u'<img src="/templates/jsp/images/accessOA.png">', True),
+    ("says_open_access", "Oxford University Press (OUP)", u"<i class='icon-availability_open' title='Open'>", True),
+    ("says_open_access", "Institute of Electrical and Electronics Engineers (IEEE)", u'{"isOpenAccess":true}', True),
+    ("says_open_access", "Institute of Electrical and Electronics Engineers (IEEE)", u'{"openAccessFlag":"yes"}', True),
+    ("says_open_access", "Institute of Electrical and Electronics Engineers (IEEE)", u'{"isOpenAccess":false}', False),
+    ("says_open_access", "Royal Society of Chemistry (RSC)", u'<img src="/content/open_access_blue.png">', True),
+    ("says_open_access", "Cambridge University Press (CUP)", u'<span class="icon access open-access cursorDefault">', True),
+    ("says_open_access", "Elsevier BV", u'<img src="/templates/jsp/images/accessOA.png">', False),
+    ("says_open_access", None, u'<img src="/templates/jsp/images/accessOA.png">', False),
+]
+
+
+def says_so(rule_type, publisher, page):
+    return any([pattern.search(page) for pattern in publisher_rules.for_publisher(rule_type, publisher)])
+
+
+@ddt
+class TestPublisherRules(unittest.TestCase):
+
+    @data(*page_checks)
+    def test_page_checks(self, test_data):
+        (rule_type, publisher, page, expected) = test_data
+        assert_equals(says_so(rule_type, publisher, page), expected)
+
+    def test_same_patterns_as_before(self):
+        for (rule_type, old_patterns) in [("says_free_pdf", old_says_free_publisher_patterns),
+                                          ("says_open_access", old_says_open_access_patterns)]:
+            for (publisher, old_pattern) in old_patterns:
+                patterns = publisher_rules.for_publisher(rule_type, publisher)
+                assert_equals(old_pattern in [pattern.pattern for pattern in patterns], True)
+                assert_equals(set([pattern.flags & (re.IGNORECASE | re.DOTALL) for pattern in patterns]),
+                              set([re.IGNORECASE | re.DOTALL]))
+            num_rules = sum([len(patterns) for patterns in publisher_rules.publisher_rules[rule_type].values()])
+            assert_equals(num_rules, len(old_patterns))
+
+    def test_url_rules(self):
+        page = u"<p><strong>Full-text: Open access</strong></p>"
+        patterns = publisher_rules.for_url("says_open_access_at_url", u"https://ProjectEuclid.org/euclid.bams/1183525")
+        assert_equals([bool(pattern.search(page)) for pattern in patterns], [True])
+        assert_equals(publisher_rules.for_url("says_open_access_at_url", u"https://example.com/projecteuclid"), [])
+        assert_equals(publisher_rules.for_url("says_open_access_at_url", None), [])
+
+    def test_rule_needs_a_publisher_or_url(self):
+        assert_raises(ValueError, PublisherRules, {"says_open_access": [{"pattern": "open"}]})
+
+
+class FakePub(object):
+    def __init__(self, doi, publisher):
+        self.doi = doi
+        self.tdm_api = None
+        self.publisher = publisher
+
+    def is_same_publisher(self, publisher):
+        return False
+
+
+class TestIsAPdfPage(unittest.TestCase):
+
+    def setUp(self):
+        host_scheduler.buckets["127.0.0.1"] = HostBucket(1000, 1000)
+        self.server = LocalServer({
+            "/viewer": (200, {"Content-Type": "text/html"}, '<html><iframe id="pdfDocument" src="/pdf"></iframe></html>')
+        }).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def is_a_pdf_page(self, publisher):
+        webpage = Webpage(url=self.server.url("/viewer"), related_pub=FakePub("10.123/abc", publisher))
+        r = http_get(self.server.url("/viewer"), stream=True)
+        try:
+            return webpage.is_a_pdf_page(r)
+        finally:
+            r.close()
+
+    def test_only_the_publishers_own_rules(self):
+        assert_equals(self.is_a_pdf_page("Wiley-Blackwell"), True)
+        assert_equals(self.is_a_pdf_page("JSTOR"), False)
+        assert_equals(self.is_a_pdf_page(None), False)
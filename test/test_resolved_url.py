@@ -0,0 +1,146 @@
+import datetime
+import unittest
+from nose.tools import assert_equals
+from nose.tools import assert_is_none
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+import http_cache
+import resolved_url
+from resolved_url import get_resolved_url
+from resolved_url import set_resolved_url
+from resolved_url import set_resolved_urls
+from resolved_url import RESOLVED_URL_RESOURCE
+from resolved_url import RESOLVED_URL_LANDING_PAGE
+from http_cache import get_crossref_resolve_url
+
+
+# sql/resolved_url.sql without the postgres-only default
+create_table = u"""create table resolved_url (
+    doi text not null,
+    kind text not null default 'resource',
+    url text not null,
+    source text,
+    updated timestamp not null,
+    primary key (doi, kind)
+)"""
+
+
+class FakeDb(object):
+    def __init__(self):
+        self.engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+        self.engine.execute(create_table)
+
+
+class ResolvedUrlTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.old_db = resolved_url.db
+        resolved_url.db = FakeDb()
+
+    def tearDown(self):
+        resolved_url.db = self.old_db
+
+    def rows(self):
+        return resolved_url.db.engine.execute(
+            u"select doi, kind, url, source, updated from resolved_url order by doi, kind").fetchall()
+
+    def make_old(self, days):
+        updated = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+        resolved_url.db.engine.execute(u"update resolved_url set updated=?", updated)
+
+
+class TestResolvedUrl(ResolvedUrlTestCase):
+
+    def test_kinds_kept_apart(self):
+        set_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE, u"http://example.com/abc", u"crossref tdm")
+        assert_equals(get_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE), u"http://example.com/abc")
+        assert_is_none(get_resolved_url(u"10.123/abc", RESOLVED_URL_LANDING_PAGE))
+
+        set_resolved_url(u"10.123/abc", RESOLVED_URL_LANDING_PAGE, u"http://example.com/abc/full", u"doi.org")
+        assert_equals(get_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE), u"http://example.com/abc")
+        assert_equals(get_resolved_url(u"10.123/abc", RESOLVED_URL_LANDING_PAGE), u"http://example.com/abc/full")
+
+    def test_too_old_looked_up_again(self):
+        set_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE, u"http://example.com/abc", u"crossref tdm")
+        self.make_old(resolved_url.RESOLVED_URL_TTL_DAYS + 1)
+        assert_is_none(get_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE))
+
+        set_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE, u"http://example.com/abc", u"crossref tdm")
+        assert_equals(get_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE), u"http://example.com/abc")
+
+    def test_fresh_row_with_the_same_url_left_alone(self):
+        set_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE, u"http://example.com/abc", u"crossref tdm")
+        self.make_old(1)
+        updated = self.rows()[0][4]
+        set_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE, u"http://example.com/abc", u"crossref api")
+        assert_equals(self.rows(), [(u"10.123/abc", RESOLVED_URL_RESOURCE, u"http://example.com/abc", u"crossref tdm", updated)])
+
+    def test_changed_url_replaced(self):
+        set_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE, u"http://example.com/abc", u"crossref tdm")
+        set_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE, u"http://example.com/moved", u"crossref api")
+        assert_equals([row[:4] for row in self.rows()],
+                      [(u"10.123/abc", RESOLVED_URL_RESOURCE, u"http://example.com/moved", u"crossref api")])
+
+    def test_many_at_once(self):
+        set_resolved_urls([
+            (u"10.123/a", RESOLVED_URL_RESOURCE, u"http://example.com/a", u"crossref api"),
+            (u"10.123/b", RESOLVED_URL_RESOURCE, u"http://example.com/b", u"crossref api"),
+            (u"10.123/c", RESOLVED_URL_RESOURCE, None, u"crossref api"),
+            (None, RESOLVED_URL_RESOURCE, u"http://example.com/d", u"crossref api")
+        ])
+        assert_equals([row[:3] for row in self.rows()], [
+            (u"10.123/a", RESOLVED_URL_RESOURCE, u"http://example.com/a"),
+            (u"10.123/b", RESOLVED_URL_RESOURCE, u"http://example.com/b")
+        ])
+
+    def test_no_table(self):
+        resolved_url.db.engine.execute(u"drop table resolved_url")
+        assert_is_none(get_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE))
+        set_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE, u"http://example.com/abc", u"crossref tdm")
+
+
+class FakePub(object):
+    def __init__(self, tdm_api=None):
+        self.tdm_api = tdm_api
+
+
+class TestGetCrossrefResolveUrl(ResolvedUrlTestCase):
+
+    def setUp(self):
+        super(TestGetCrossrefResolveUrl, self).setUp()
+        self.old_lookup = http_cache.lookup_crossref_resolve_url
+        self.lookups = []
+        self.lookup_result = (u"http://example.com/abc", u"crossref tdm")
+        http_cache.lookup_crossref_resolve_url = self.fake_lookup
+
+    def tearDown(self):
+        http_cache.lookup_crossref_resolve_url = self.old_lookup
+        super(TestGetCrossrefResolveUrl, self).tearDown()
+
+    def fake_lookup(self, url, related_pub=None):
+        self.lookups.append(url)
+        return self.lookup_result
+
+    def test_looked_up_once_then_saved(self):
+        assert_equals(get_crossref_resolve_url(u"https://doi.org/10.123/ABC"), u"http://example.com/abc")
+        assert_equals(get_crossref_resolve_url(u"https://doi.org/10.123/abc"), u"http://example.com/abc")
+        assert_equals(self.lookups, [u"https://doi.org/10.123/ABC"])
+        assert_equals([row[:4] for row in self.rows()],
+                      [(u"10.123/abc", RESOLVED_URL_RESOURCE, u"http://example.com/abc", u"crossref tdm")])
+
+    def test_not_the_registered_url_isnt_saved(self):
+        self.lookup_result = (u"http://example.com/after/content/negotiation", None)
+        get_crossref_resolve_url(u"https://doi.org/10.123/abc")
+        assert_equals(self.rows(), [])
+
+    def test_saved_landing_page_isnt_used_as_the_resource(self):
+        set_resolved_url(u"10.123/abc", RESOLVED_URL_LANDING_PAGE, u"http://example.com/abc/full", u"doi.org")
+        assert_equals(get_crossref_resolve_url(u"https://doi.org/10.123/abc"), u"http://example.com/abc")
+        assert_equals(len(self.lookups), 1)
+
+    def test_pub_with_crossref_record_doesnt_touch_the_table(self):
+        set_resolved_url(u"10.123/abc", RESOLVED_URL_RESOURCE, u"http://example.com/old", u"crossref api")
+        assert_equals(get_crossref_resolve_url(u"https://doi.org/10.123/abc", FakePub(tdm_api=u"<xml/>")),
+                      u"http://example.com/abc")
+        assert_equals([row[2] for row in self.rows()], [u"http://example.com/old"])
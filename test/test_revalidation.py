@@ -0,0 +1,115 @@
+import shutil
+import tempfile
+import unittest
+from nose.tools import assert_equals
+from nose.tools import assert_is_none
+from nose.tools import assert_true
+
+import http_cache
+from http_cache import http_get
+from http_cache import get_revalidation_stats
+from http_cache import get_scrape_outcome
+from http_cache import store_scrape_outcome
+from host_scheduler import host_scheduler
+from host_scheduler import HostBucket
+from page_cache import TieredPageCache
+from page_cache import DiskPageCache
+from local_server import LocalServer
+
+
+class FakePub(object):
+    def __init__(self, doi):
+        self.doi = doi
+        self.tdm_api = None
+        self.publisher = None
+
+    def is_same_publisher(self, publisher):
+        return False
+
+class TestRevalidation(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.old_page_cache = http_cache.page_cache
+        self.old_fresh_days = http_cache.HTTP_CACHE_FRESH_DAYS
+        http_cache.page_cache = TieredPageCache([DiskPageCache(self.cache_dir, 1000*1000)])
+        host_scheduler.buckets["127.0.0.1"] = HostBucket(1000, 1000)
+        self.etag = '"v1"'
+        self.body = "<html>version 1</html>"
+        self.server = LocalServer({
+            "/landing": (200, {}, self.respond),
+            "/no-validators": (200, {}, "<html>no validators</html>")
+        }).start()
+        self.pub = FakePub("10.123/abc")
+
+    def tearDown(self):
+        self.server.stop()
+        http_cache.page_cache = self.old_page_cache
+        http_cache.HTTP_CACHE_FRESH_DAYS = self.old_fresh_days
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def respond(self, handler):
+        if handler.headers.get("If-None-Match") == self.etag:
+            return (304, {"ETag": self.etag}, "")
+        return (200, {"Content-Type": "text/html", "ETag": self.etag}, self.body)
+
+    def conditional_headers(self):
+        return [(headers.get("if-none-match"), headers.get("if-modified-since"))
+                for (method, path, headers) in self.server.requests]
+
+    def get(self, path):
+        return http_get(self.server.url(path), related_pub=self.pub, cache_enabled=True)
+
+    def test_unchanged_page_served_from_the_cache(self):
+        self.get("/landing")
+        http_cache.HTTP_CACHE_FRESH_DAYS = 0
+        before = get_revalidation_stats()
+        r = self.get("/landing")
+        assert_true(isinstance(r, http_cache.CachedResponse))
+        assert_true(r.revalidated)
+        assert_equals(r.content, "<html>version 1</html>")
+        assert_equals(self.conditional_headers(), [(None, None), ('"v1"', None)])
+        assert_equals(get_revalidation_stats()["not_modified"] - before["not_modified"], 1)
+
+        # the 304 made the cached copy fresh again
+        http_cache.HTTP_CACHE_FRESH_DAYS = self.old_fresh_days
+        assert_equals(self.get("/landing").content, "<html>version 1</html>")
+        assert_equals(len(self.server.requests), 2)
+
+    def test_changed_page_replaces_the_cached_copy(self):
+        self.get("/landing")
+        http_cache.HTTP_CACHE_FRESH_DAYS = 0
+        self.etag = '"v2"'
+        self.body = "<html>version 2</html>"
+        r = self.get("/landing")
+        assert_true(not isinstance(r, http_cache.CachedResponse))
+        assert_equals(r.content, "<html>version 2</html>")
+        assert_equals(self.conditional_headers(), [(None, None), ('"v1"', None)])
+        cached = http_cache.get_page_from_cache(self.server.url("/landing"))
+        assert_equals((cached.content, cached.headers["etag"]), ("<html>version 2</html>", '"v2"'))
+
+    def test_no_validators_means_a_plain_get(self):
+        self.get("/no-validators")
+        http_cache.HTTP_CACHE_FRESH_DAYS = 0
+        r = self.get("/no-validators")
+        assert_equals(r.content, "<html>no validators</html>")
+        assert_equals(self.conditional_headers(), [(None, None), (None, None)])
+
+    def test_scrape_outcome_reused_only_for_the_same_page(self):
+        url = self.server.url("/landing")
+        r = self.get("/landing")
+        store_scrape_outcome("PublisherWebpage", url, r, {"scraped_pdf_url": u"http://example.com/a.pdf"})
+        # a live response has just been scraped, so there's nothing to reuse
+        assert_is_none(get_scrape_outcome("PublisherWebpage", url, r))
+
+        http_cache.HTTP_CACHE_FRESH_DAYS = 0
+        r = self.get("/landing")
+        assert_equals(get_scrape_outcome("PublisherWebpage", url, r), {"scraped_pdf_url": u"http://example.com/a.pdf"})
+        assert_is_none(get_scrape_outcome("RepoWebpage", url, r))
+
+        # the page changed, so the outcome went with the old version
+        self.etag = '"v2"'
+        self.get("/landing")
+        r = self.get("/landing")
+        assert_true(r.revalidated)
+        assert_is_none(get_scrape_outcome("PublisherWebpage", url, r))
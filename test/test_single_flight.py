@@ -0,0 +1,113 @@
+import unittest
+from threading import Event
+from threading import Lock
+from threading import Thread
+from time import sleep
+from time import time
+from nose.tools import assert_equals
+from nose.tools import assert_true
+
+from single_flight import SingleFlight
+
+
+# redis where another process always holds the lock
+class LockHeldElsewhereRedis(object):
+    def set(self, key, value, nx=False, ex=None):
+        return None
+
+    def exists(self, key):
+        return True
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        self.calls_lock = Lock()
+        self.release = Event()
+
+    def slow_fn(self):
+        with self.calls_lock:
+            self.calls += 1
+        self.release.wait(5)
+        return "result"
+
+    def run_in_threads(self, flight, key, fn, num_threads):
+        results = []
+        threads = [Thread(target=lambda: results.append(flight.do(key, fn))) for i in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        return (threads, results)
+
+    def test_concurrent_calls_run_once(self):
+        flight = SingleFlight()
+        (threads, results) = self.run_in_threads(flight, "10.123/abc", self.slow_fn, 10)
+        give_up_time = time() + 5
+        while flight.stats()["local_waiters"] < 9 and time() < give_up_time:
+            sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+        assert_equals(self.calls, 1)
+        assert_equals(results, ["result"] * 10)
+        assert_equals(flight.stats()["leaders"], 1)
+        assert_equals(flight.stats()["local_waiters"], 9)
+        assert_equals(flight.stats()["in_flight"], 0)
+
+    def test_different_keys_run_separately(self):
+        flight = SingleFlight()
+        self.release.set()
+        flight.do("10.123/abc", self.slow_fn)
+        flight.do("10.123/def", self.slow_fn)
+        assert_equals(self.calls, 2)
+
+    def test_waiters_get_the_leaders_exception(self):
+        flight = SingleFlight()
+        errors = []
+
+        def failing_fn():
+            self.release.wait(5)
+            raise ValueError("no good")
+
+        def call():
+            try:
+                flight.do("10.123/abc", failing_fn)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [Thread(target=call) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        assert_equals(len(errors), 5)
+
+    def test_other_process_result_comes_from_check_fn(self):
+        flight = SingleFlight(LockHeldElsewhereRedis(), wait_seconds=5)
+        checks = []
+
+        def check_fn():
+            checks.append(1)
+            if len(checks) >= 3:
+                return "their result"
+            return None
+
+        assert_equals(flight.do("10.123/abc", self.slow_fn, check_fn), "their result")
+        assert_equals(self.calls, 0)
+        assert_equals(flight.stats()["redis_waits_satisfied"], 1)
+
+    def test_no_check_fn_means_no_redis_wait(self):
+        flight = SingleFlight(LockHeldElsewhereRedis(), wait_seconds=5)
+        self.release.set()
+        assert_equals(flight.do("10.123/abc", self.slow_fn), "result")
+        assert_equals(self.calls, 1)
+        assert_equals(flight.stats()["redis_waiters"], 0)
+
+    def test_gives_up_on_a_slow_process(self):
+        flight = SingleFlight(LockHeldElsewhereRedis(), wait_seconds=0.3)
+        self.release.set()
+        assert_equals(flight.do("10.123/abc", self.slow_fn, lambda: None), "result")
+        assert_equals(self.calls, 1)
+        assert_true(flight.stats()["wait_timeouts"] >= 1)
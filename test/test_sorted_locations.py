@@ -0,0 +1,119 @@
+import unittest
+from nose.tools import assert_equals
+
+from publication import Crossref
+from open_location import OpenLocation
+from reported_noncompliant_copies import is_reported_noncompliant_url
+
+
+# Crossref and OpenLocation need postgres to be instantiated, so these borrow the code under test
+class LocationsPub(object):
+    location_views = Crossref.__dict__["location_views"]
+    sorted_locations = Crossref.__dict__["sorted_locations"]
+    green_locations = Crossref.__dict__["green_locations"]
+    gold_locations = Crossref.__dict__["gold_locations"]
+    blue_locations = Crossref.__dict__["blue_locations"]
+    decide_if_open = Crossref.__dict__["decide_if_open"]
+    set_fulltext_url = Crossref.__dict__["set_fulltext_url"]
+
+    def __init__(self, doi, open_locations):
+        self.doi = doi
+        self.open_locations = open_locations
+        self.location_views_key = None
+        self.location_views_cache = None
+
+
+class Location(object):
+    best_fulltext_url = OpenLocation.__dict__["best_fulltext_url"]
+    base_collection = OpenLocation.__dict__["base_collection"]
+    is_publisher_base_collection = OpenLocation.__dict__["is_publisher_base_collection"]
+    is_reported_noncompliant = OpenLocation.__dict__["is_reported_noncompliant"]
+    is_gold = OpenLocation.__dict__["is_gold"]
+    is_hybrid = OpenLocation.__dict__["is_hybrid"]
+    oa_color = OpenLocation.__dict__["oa_color"]
+
+    def __init__(self, pdf_url, evidence, doi):
+        self.id = pdf_url
+        self.pdf_url = pdf_url
+        self.metadata_url = None
+        self.evidence = evidence
+        self.doi = doi
+        self.base_id = None
+        self.version = None
+        self.license = None
+
+
+def make_location(url, evidence, doi=u"10.123/abc"):
+    return Location(url, evidence, doi)
+
+
+def urls(locations):
+    return [location.best_fulltext_url for location in locations]
+
+
+class TestSortedLocations(unittest.TestCase):
+
+    def setUp(self):
+        self.repo_b = make_location(u"http://repo.example.edu/b.pdf", u"oa repository (via BASE title match)")
+        self.repo_a = make_location(u"http://repo.example.edu/a.pdf", u"oa repository (via BASE title match)")
+        self.hybrid = make_location(u"http://publisher.example.com/hybrid.pdf", u"open (via free pdf) hybrid")
+        self.publisher = make_location(u"http://publisher.example.com/free.pdf", u"open (via page says license) publisher")
+        self.gold = make_location(u"http://journal.example.org/gold.pdf", u"oa journal (via doaj)")
+        self.pub = LocationsPub(u"10.123/abc", [self.repo_b, self.hybrid, self.repo_a, self.gold, self.publisher])
+
+    def test_best_first_ties_by_url(self):
+        assert_equals(self.pub.sorted_locations,
+                      [self.gold, self.publisher, self.hybrid, self.repo_a, self.repo_b])
+
+    def test_colour_buckets_keep_the_order(self):
+        assert_equals(self.pub.gold_locations, [self.gold])
+        assert_equals(self.pub.green_locations, [self.publisher, self.repo_a, self.repo_b])
+        assert_equals(self.pub.blue_locations, [self.hybrid])
+
+    def test_reported_noncompliant_dropped(self):
+        doi = u"10.1016/j.tcb.2014.11.005"
+        noncompliant = make_location(u"https://figshare.com/articles/An_open_data_ecosystem_for_cell_migration_research_/1409475",
+                                     u"oa repository (via BASE doi match)", doi=doi)
+        fine = make_location(u"http://repo.example.edu/a.pdf", u"oa repository (via BASE doi match)", doi=doi)
+        pub = LocationsPub(doi, [noncompliant, fine])
+        assert_equals(pub.sorted_locations, [fine])
+        assert_equals(pub.green_locations, [fine])
+
+    def test_recomputed_when_locations_change(self):
+        assert_equals(len(self.pub.sorted_locations), 5)
+        better = make_location(u"http://journal.example.org/aaa.pdf", u"oa journal (via doaj)")
+        self.pub.open_locations.append(better)
+        assert_equals(self.pub.sorted_locations[0], better)
+        assert_equals(self.pub.gold_locations, [better, self.gold])
+
+        self.pub.open_locations = [self.repo_b]
+        assert_equals(self.pub.sorted_locations, [self.repo_b])
+        assert_equals(self.pub.gold_locations, [])
+
+    def test_decide_if_open_leaves_the_order_alone(self):
+        before = list(self.pub.sorted_locations)
+        self.pub.decide_if_open()
+        assert_equals(self.pub.fulltext_url, self.gold.pdf_url)
+        assert_equals(self.pub.oa_color, "gold")
+        self.pub.decide_if_open()
+        assert_equals(self.pub.fulltext_url, self.gold.pdf_url)
+        assert_equals(self.pub.sorted_locations, before)
+
+    def test_closed_when_no_locations(self):
+        pub = LocationsPub(u"10.123/abc", [])
+        pub.decide_if_open()
+        assert_equals(pub.fulltext_url, None)
+        assert_equals(pub.evidence, "closed")
+        assert_equals(urls(pub.sorted_locations), [])
+
+
+class TestReportedNoncompliant(unittest.TestCase):
+
+    def test_doi_and_url_case_dont_matter(self):
+        assert_equals(is_reported_noncompliant_url(u"10.1016/J.TCB.2014.11.005", u"HTTPS://DOI.ORG/10.6084/m9.figshare.1409475"), True)
+        assert_equals(is_reported_noncompliant_url(u"https://doi.org/10.1016/j.tcb.2014.11.005", u"http://doi.org/10.6084/M9.FIGSHARE.3114679"), True)
+
+    def test_other_urls_and_dois(self):
+        assert_equals(is_reported_noncompliant_url(u"10.1016/j.tcb.2014.11.005", u"http://repo.example.edu/a.pdf"), False)
+        assert_equals(is_reported_noncompliant_url(u"10.123/abc", u"http://doi.org/10.6084/m9.figshare.1409475"), False)
+        assert_equals(is_reported_noncompliant_url(None, u"http://doi.org/10.6084/m9.figshare.1409475"), False)
@@ -0,0 +1,240 @@
+import json
+import os
+import unittest
+from threading import Event
+from threading import Thread
+from time import sleep
+from time import time
+from nose.tools import assert_equals
+from nose.tools import assert_true
+
+import publication
+import views
+from app import app
+from single_flight import single_flight
+from util import NoDoiException
+
+
+class FakePub(object):
+    def __init__(self, doi):
+        self.doi = doi
+
+    def to_dict(self):
+        return {"doi": self.doi, "is_oa": False, "oa_color": None}
+
+
+# stands in for the db lookup, one pub per biblio like the real one
+def fake_get_pubs_from_biblio(biblios, run_with_hybrid=False):
+    for biblio in biblios:
+        if biblio["doi"].startswith("10.999/"):
+            raise NoDoiException
+    return [FakePub(biblio["doi"]) for biblio in biblios]
+
+
+class TestBulkEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.old_get_pubs_from_biblio = publication.get_pubs_from_biblio
+        publication.get_pubs_from_biblio = fake_get_pubs_from_biblio
+
+    def tearDown(self):
+        publication.get_pubs_from_biblio = self.old_get_pubs_from_biblio
+
+    def post_bulk(self, body):
+        return self.client.post("/v1/publications/bulk",
+                                data=json.dumps(body),
+                                content_type="application/json",
+                                headers={"X-Forwarded-Proto": "https"})
+
+    def response_lines(self, r):
+        return [json.loads(line) for line in r.data.splitlines()]
+
+    def test_one_line_per_doi_in_order(self):
+        r = self.post_bulk({"dois": ["10.123/a", "not a doi", "10.123/b"]})
+        assert_equals(r.status_code, 200)
+        lines = self.response_lines(r)
+        assert_equals([line["doi"] for line in lines], ["10.123/a", "not a doi", "10.123/b"])
+        assert_true(lines[1]["error"])
+
+    def test_items_that_arent_strings(self):
+        r = self.post_bulk({"dois": [123, None, {}, "10.123/a"]})
+        assert_equals(r.status_code, 200)
+        lines = self.response_lines(r)
+        assert_equals(len(lines), 4)
+        assert_equals([line.get("error", False) for line in lines], [True, True, True, False])
+        assert_equals(lines[3]["doi"], "10.123/a")
+
+    def test_dois_not_a_list(self):
+        r = self.post_bulk({"dois": "10.123/a"})
+        assert_equals(r.status_code, 400)
+
+    def test_one_bad_doi_doesnt_spoil_its_chunk(self):
+        r = self.post_bulk({"dois": ["10.123/a", "10.999/gone", "10.123/b"]})
+        lines = self.response_lines(r)
+        assert_equals([line.get("error", False) for line in lines], [False, True, False])
+
+    def test_to_dict_blowing_up_doesnt_end_the_stream(self):
+        def get_pubs_with_a_bad_one(biblios, run_with_hybrid=False):
+            pubs = fake_get_pubs_from_biblio(biblios)
+            pubs[1].to_dict = lambda: 1/0
+            return pubs
+        publication.get_pubs_from_biblio = get_pubs_with_a_bad_one
+        r = self.post_bulk({"dois": ["10.123/a", "10.123/b", "10.123/c"]})
+        lines = self.response_lines(r)
+        assert_equals([line["doi"] for line in lines], ["10.123/a", "10.123/b", "10.123/c"])
+        assert_equals([line.get("error", False) for line in lines], [False, True, False])
+
+
+# just enough of redis for the quota: the script's check-and-count, and decr
+class QuotaRedis(object):
+    def __init__(self):
+        self.counts = {}
+
+    def eval(self, script, num_keys, key, wanted, quota, expire_seconds):
+        used = self.counts.get(key, 0)
+        if used + wanted > quota:
+            return [0, used]
+        self.counts[key] = used + wanted
+        return [1, self.counts[key]]
+
+    def decr(self, key, amount=1):
+        self.counts[key] = self.counts.get(key, 0) - amount
+        return self.counts[key]
+
+
+class TestBulkQuota(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.old_get_pubs_from_biblio = publication.get_pubs_from_biblio
+        publication.get_pubs_from_biblio = fake_get_pubs_from_biblio
+        self.old_redis = views.redis_rq_conn
+        self.old_quota = views.BULK_DAILY_QUOTA
+        views.redis_rq_conn = QuotaRedis()
+        views.BULK_DAILY_QUOTA = 5
+
+    def tearDown(self):
+        publication.get_pubs_from_biblio = self.old_get_pubs_from_biblio
+        views.redis_rq_conn = self.old_redis
+        views.BULK_DAILY_QUOTA = self.old_quota
+
+    def used(self):
+        return sum(views.redis_rq_conn.counts.values())
+
+    def post(self, path, dois):
+        return self.client.post(path + "?email=me@example.com",
+                                data=json.dumps({"dois": dois}),
+                                content_type="application/json",
+                                headers={"X-Forwarded-Proto": "https"})
+
+    def test_turned_away_dois_arent_counted(self):
+        assert_equals(self.post("/v1/publications/bulk", ["10.123/a", "10.123/b", "10.123/c"]).status_code, 200)
+        r = self.post("/v1/publications/bulk", ["10.123/d", "10.123/e", "10.123/f"])
+        assert_equals(r.status_code, 429)
+        assert_equals(self.used(), 3)
+        assert_equals(self.post("/v1/publications/bulk", ["10.123/d", "10.123/e"]).status_code, 200)
+
+    def test_hanging_up_refunds_what_wasnt_sent(self):
+        views.BULK_DAILY_QUOTA = 1000
+        dois = [u"10.123/{}".format(i) for i in range(250)]
+        r = self.post("/v1/publications/bulk", dois)
+        lines = r.response
+        for i in range(10):
+            next(lines)
+        r.close()
+        assert_equals(self.used(), 10)
+
+    def test_doi_lists_use_the_quota(self):
+        r = self.post("/v1/publications", ["10.123/a", "10.123/b"])
+        assert_equals(r.status_code, 200)
+        assert_equals(self.used(), 2)
+        r = self.post("/v1/publications", ["10.123/c", "10.123/d", "10.123/e", "10.123/f"])
+        assert_equals(r.status_code, 429)
+
+
+class TestDoiEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.old_get_precomputed_response = publication.get_precomputed_response
+        self.old_get_pub_from_biblio = publication.get_pub_from_biblio
+        publication.get_precomputed_response = lambda doi: None
+        self.release = Event()
+        self.lookups = []
+
+    def tearDown(self):
+        publication.get_precomputed_response = self.old_get_precomputed_response
+        publication.get_pub_from_biblio = self.old_get_pub_from_biblio
+
+    def slow_missing_doi(self, biblio, run_with_hybrid=False, skip_all_hybrid=False):
+        self.lookups.append(biblio["doi"])
+        self.release.wait(5)
+        raise NoDoiException
+
+    def get(self, path, status_codes):
+        r = self.client.get(path, headers={"X-Forwarded-Proto": "https"})
+        status_codes.append((r.status_code, json.loads(r.data)["HTTP_status_code"]))
+
+    def test_coalesced_requests_each_get_their_own_404(self):
+        publication.get_pub_from_biblio = self.slow_missing_doi
+        status_codes = []
+        threads = [Thread(target=self.get, args=("/10.123/nothing-here", status_codes)) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        give_up_time = time() + 5
+        while single_flight.stats()["in_flight"] < 1 and time() < give_up_time:
+            sleep(0.01)
+        sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        assert_equals(status_codes, [(404, 404)] * 5)
+        assert_equals(len(self.lookups), 1)
+
+    def test_missing_doi_is_a_result_not_an_abort(self):
+        # an abort would carry one response object into every coalesced request
+        publication.get_pub_from_biblio = self.slow_missing_doi
+        self.release.set()
+        with app.test_request_context("/10.123/nothing-here"):
+            assert_equals(views.calculate_doi_response("10.123/nothing-here", False), (None, None))
+
+    def test_hybrid_isnt_answered_from_the_cache(self):
+        publication.get_pub_from_biblio = lambda biblio, run_with_hybrid=False, skip_all_hybrid=False: FakePub(biblio["doi"])
+        old_cached = views.get_cached_response
+        views.get_cached_response = lambda doi, hybrid=False: {"doi": doi, "is_oa": False, "oa_color": None}
+        try:
+            r = self.client.get("/10.123/abc", headers={"X-Forwarded-Proto": "https"})
+            assert_equals(r.headers["X-Response-Source"], "cache")
+            r = self.client.get("/10.123/abc?hybrid", headers={"X-Forwarded-Proto": "https"})
+            assert_equals(r.headers["X-Response-Source"], "refreshed")
+        finally:
+            views.get_cached_response = old_cached
+
+
+class TestAdminStats(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.old_key = os.environ.get("HEROKU_API_KEY", None)
+        os.environ["HEROKU_API_KEY"] = "sekrit"
+
+    def tearDown(self):
+        if self.old_key is None:
+            os.environ.pop("HEROKU_API_KEY", None)
+        else:
+            os.environ["HEROKU_API_KEY"] = self.old_key
+
+    def get(self, path):
+        return self.client.get(path, headers={"X-Forwarded-Proto": "https"})
+
+    def test_needs_the_key(self):
+        assert_equals(self.get("/admin/stats").status_code, 403)
+        assert_equals(self.get("/admin/stats?key=wrong").status_code, 403)
+        r = self.get("/admin/stats?key=sekrit")
+        assert_equals(r.status_code, 200)
+        assert_true("circuit_breaker" in json.loads(r.data))
+
+    def test_no_key_set_means_nobody(self):
+        os.environ.pop("HEROKU_API_KEY")
+        assert_equals(self.get("/admin/stats?key=").status_code, 403)
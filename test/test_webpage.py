@@ -0,0 +1,53 @@
+import os
+import unittest
+from nose.tools import assert_equals
+
+import http_cache
+from host_scheduler import host_scheduler
+from host_scheduler import HostBucket
+from webpage import Webpage
+from local_server import LocalServer
+
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def get_fixture(file_name):
+    with open(os.path.join(fixtures_dir, file_name), "rb") as fh:
+        return fh.read()
+
+
+class FakePub(object):
+    def __init__(self, doi):
+        self.doi = doi
+        self.tdm_api = None
+        self.publisher = None
+
+    def is_same_publisher(self, publisher):
+        return False
+
+
+class TestScrapeLandingPage(unittest.TestCase):
+
+    def setUp(self):
+        host_scheduler.buckets["127.0.0.1"] = HostBucket(1000, 1000)
+        self.server = LocalServer({
+            "/two-licenses": (200, {"Content-Type": "text/html"}, get_fixture("two_licenses.html")),
+            "/article.pdf": (200, {"Content-Type": "application/pdf"}, "%PDF-1.4 the article")
+        }).start()
+        # small chunks, so the pdf link turns up before the footer has downloaded
+        self.old_chunk_bytes = http_cache.BODY_CHUNK_BYTES
+        http_cache.BODY_CHUNK_BYTES = 256
+
+    def tearDown(self):
+        http_cache.BODY_CHUNK_BYTES = self.old_chunk_bytes
+        self.server.stop()
+
+    def test_best_license_on_the_page_wins(self):
+        # cc-by in a meta tag up top, cc-by-nc-nd in the footer.
+        # the whole page says cc-by-nc-nd, so the pdf link turning up first mustn't change that.
+        page = get_fixture("two_licenses.html")
+        assert_equals(page.index("creativecommons.org") > 256, True)
+        webpage = Webpage(url=self.server.url("/two-licenses"), related_pub=FakePub("10.123/abc"))
+        webpage.scrape_landing_page()
+        assert_equals(webpage.scraped_pdf_url, self.server.url("/article.pdf"))
+        assert_equals(webpage.scraped_license, "cc-by-nc-nd")
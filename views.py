@@ -6,6 +6,8 @@ from flask import render_template
 from flask import jsonify
 from flask import g
 from flask import url_for
+from flask import Response
+from flask import stream_with_context
 
 import json
 import os
@@ -17,6 +19,7 @@ from datetime import datetime
 from app import app
 from app import db
 from app import logger
+from app import redis_rq_conn
 
 import publication
 from gs import get_gs_cache
@@ -25,6 +28,22 @@ from util import NoDoiException
 from util import safe_commit
 from util import restart_dyno
 from util import elapsed
+from util import clean_doi
+from util import chunks
+from response_cache import get_cached_response
+from response_cache import peek_cached_response
+from response_cache import RESPONSE_CACHE_ENABLED
+from response_cache import set_cached_response
+from response_cache import response_cache
+from single_flight import single_flight
+from log_shipper import log_shipper
+from http_cache import get_connection_stats
+from http_cache import get_revalidation_stats
+from fetch_engine import fetch_engine
+from host_scheduler import host_scheduler
+from circuit_breaker import circuit_breaker
+from crawlera_sessions import crawlera_session_pool
+from pdf_probe import pdf_probe
 
 
 
@@ -71,8 +90,6 @@ def log_request(resp):
     if request.endpoint != "get_doi_endpoint":
         return
 
-    logging_start_time = time()
-
     try:
         results = json.loads(resp.get_data())["results"][0]
     except (ValueError, RuntimeError, KeyError):
@@ -94,15 +111,8 @@ def log_request(resp):
         "oa_color": oa_color
     }
 
-    h = {
-        "content-type": "text/json",
-        "X-Forwarded-For": get_ip()
-    }
-
-    url = "http://logs-01.loggly.com/inputs/6470410b-1d7f-4cb2-a625-72d8fa867d61/tag/{}/".format(
-        oa_color)
-    requests.post(url, headers=h, data=json.dumps(body))
-    # logger.info(u"log_request took {} seconds".format(elapsed(logging_start_time, 2)))
+    # sent from a background thread, so this request doesn't wait on loggly
+    log_shipper.ship(oa_color, body)
 
 
 @app.after_request
@@ -173,8 +183,6 @@ def get_multiple_pubs_response():
     if "dois" in body:
         if len(body["dois"]) > 25:
             abort_json(413, "max number of DOIs is 25")
-        if len(body["dois"]) > 1:
-            is_person_who_is_making_too_many_requests = True
         for doi in body["dois"]:
             biblios += [{"doi": doi}]
             if u"jama" in doi:
@@ -184,9 +192,6 @@ def get_multiple_pubs_response():
         for biblio in body["biblios"]:
             biblios += [biblio]
 
-        if len(body["biblios"]) > 1:
-            is_person_who_is_making_too_many_requests = True
-
     logger.info(u"in get_multiple_pubs_response with {}".format(biblios))
 
 
@@ -194,28 +199,98 @@ def get_multiple_pubs_response():
     if is_person_who_is_making_too_many_requests:
         logger.info(u"is_person_who_is_making_too_many_requests, so returning 429")
         abort_json(429, u"sorry, you are calling us too quickly.  Please email team@impactstory.org so we can figure out a good way to get you the data you are looking for.")
+
+    # lists count against the same daily quota as the bulk endpoint
+    if len(biblios) > 1:
+        quota_key = get_bulk_quota_key()
+        if use_bulk_quota(get_bulk_quota_redis_key(quota_key), len(biblios)) < 0:
+            logger.info(u"{} is over their bulk quota, so returning 429".format(quota_key))
+            abort_json(429, u"sorry, that would take you over your daily quota of {} DOIs.  Please email team@impactstory.org if you need more.".format(BULK_DAILY_QUOTA))
     pubs = publication.get_pubs_from_biblio(biblios, run_with_hybrid)
     return pubs
 
 
-def get_pub_from_doi(doi):
-    run_with_hybrid = g.hybrid
-    skip_all_hybrid = "skip_all_hybrid" in request.args
+# None if there's no such doi.  this runs inside single_flight, so it mustn't abort:
+# the abort's response object would be raised again in every waiting request.
+def get_pub_from_doi(doi, run_with_hybrid, skip_all_hybrid):
     try:
         my_pub = publication.get_pub_from_biblio({"doi": doi},
                                                  run_with_hybrid=run_with_hybrid,
                                                  skip_all_hybrid=skip_all_hybrid
                                                  )
     except NoDoiException:
-        abort_json(404, u"'{}' is an invalid doi.  See http://doi.org/{}".format(doi, doi))
+        return None
     return my_pub
 
 
+# the X-Response-Source header says which path served the request
+def get_doi_response(doi):
+    try:
+        doi = clean_doi(doi)
+    except NoDoiException:
+        abort_json(404, u"'{}' is an invalid doi.  See http://doi.org/{}".format(doi, doi))
+
+    # ?hybrid asks for a live scrape, so it doesn't get answered from the cache
+    hybrid = g.hybrid
+    use_response_cache = RESPONSE_CACHE_ENABLED and not hybrid
+
+    if use_response_cache:
+        cached_response = get_cached_response(doi)
+        if cached_response:
+            resp = jsonify({"results": [cached_response]})
+            resp.headers["X-Response-Source"] = "cache"
+            return resp
+
+    # when lots of requests come in for the same doi at once, only one does the work
+    skip_all_hybrid = "skip_all_hybrid" in request.args
+    calculate_response = lambda: calculate_doi_response(doi, hybrid, skip_all_hybrid)
+    def check_cache():
+        cached_response = peek_cached_response(doi)
+        if cached_response:
+            return (cached_response, "coalesced")
+        return None
+    if not use_response_cache:
+        # other processes' results only show up through the cache, so just coalesce within this one
+        check_cache = None
+    single_flight_key = u"{}:{}".format("hybrid" if hybrid else "plain", doi)
+    (response, response_source) = single_flight.do(single_flight_key, calculate_response, check_cache)
+    if response is None:
+        abort_json(404, u"'{}' is an invalid doi.  See http://doi.org/{}".format(doi, doi))
+
+    resp = jsonify({"results": [response]})
+    resp.headers["X-Response-Source"] = response_source
+    return resp
+
+
+# (response, where it came from), or (None, None) if there's no such doi
+def calculate_doi_response(doi, hybrid, skip_all_hybrid=False):
+    response = None
+    if not hybrid:
+        response = publication.get_precomputed_response(doi)
+        if response:
+            response_source = "precomputed"
+
+    if not response:
+        my_pub = get_pub_from_doi(doi, hybrid, skip_all_hybrid)
+        if not my_pub:
+            return (None, None)
+        response = my_pub.to_dict()
+        if hybrid:
+            response_source = "refreshed"
+        else:
+            response_source = "recalculated"
+
+    # cache it before we let go of the single flight lock, so waiters can find it.
+    # hybrid responses aren't read from the cache, so there's no point keeping them.
+    if not hybrid:
+        set_cached_response(doi, False, response)
+    return (response, response_source)
+
+
 @app.route("/v1/publication/doi/<path:doi>", methods=["GET"])
 @app.route("/v1/publication/doi.json/<path:doi>", methods=["GET"])
 def get_from_new_doi_endpoint(doi):
-    my_pub = get_pub_from_doi(doi)
-    return jsonify({"results": [my_pub.to_dict()]})
+    return get_doi_response(doi)
 
 
 def get_ip():
@@ -250,6 +325,211 @@ def new_post_publications_endpoint():
 
 
 
+# bulk endpoint for big lists of dois.
+# takes {"dois": [...]} as json, or dois one per line as the request body or an uploaded file.
+# streams back one json object per line (ndjson) as each chunk of dois is looked up,
+# so the client starts getting results right away.
+# no live hybrid scraping here, just what we have in the db.
+BULK_MAX_DOIS = int(os.getenv("BULK_MAX_DOIS", 10000))
+BULK_DAILY_QUOTA = int(os.getenv("BULK_DAILY_QUOTA", 100000))
+BULK_CHUNK_SIZE = 100
+
+def get_bulk_dois():
+    if request.files:
+        uploaded_file = request.files.values()[0]
+        lines = uploaded_file.read().splitlines()
+    elif request.json and "dois" in request.json:
+        lines = request.json["dois"]
+        if not isinstance(lines, list):
+            abort_json(400, "dois should be a list")
+    else:
+        lines = request.get_data().splitlines()
+
+    # anything in a json list that isn't a string gets an error line of its own,
+    # so it's kept (as None) in its place
+    dois = []
+    for line in lines:
+        if not isinstance(line, basestring):
+            dois.append(None)
+        elif line.strip():
+            dois.append(line.strip())
+    return dois
+
+
+def get_bulk_quota_key():
+    email = request.args.get("email", None)
+    if email:
+        return email.lower()
+    return get_ip()
+
+
+# counts the dois against today's quota only if they all fit, in one step in redis,
+# so a failure partway can't charge anyone for dois they were turned away for.
+# returns [1 if counted, how many used now]
+use_bulk_quota_script = """
+local used = tonumber(redis.call("get", KEYS[1]) or "0")
+local wanted = tonumber(ARGV[1])
+if used + wanted > tonumber(ARGV[2]) then
+    return {0, used}
+end
+used = redis.call("incrby", KEYS[1], wanted)
+redis.call("expire", KEYS[1], ARGV[3])
+return {1, used}
+"""
+
+def get_bulk_quota_redis_key(quota_key):
+    return u"bulk_quota:{}:{}".format(quota_key, datetime.utcnow().strftime("%Y-%m-%d"))
+
+
+# returns how many dois this key has left today, after counting these ones.
+# less than zero means they didn't fit, and weren't counted.
+def use_bulk_quota(redis_key, num_dois):
+    try:
+        (counted, used) = redis_rq_conn.eval(use_bulk_quota_script, 1, redis_key, num_dois, BULK_DAILY_QUOTA, 60*60*48)
+    except Exception as e:
+        # don't turn people away because redis is having a bad day
+        logger.info(u"couldn't check bulk quota for {}: {}".format(redis_key, e))
+        return BULK_DAILY_QUOTA - num_dois
+    if not counted:
+        return BULK_DAILY_QUOTA - used - num_dois
+    return BULK_DAILY_QUOTA - used
+
+
+# gives back the dois we were paid for but never sent, like when the client hangs up
+def refund_bulk_quota(redis_key, num_dois):
+    try:
+        redis_rq_conn.decr(redis_key, num_dois)
+    except Exception as e:
+        logger.info(u"couldn't refund bulk quota for {}: {}".format(redis_key, e))
+
+
+def bulk_response_line_for_one(biblio):
+    try:
+        return publication.get_pubs_from_biblio([biblio])[0].to_dict()
+    except NoDoiException:
+        return {"doi": biblio["doi"], "error": True, "message": u"'{}' is an invalid doi".format(biblio["doi"])}
+    except Exception as e:
+        logger.exception(u"exception looking up {} in bulk".format(biblio["doi"]))
+        return {"doi": biblio["doi"], "error": True, "message": u"something went wrong looking up this doi"}
+
+
+# by now the 200 has gone out, so a pub whose to_dict blows up gets an error line
+# rather than cutting the stream off
+def bulk_response_line_for_pub(biblio, my_pub):
+    try:
+        return my_pub.to_dict()
+    except Exception as e:
+        logger.exception(u"exception in to_dict for {} in bulk".format(biblio["doi"]))
+        return {"doi": biblio["doi"], "error": True, "message": u"something went wrong looking up this doi"}
+
+
+def bulk_response_lines(dois, quota_redis_key=None):
+    num_sent = 0
+    try:
+        for doi_chunk in chunks(dois, BULK_CHUNK_SIZE):
+            biblios = []
+            for doi in doi_chunk:
+                biblio = None
+                if doi is not None:
+                    try:
+                        biblio = {"doi": clean_doi(doi)}
+                    except NoDoiException:
+                        pass
+                biblios.append(biblio)
+
+            chunk_failed = False
+            try:
+                pubs = publication.get_pubs_from_biblio([biblio for biblio in biblios if biblio])
+            except NoDoiException:
+                # one doi we won't look up spoils the chunk, so do this chunk one at a time
+                pubs = None
+            except Exception as e:
+                logger.exception(u"exception looking up bulk chunk")
+                pubs = None
+                chunk_failed = True
+
+            # pubs come back in the same order as the valid biblios
+            pubs_iter = iter(pubs or [])
+            for (doi, biblio) in zip(doi_chunk, biblios):
+                if doi is None:
+                    line = {"doi": None, "error": True, "message": u"dois should be strings"}
+                elif not biblio:
+                    line = {"doi": doi, "error": True, "message": u"'{}' is an invalid doi".format(doi)}
+                elif chunk_failed:
+                    line = {"doi": biblio["doi"], "error": True, "message": u"something went wrong looking up this doi"}
+                elif pubs is None:
+                    line = bulk_response_line_for_one(biblio)
+                else:
+                    line = bulk_response_line_for_pub(biblio, next(pubs_iter))
+                num_sent += 1
+                yield json.dumps(line, sort_keys=True) + "\n"
+
+            # don't hold the db connection while the client reads
+            db.session.remove()
+    finally:
+        db.session.remove()
+        if quota_redis_key and num_sent < len(dois):
+            refund_bulk_quota(quota_redis_key, len(dois) - num_sent)
+
+
+@app.route("/v1/publications/bulk", methods=["POST"])
+def bulk_publications_endpoint():
+    print_ip()
+    dois = get_bulk_dois()
+    if not dois:
+        abort_json(400, "no dois found.  send {\"dois\": [...]} as json, or one doi per line.")
+    if len(dois) > BULK_MAX_DOIS:
+        abort_json(413, u"max number of DOIs is {}".format(BULK_MAX_DOIS))
+
+    quota_key = get_bulk_quota_key()
+    quota_redis_key = get_bulk_quota_redis_key(quota_key)
+    quota_remaining = use_bulk_quota(quota_redis_key, len(dois))
+    if quota_remaining < 0:
+        logger.info(u"{} is over their bulk quota, so returning 429".format(quota_key))
+        abort_json(429, u"sorry, that would take you over your daily quota of {} DOIs.  Please email team@impactstory.org if you need more.".format(BULK_DAILY_QUOTA))
+
+    logger.info(u"in bulk_publications_endpoint with {} dois for {}".format(len(dois), quota_key))
+
+    # flask_compress doesn't compress this mimetype, so it won't buffer the stream
+    # dois we don't get to send, because the client hung up, go back on the quota
+    resp = Response(stream_with_context(bulk_response_lines(dois, quota_redis_key)), mimetype="application/x-ndjson")
+    resp.headers["X-Quota-Remaining"] = str(quota_remaining)
+    return resp
+
+
+
+# admin endpoints need the heroku api key as one of the query args
+def is_admin_request():
+    admin_key = os.getenv("HEROKU_API_KEY")
+    if not admin_key:
+        return False
+    for (k, v) in request.args.iteritems():
+        if v == admin_key:
+            return True
+    return False
+
+
+# hit and miss counts for the response cache, for this worker and summed over all of them.
+# the rest are just for the worker that answers.
+@app.route("/admin/stats", methods=["GET"])
+def admin_stats_endpoint():
+    if not is_admin_request():
+        abort_json(403, "not allowed, didn't send the right api key")
+    return jsonify({
+        "response_cache": response_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "log_shipper": log_shipper.stats(),
+        "http_connections": get_connection_stats(),
+        "page_cache_revalidation": get_revalidation_stats(),
+        "fetch_engine": fetch_engine.stats(),
+        "pdf_probe": pdf_probe.stats(),
+        "hosts": host_scheduler.stats(),
+        "circuit_breaker": circuit_breaker.stats(),
+        "crawlera_sessions": crawlera_session_pool.stats()
+    })
+
+
+
 # this endpoint is undocumented for public use, and we don't really use it
 # in production either.
 # it's just for testing the POST biblio endpoint.
@@ -307,8 +587,7 @@ def base_endpoint():
 @app.route("/<path:doi>", methods=["GET"])
 def get_doi_endpoint(doi):
     # the GET api endpoint (returns json data)
-    my_pub = get_pub_from_doi(doi)
-    return jsonify({"results": [my_pub.to_dict()]})
+    return get_doi_response(doi)
 
 
 @app.route("/gs/cache/<path:doi>", methods=["GET"])
@@ -330,11 +609,7 @@ def post_gs_cache_endpoint():
 @app.route("/admin/restart", methods=["POST"])
 def restart_endpoint():
     logger.info(u"in restart endpoint")
-    allowed_to_reboot = False
-    for (k, v) in request.args.iteritems():
-        if v==os.getenv("HEROKU_API_KEY"):
-            allowed_to_reboot = True
-    if not allowed_to_reboot:
+    if not is_admin_request():
         logger.info(u"not allowed to reboot in restart_endpoint")
         return jsonify({
             "response": "not allowed to reboot, didn't send right heroku api key"
@@ -6,6 +6,7 @@ import os
 import requests
 from requests.auth import HTTPProxyAuth
 import re
+import copy
 from time import time
 from lxml import html
 from lxml import etree
@@ -15,18 +16,43 @@ from app import logger
 from oa_local import find_normalized_license
 from open_location import OpenLocation
 from http_cache import http_get
+from http_cache import PROXY_DIRECT
+from http_cache import PROXY_CRAWLERA
 from util import is_doi_url
 from util import elapsed
-from util import get_tree
 from util import get_link_target
 from util import normalize
 from http_cache import is_response_too_large
+from http_cache import read_bounded_content
+from http_cache import content_is_pdf
+from http_cache import scan_content
+from http_cache import get_scrape_outcome
+from http_cache import store_scrape_outcome
+from publisher_rules import publisher_rules
+from fetch_engine import fetch_engine
+from pdf_probe import pdf_probe
+from pdf_probe import headers_say_pdf
 
 DEBUG_SCRAPING = False
 
+# look for a pdf link while landing pages download, and once one checks out, read the
+# rest of the page only for its license, without parsing it or checking other links.
+SCRAPE_EARLY_EXIT = os.getenv("SCRAPE_EARLY_EXIT", "True") == "True"
+
+# how many of a page's best-looking pdf links to check, all at once.
+# scrapes usually run on fetch_engine already, so the checks go to its nested pool.
+PDF_CANDIDATES_TO_CHECK = int(os.getenv("PDF_CANDIDATES_TO_CHECK", 3))
+
+# "probe" checks pdf links with a HEAD and then a ranged GET before falling back to
+# a full GET (see pdf_probe.py).  "get" always does the full GET.
+PDF_CHECK_MODE = os.getenv("PDF_CHECK_MODE", "probe")
+
 
 
 class Webpage(object):
+    # what a scrape of the landing page decides, kept so an unchanged page needn't be scraped again
+    scrape_outcome_fields = ["scraped_pdf_url", "scraped_open_metadata_url", "scraped_license"]
+
     def __init__(self, **kwargs):
         self.url = None
         self.scraped_pdf_url = None
@@ -50,8 +76,8 @@ class Webpage(object):
 
     # sometimes overriden, for publisherwebpage
     @property
-    def use_proxy(self):
-        return False
+    def proxy_profile(self):
+        return PROXY_DIRECT
 
     @property
     def publisher(self):
@@ -102,6 +128,28 @@ class Webpage(object):
         return my_location
 
     def scrape_for_fulltext_link(self):
+        self.landing_page_response = None
+        error_before = self.error
+        response = self.scrape_landing_page()
+        if self.landing_page_response is not None and self.error == error_before:
+            outcome = dict([(field, getattr(self, field)) for field in self.scrape_outcome_fields])
+            store_scrape_outcome(self.__class__.__name__, self.url, self.landing_page_response, outcome)
+        return response
+
+    # true if the landing page hasn't changed since we last scraped it,
+    # in which case we've set what we found then
+    def use_previous_scrape_outcome(self, r):
+        outcome = get_scrape_outcome(self.__class__.__name__, self.url, r)
+        if outcome is None:
+            self.landing_page_response = r
+            return False
+        if DEBUG_SCRAPING:
+            logger.info(u"landing page unchanged, using what we found last time [{}]".format(self.url))
+        for field in self.scrape_outcome_fields:
+            setattr(self, field, outcome.get(field, None))
+        return True
+
+    def scrape_landing_page(self):
         url = self.url
         check_if_links_accessible = True
 
@@ -130,12 +178,15 @@ class Webpage(object):
                 return
 
         try:
-            with closing(http_get(url, stream=True, related_pub=self.related_pub, use_proxy=self.use_proxy)) as r:
+            with closing(http_get(url, stream=True, related_pub=self.related_pub, proxy_profile=self.proxy_profile)) as r:
 
                 if r.status_code != 200:
                     self.error += u"ERROR: status_code={} on {} in scrape_for_fulltext_link".format(r.status_code, url)
                     return
 
+                if self.use_previous_scrape_outcome(r):
+                    return
+
                 # if our url redirects to a pdf, we're done.
                 # = open repo http://hdl.handle.net/2060/20140010374
                 if self.is_a_pdf_page(r):
@@ -148,42 +199,70 @@ class Webpage(object):
                     if DEBUG_SCRAPING:
                         logger.info(u"is not a PDF for {}.  continuing more checks".format(url))
 
+                # most pages with a pdf link have it in a meta tag or a script near the top.
+                # look for it while the page downloads.  if it checks out, the rest of the page
+                # is only read for the license: find_normalized_license picks the best one
+                # on the whole page, and a better one than the head's can be in the footer.
+                scanner = None
+                early_pdf_url = None
+                if SCRAPE_EARLY_EXIT:
+                    scanner = StreamingPageScanner()
+                    if scan_content(r, scanner.feed):
+                        early_link = scanner.pdf_link
+                        if DEBUG_SCRAPING:
+                            logger.info(u"found {} after reading {} bytes, checking it [{}]".format(
+                                early_link.anchor, scanner.num_bytes, url))
+                        if self.gets_a_pdf(early_link, r.url):
+                            early_pdf_url = get_link_target(early_link.href, r.url)
+
                 # now before reading the content, bail it too large
-                if is_response_too_large(r):
+                page = None
+                if not is_response_too_large(r):
+                    page = read_bounded_content(r)
+                if page is None:
                     logger.info(u"landing page is too large, skipping")
+                    if early_pdf_url:
+                        self.scraped_pdf_url = early_pdf_url
+                        self.scraped_open_metadata_url = url
                     return
 
-                # get the HTML tree
-                page = r.content
-
                 # set the license if we can find one
                 scraped_license = find_normalized_license(page)
                 if scraped_license:
                     self.scraped_license = scraped_license
 
-                pdf_download_link = self.find_pdf_link(page)
+                if early_pdf_url:
+                    # we only read on for the license
+                    self.scraped_pdf_url = early_pdf_url
+                    self.scraped_open_metadata_url = url
+                    return
+
+                # get the HTML tree
+                if scanner:
+                    parsed_page = scanner.finish(page)
+                else:
+                    parsed_page = ParsedPage(page)
+
+                if check_if_links_accessible:
+                    # if they are linking to a PDF, we need to follow the link to make sure it's legit
+                    skip_hrefs = []
+                    if scanner and scanner.pdf_link:
+                        # already checked it above, and it isn't a pdf
+                        skip_hrefs = [scanner.pdf_link.href]
+                    pdf_download_link = self.find_verified_pdf_link(parsed_page, r.url, skip_hrefs=skip_hrefs)
+                else:
+                    pdf_download_link = self.find_pdf_link(parsed_page)
                 if pdf_download_link is not None:
                     if DEBUG_SCRAPING:
                         logger.info(u"found a PDF download link: {} {} [{}]".format(
                             pdf_download_link.href, pdf_download_link.anchor, url))
-
-                    pdf_url = get_link_target(pdf_download_link.href, r.url)
-                    if check_if_links_accessible:
-                        # if they are linking to a PDF, we need to follow the link to make sure it's legit
-                        if DEBUG_SCRAPING:
-                            logger.info(u"checking to see the PDF link actually gets a PDF [{}]".format(url))
-                        if self.gets_a_pdf(pdf_download_link, r.url):
-                            self.scraped_pdf_url = pdf_url
-                            self.scraped_open_metadata_url = url
-                            return
-                    else:
-                        self.scraped_pdf_url = pdf_url
-                        self.scraped_open_metadata_url = url
-                        return
+                    self.scraped_pdf_url = get_link_target(pdf_download_link.href, r.url)
+                    self.scraped_open_metadata_url = url
+                    return
 
                 # try this later because would rather get a pdfs
                 # if they are linking to a .docx or similar, this is open.
-                doc_link = find_doc_download_link(page)
+                doc_link = find_doc_download_link(parsed_page)
                 if doc_link is not None:
                     if DEBUG_SCRAPING:
                         logger.info(u"found a .doc download link {} [{}]".format(
@@ -225,26 +304,30 @@ class Webpage(object):
                     r.request.url))
             return True
 
-        # everything below here needs to look at the content
-        # so bail here if the page is too big
-        if is_response_too_large(r):
+        # pdfs start with %PDF whatever the headers say.
+        # this only reads the first chunk, so it's cheap even on a huge file.
+        if content_is_pdf(r):
             if DEBUG_SCRAPING:
-                logger.info(u"response is too big for more checks in gets_a_pdf")
-            return False
+                logger.info(u"content starts like a PDF {}".format(r.url))
+            return True
 
         if self.related_pub:
+            # see data/publisher_rules.json
+            says_free_patterns = publisher_rules.for_publisher("says_free_pdf", self.publisher)
+            if says_free_patterns:
+                # this needs to look at the whole content
+                # so bail here if the page is too big
+                page = None
+                if not is_response_too_large(r):
+                    page = read_bounded_content(r)
+                if page is None:
+                    if DEBUG_SCRAPING:
+                        logger.info(u"response is too big for more checks in gets_a_pdf")
+                    return False
 
-            says_free_publisher_patterns = [
-                    ("Wiley-Blackwell", u'<span class="freeAccess" title="You have free access to this content">'),
-                    ("Wiley-Blackwell", u'<iframe id="pdfDocument"'),
-                    ("JSTOR", ur'<li class="download-pdf-button">.*Download PDF.*</li>'),
-                    ("Institute of Electrical and Electronics Engineers (IEEE)", ur'<frame src="http://ieeexplore.ieee.org/.*?pdf.*?</frameset>'),
-                    ("IOP Publishing", ur'Full Refereed Journal Article')
-                        ]
-            for (publisher, pattern) in says_free_publisher_patterns:
-                matches = re.findall(pattern, r.content, re.IGNORECASE | re.DOTALL)
-                if self.related_pub.is_same_publisher(publisher) and matches:
-                    return True
+                for pattern in says_free_patterns:
+                    if pattern.search(page):
+                        return True
         return False
 
 
@@ -259,7 +342,21 @@ class Webpage(object):
     
         start = time()
         try:
-            with closing(http_get(absolute_url, stream=True, related_pub=self.related_pub, use_proxy=self.use_proxy)) as r:
+            if PDF_CHECK_MODE == "probe":
+                # publishers with pdf viewer pages need the whole page to rule it out
+                can_rule_out = not (self.related_pub and publisher_rules.for_publisher("says_free_pdf", self.publisher))
+                (is_pdf, status_code) = pdf_probe.check(absolute_url,
+                                                        related_pub=self.related_pub,
+                                                        proxy_profile=self.proxy_profile,
+                                                        can_rule_out=can_rule_out)
+                if is_pdf is not None:
+                    if not is_pdf and status_code not in (200, 206):
+                        self.error += u"ERROR: status_code={} on {} in gets_a_pdf".format(status_code, absolute_url)
+                    if DEBUG_SCRAPING:
+                        logger.info(u"probed {}, pdf is {}. took {} seconds".format(absolute_url, is_pdf, elapsed(start)))
+                    return is_pdf
+
+            with closing(http_get(absolute_url, stream=True, related_pub=self.related_pub, proxy_profile=self.proxy_profile)) as r:
 
                 if r.status_code != 200:
                     self.error += u"ERROR: status_code={} on {} in gets_a_pdf".format(r.status_code, absolute_url)
@@ -290,10 +387,14 @@ class Webpage(object):
         return False
 
 
-    def find_pdf_link(self, page):
+    # every link on the page that might be the pdf, best first, as (score, link).
+    # the scores keep the order we've always trusted these signals in; ties stay in page order.
+    def rank_pdf_links(self, parsed_page):
 
         if DEBUG_SCRAPING:
-            logger.info(u"in find_pdf_link in {}".format(self.url))
+            logger.info(u"in rank_pdf_links in {}".format(self.url))
+
+        candidates = []
 
         # before looking in links, look in meta for the pdf link
         # = open journal http://onlinelibrary.wiley.com/doi/10.1111/j.1461-0248.2011.01645.x/abstract
@@ -303,19 +404,22 @@ class Webpage(object):
 
         # logger.info(page)
 
-        link = get_pdf_in_meta(page)
+        link = get_pdf_in_meta(parsed_page)
         if link:
-            return link
+            candidates.append((100, link))
 
-        link = get_pdf_from_javascript(page)
+        link = get_pdf_from_javascript(parsed_page.content)
         if link:
-            return link
+            candidates.append((90, link))
 
+        # want "full text" to match for this one https://doi.org/10.2298/SGS0603181L
+        # but not this one: 10.1097/00003643-201406001-00238
+        full_text_means_pdf = self.related_pub and not self.related_pub.is_same_publisher("Ovid Technologies (Wolters Kluwer Health)")
 
-        for link in get_useful_links(page):
+        for link in get_useful_links(parsed_page):
 
             if DEBUG_SCRAPING:
-                logger.info(u"trying {}, {} in find_pdf_link".format(link.href, link.anchor))
+                logger.info(u"trying {}, {} in rank_pdf_links".format(link.href, link.anchor))
 
             # there are some links that are SURELY NOT the pdf for this article
             if has_bad_anchor_word(link.anchor):
@@ -325,55 +429,88 @@ class Webpage(object):
             if has_bad_href_word(link.href):
                 continue
 
+            score = 0
 
             # download link ANCHOR text is something like "manuscript.pdf" or like "PDF (1 MB)"
             # = open repo http://hdl.handle.net/1893/372
             # = open repo https://research-repository.st-andrews.ac.uk/handle/10023/7421
             # = open repo http://dro.dur.ac.uk/1241/
             if link.anchor and "pdf" in link.anchor.lower():
-                return link
+                score = 50
 
             # button says download
             # = open repo https://works.bepress.com/ethan_white/45/
             # = open repo http://ro.uow.edu.au/aiimpapers/269/
             # = open repo http://eprints.whiterose.ac.uk/77866/
-            if "download" in link.anchor:
-                if "citation" in link.anchor:
-                    pass
-                else:
-                    return link
-
-            if "download" in link.anchor:
-                if "citation" in link.anchor:
-                    pass
-                else:
-                    return link
+            elif "download" in link.anchor and "citation" not in link.anchor:
+                score = 40
 
-            # want it to match for this one https://doi.org/10.2298/SGS0603181L
-            # but not this one: 10.1097/00003643-201406001-00238
-            if self.related_pub and not self.related_pub.is_same_publisher("Ovid Technologies (Wolters Kluwer Health)"):
-                if link.anchor and "full text" in link.anchor.lower():
-                    return link
+            elif full_text_means_pdf and link.anchor and "full text" in link.anchor.lower():
+                score = 30
 
             # download link is identified with an image
-            for img in link.findall("img"):
-                try:
-                    if "pdf" in img.attrib["src"].lower():
-                        return link
-                except KeyError:
-                    pass  # no src attr
+            elif [img for img in link.findall("img") if "pdf" in img.attrib.get("src", "").lower()]:
+                score = 20
 
-            try:
-                if "pdf" in link.attrib["title"].lower():
-                    return link
-            except KeyError:
-                pass
+            elif "pdf" in link.attrib.get("title", "").lower():
+                score = 10
+
+            if score:
+                # all else being equal, a link that looks like a pdf file
+                if link.href.lower().split("?")[0].endswith(".pdf"):
+                    score += 5
+                candidates.append((score, link))
 
+        # sorted is stable, so equal scores keep their order on the page
+        return sorted(candidates, key=lambda candidate: candidate[0], reverse=True)
 
 
+    def find_pdf_link(self, parsed_page):
+        candidates = self.rank_pdf_links(parsed_page)
+        if candidates:
+            return candidates[0][1]
         return None
 
 
+    # checks the top PDF_CANDIDATES_TO_CHECK candidate links at the same time, and
+    # returns the best-ranked one that really is a pdf, or None
+    def find_verified_pdf_link(self, parsed_page, base_url, skip_hrefs=None):
+        candidates = []
+        seen_urls = set([get_link_target(href, base_url) for href in (skip_hrefs or [])])
+        for (score, link) in self.rank_pdf_links(parsed_page):
+            pdf_url = get_link_target(link.href, base_url)
+            if pdf_url in seen_urls or is_purchase_link(link):
+                continue
+            seen_urls.add(pdf_url)
+            candidates.append(link)
+            if len(candidates) >= PDF_CANDIDATES_TO_CHECK:
+                break
+        if not candidates:
+            return None
+
+        if DEBUG_SCRAPING:
+            logger.info(u"checking {} candidate pdf links at once [{}]".format(len(candidates), self.url))
+
+        tasks = fetch_engine.map(self.check_pdf_candidate, [[link, base_url] for link in candidates])
+        verified_link = None
+        for (link, task) in zip(candidates, tasks):
+            if task.error:
+                self.error += u"ERROR: {} checking {} in find_verified_pdf_link".format(task.error, link.href)
+                continue
+            (is_pdf, error) = task.result
+            self.error += error
+            if is_pdf and verified_link is None:
+                verified_link = link
+        return verified_link
+
+    # gets_a_pdf on a copy of this webpage, so checks running at the same time
+    # don't trip over each other adding to self.error
+    def check_pdf_candidate(self, link, base_url):
+        checker = copy.copy(self)
+        checker.error = u""
+        is_pdf = checker.gets_a_pdf(link, base_url)
+        return (is_pdf, checker.error)
+
 
     def __repr__(self):
         return u"<{} ({}) {}>".format(self.__class__.__name__, self.url, self.is_open)
@@ -390,12 +527,13 @@ class OpenPublisherWebpage(Webpage):
 
 class PublisherWebpage(Webpage):
     open_version_source_string = u"publisher landing page"
+    scrape_outcome_fields = Webpage.scrape_outcome_fields + ["open_version_source_string"]
     
     @property
-    def use_proxy(self):
-        return True
+    def proxy_profile(self):
+        return PROXY_CRAWLERA
 
-    def scrape_for_fulltext_link(self):
+    def scrape_landing_page(self):
         landing_url = self.url
 
         if DEBUG_SCRAPING:
@@ -403,7 +541,7 @@ class PublisherWebpage(Webpage):
 
         start = time()
         try:
-            with closing(http_get(landing_url, stream=True, related_pub=self.related_pub, use_proxy=self.use_proxy)) as r:
+            with closing(http_get(landing_url, stream=True, related_pub=self.related_pub, proxy_profile=self.proxy_profile)) as r:
 
                 if r.status_code != 200:
                     self.error += u"ERROR: status_code={} on {} in scrape_for_fulltext_link, skipping.".format(r.status_code, r.url)
@@ -411,6 +549,9 @@ class PublisherWebpage(Webpage):
                     logger.debug(r.request.headers)
                     return
 
+                if self.use_previous_scrape_outcome(r):
+                    return self.is_open
+
                 # if our landing_url redirects to a pdf, we're done.
                 # = open repo http://hdl.handle.net/2060/20140010374
                 if self.is_a_pdf_page(r):
@@ -425,23 +566,27 @@ class PublisherWebpage(Webpage):
                     if DEBUG_SCRAPING:
                         logger.info(u"landing page is not a PDF for {}.  continuing more checks".format(landing_url))
 
+                # now before reading the content, bail it too large
+                page = None
+                if not is_response_too_large(r):
+                    page = read_bounded_content(r)
+                if page is None:
+                    logger.info(u"landing page is too large, skipping")
+                    return False
+
                 # get the HTML tree
-                page = r.content
+                parsed_page = ParsedPage(page)
 
                 # set the license if we can find one
                 scraped_license = find_normalized_license(page)
                 if scraped_license:
                     self.scraped_license = scraped_license
 
-                page = r.content
-
-                pdf_download_link = self.find_pdf_link(page)
+                pdf_download_link = self.find_verified_pdf_link(parsed_page, r.url)
                 if pdf_download_link is not None:
-                    pdf_url = get_link_target(pdf_download_link.href, r.url)
-                    if self.gets_a_pdf(pdf_download_link, r.url):
-                        self.scraped_pdf_url = pdf_url
-                        self.scraped_open_metadata_url = self.url
-                        self.open_version_source_string = "hybrid (via free pdf)"
+                    self.scraped_pdf_url = get_link_target(pdf_download_link.href, r.url)
+                    self.scraped_open_metadata_url = self.url
+                    self.open_version_source_string = "hybrid (via free pdf)"
 
                 # now look and see if it is not just free, but open!
                 license_patterns = [u"(creativecommons.org\/licenses\/[a-z\-]+)",
@@ -457,25 +602,14 @@ class PublisherWebpage(Webpage):
                         self.scraped_open_metadata_url = self.url
                         self.open_version_source_string = "hybrid (via page says license)"
 
-                says_open_url_snippet_patterns = [("projecteuclid.org/", u'<strong>Full-text: Open access</strong>'),
-                            ]
-                for (url_snippet, pattern) in says_open_url_snippet_patterns:
-                    matches = re.findall(pattern, r.content, re.IGNORECASE)
-                    if url_snippet in r.request.url.lower() and matches:
+                # see data/publisher_rules.json
+                for pattern in publisher_rules.for_url("says_open_access_at_url", r.request.url):
+                    if pattern.search(page):
                         self.scraped_open_metadata_url = r.request.url
                         self.open_version_source_string = "hybrid (via page says Open Access)"
 
-                says_open_access_patterns = [("Informa UK Limited", u"/accessOA.png"),
-                            ("Oxford University Press (OUP)", u"<i class='icon-availability_open'"),
-                            ("Institute of Electrical and Electronics Engineers (IEEE)", ur'"isOpenAccess":true'),
-                            ("Institute of Electrical and Electronics Engineers (IEEE)", ur'"openAccessFlag":"yes"'),
-                            ("Informa UK Limited", u"/accessOA.png"),
-                            ("Royal Society of Chemistry (RSC)", u"/open_access_blue.png"),
-                            ("Cambridge University Press (CUP)", u'<span class="icon access open-access cursorDefault">'),
-                            ]
-                for (publisher, pattern) in says_open_access_patterns:
-                    matches = re.findall(pattern, page, re.IGNORECASE | re.DOTALL)
-                    if self.is_same_publisher(publisher) and matches:
+                for pattern in publisher_rules.for_publisher("says_open_access", self.publisher):
+                    if pattern.search(page):
                         self.scraped_license = None  # could get it by following landing_url but out of scope for now
                         self.scraped_open_metadata_url = landing_url
                         self.open_version_source_string = "hybrid (via page says Open Access)"
@@ -552,8 +686,8 @@ class WebpageInUnknownRepo(WebpageInRepo):
 
 
 
-def find_doc_download_link(page):
-    for link in get_useful_links(page):
+def find_doc_download_link(parsed_page):
+    for link in get_useful_links(parsed_page):
         # there are some links that are FOR SURE not the download for this article
         if has_bad_href_word(link.href):
             continue
@@ -571,20 +705,7 @@ def find_doc_download_link(page):
 # it matters this is just using the header, because we call it even if the content
 # is too large.  if we start looking in content, need to break the pieces apart.
 def resp_is_pdf_from_header(resp):
-    looks_good = False
-
-    for k, v in resp.headers.iteritems():
-        if v:
-            key = k.lower()
-            val = v.lower()
-
-            if key == "content-type" and "application/pdf" in val:
-                looks_good = True
-
-            if key =='content-disposition' and "pdf" in val:
-                looks_good = True
-
-    return looks_good
+    return headers_say_pdf(resp.headers)
 
 
 class DuckLink(object):
@@ -593,49 +714,173 @@ class DuckLink(object):
         self.anchor = anchor
 
 
-def get_useful_links(page):
-    links = []
+# one landing page, parsed once and shared by all the heuristics that look at it.
+# the tree, the meta tags and the useful links are each worked out the first time
+# something asks for them.
+class ParsedPage(object):
+    def __init__(self, content, tree=None):
+        self.content = content
+        self.num_parses = 0
+        self.tree_is_parsed = tree is not None
+        self.parsed_tree = tree
+        self.found_meta_tags = None
+        self.found_links = None
 
-    tree = get_tree(page)
-    if tree is None:
-        return []
+    @property
+    def tree(self):
+        if not self.tree_is_parsed:
+            self.tree_is_parsed = True
+            self.num_parses += 1
+            try:
+                self.parsed_tree = html.fromstring(self.content)
+            except (etree.XMLSyntaxError, etree.ParserError) as e:
+                logger.info(u"not parsing, because {} in ParsedPage: {}".format(e.__class__.__name__, e))
+                self.parsed_tree = None
+        return self.parsed_tree
 
-    # remove related content sections
+    # the attributes of each <meta> tag
+    @property
+    def meta_tags(self):
+        if self.found_meta_tags is None:
+            if self.tree is None:
+                self.found_meta_tags = []
+            else:
+                self.found_meta_tags = [dict(meta.attrib) for meta in self.tree.xpath("//meta")]
+        return self.found_meta_tags
 
-    # references and related content sections
-    bad_section_finders = [
-        "//div[@class=\'relatedItem\']",  #http://www.tandfonline.com/doi/abs/10.4161/auto.19496
-        "//div[@class=\'citedBySection\']"  #10.3171/jns.1966.25.4.0458
-    ]
-    for section_finder in bad_section_finders:
-        for bad_section in tree.xpath(section_finder):
-            bad_section.clear()
+    @property
+    def links(self):
+        if self.found_links is None:
+            self.found_links = self.find_useful_links()
+        return self.found_links
+
+    def find_useful_links(self):
+        links = []
+
+        # this clears parts of the tree, so get the meta tags first
+        self.meta_tags
+        tree = self.tree
+        if tree is None:
+            return []
+
+        # remove related content sections
+
+        # references and related content sections
+        bad_section_finders = [
+            "//div[@class=\'relatedItem\']",  #http://www.tandfonline.com/doi/abs/10.4161/auto.19496
+            "//div[@class=\'citedBySection\']"  #10.3171/jns.1966.25.4.0458
+        ]
+        for section_finder in bad_section_finders:
+            for bad_section in tree.xpath(section_finder):
+                bad_section.clear()
+
+        # now get the links
+        link_elements = tree.xpath("//a")
+
+        for link in link_elements:
+            # &nbsp; comes through as \xa0, make it a plain space like the anchors used to have
+            link_text = link.text_content().replace(u"\xa0", u" ").strip().lower()
+            if link_text:
+                link.anchor = link_text
+                if "href" in link.attrib:
+                    link.href = link.attrib["href"]
 
-    # now get the links
-    link_elements = tree.xpath("//a")
+            else:
+                # also a useful link if it has a solo image in it, and that image includes "pdf" in its filename
+                link_content_elements = [l for l in link]
+                if len(link_content_elements)==1:
+                    link_insides = link_content_elements[0]
+                    if link_insides.tag=="img":
+                        if "src" in link_insides.attrib and "pdf" in link_insides.attrib["src"]:
+                            link.anchor = u"image: {}".format(link_insides.attrib["src"])
+                            if "href" in link.attrib:
+                                link.href = link.attrib["href"]
+
+            if hasattr(link, "anchor") and hasattr(link, "href"):
+                links.append(link)
+
+        return links
+
+
+def get_useful_links(parsed_page):
+    return parsed_page.links
+
+
+# parses a page as it downloads, watching for a citation_pdf_url meta tag or a
+# "pdfUrl" in a script -- what find_pdf_link would pick first.
+# feed() returns True once the rest of the page can't change that: as soon as there's
+# a meta tag, or there's a pdfUrl and the <head> is over without one.
+# if we read the whole page after all, finish() hands back a ParsedPage with the tree
+# built so far, so it isn't parsed twice.
+class StreamingPageScanner(object):
+    pdf_url_in_javascript = re.compile('"pdfUrl":"(.*?)"')
+
+    def __init__(self):
+        self.parser = etree.HTMLPullParser(events=("start",))
+        self.parser.set_element_class_lookup(html.HtmlElementClassLookup())
+        self.chunks = []
+        self.num_bytes = 0
+        self.num_bytes_fed = 0
+        self.javascript_link = None
+        self.meta_link = None
+        self.head_is_over = False
+        self.parser_failed = False
 
-    for link in link_elements:
-        link_text = link.text_content().strip().lower()
-        if link_text:
-            link.anchor = link_text
-            if "href" in link.attrib:
-                link.href = link.attrib["href"]
+    @property
+    def pdf_link(self):
+        if self.meta_link:
+            return self.meta_link
+        if self.javascript_link and self.head_is_over:
+            return self.javascript_link
+        return None
 
-        else:
-            # also a useful link if it has a solo image in it, and that image includes "pdf" in its filename
-            link_content_elements = [l for l in link]
-            if len(link_content_elements)==1:
-                link_insides = link_content_elements[0]
-                if link_insides.tag=="img":
-                    if "src" in link_insides.attrib and "pdf" in link_insides.attrib["src"]:
-                        link.anchor = u"image: {}".format(link_insides.attrib["src"])
-                        if "href" in link.attrib:
-                            link.href = link.attrib["href"]
+    def content(self):
+        if len(self.chunks) > 1:
+            self.chunks = ["".join(self.chunks)]
+        if self.chunks:
+            return self.chunks[0]
+        return ""
+
+    def feed(self, chunk):
+        # keep a little of the last chunk, in case the pdfUrl is split between them
+        overlap = self.chunks[-1][-1000:] if self.chunks else ""
+        self.chunks.append(chunk)
+        self.num_bytes += len(chunk)
+
+        if not self.javascript_link:
+            matches = self.pdf_url_in_javascript.findall(overlap + chunk)
+            if matches:
+                self.javascript_link = DuckLink(href=matches[0], anchor="pdfUrl")
 
-        if hasattr(link, "anchor") and hasattr(link, "href"):
-            links.append(link)
+        self.feed_parser(chunk)
+        return self.pdf_link is not None
 
-    return links
+    def feed_parser(self, chunk):
+        if self.parser_failed:
+            return
+        try:
+            self.parser.feed(chunk)
+            self.num_bytes_fed += len(chunk)
+            for (event, element) in self.parser.read_events():
+                tag = element.tag
+                if tag == "meta" and not self.meta_link:
+                    if element.attrib.get("name", None) == "citation_pdf_url" and "content" in element.attrib:
+                        self.meta_link = DuckLink(href=element.attrib["content"], anchor="<meta citation_pdf_url>")
+                elif tag == "body":
+                    self.head_is_over = True
+        except (etree.XMLSyntaxError, etree.ParserError) as e:
+            logger.info(u"StreamingPageScanner couldn't parse, leaving it to ParsedPage: {}".format(e))
+            self.parser_failed = True
+
+    def finish(self, page):
+        self.feed_parser(page[self.num_bytes_fed:])
+        tree = None
+        if not self.parser_failed:
+            try:
+                tree = self.parser.close()
+            except (etree.XMLSyntaxError, etree.ParserError):
+                tree = None
+        return ParsedPage(page, tree=tree)
 
 
 def is_purchase_link(link):
@@ -740,24 +985,22 @@ def has_bad_anchor_word(anchor_text):
     return False
 
 
-def get_pdf_in_meta(page):
-    if "citation_pdf_url" in page:
+def get_pdf_in_meta(parsed_page):
+    if "citation_pdf_url" in parsed_page.content:
         if DEBUG_SCRAPING:
             logger.info(u"citation_pdf_url in page")
 
-        tree = get_tree(page)
-        if tree is not None:
-            metas = tree.xpath("//meta")
-            for meta in metas:
-                if "name" in meta.attrib:
-                    if meta.attrib["name"]=="citation_pdf_url":
-                        if "content" in meta.attrib:
-                            link = DuckLink(href=meta.attrib["content"], anchor="<meta citation_pdf_url>")
+        if parsed_page.tree is not None:
+            for meta in parsed_page.meta_tags:
+                if "name" in meta:
+                    if meta["name"]=="citation_pdf_url":
+                        if "content" in meta:
+                            link = DuckLink(href=meta["content"], anchor="<meta citation_pdf_url>")
                             return link
         else:
             # backup if tree fails
             regex = r'<meta name="citation_pdf_url" content="(.*?)">'
-            matches = re.findall(regex, page)
+            matches = re.findall(regex, parsed_page.content)
             if matches:
                 link = DuckLink(href=matches[0], anchor="<meta citation_pdf_url>")
                 return link